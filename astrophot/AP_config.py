@@ -2,9 +2,11 @@ import sys
 import logging
 import torch
 
-__all__ = ["ap_dtype", "ap_device", "ap_logger", "set_logging_output"]
+__all__ = ["ap_dtype", "ap_device", "ap_precision_mode", "ap_logger", "set_logging_output"]
 
 ap_dtype = torch.float64
+# full evaluates models with ap_dtype, mixed evaluates model brightness and psf convolution in float32 while results are accumulated with ap_dtype
+ap_precision_mode = "full"
 ap_device = "cuda:0" if torch.cuda.is_available() else "cpu"
 ap_verbose = 0
 
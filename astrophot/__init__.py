@@ -1,7 +1,7 @@
 import argparse
 import requests
 import torch
-from .parse_config import galfit_config, basic_config
+from .parse_config import galfit_config, basic_config, batch_fit
 from . import models, image, plots, utils, fit, param, AP_config
 
 try:
@@ -26,13 +26,15 @@ def run_from_terminal() -> None:
     This function uses the `argparse` module to parse command line arguments and execute the appropriate functionality.
     It accepts the following arguments:
 
-    - `filename`: the path to the configuration file. Or just 'tutorial' to download tutorials.
+    - `filename`: the path to the configuration file. Or just 'tutorial' to download tutorials, or 'batch' to fit a manifest of objects.
+    - `manifest`: the path to the manifest file when running `astrophot batch manifest.yaml`, see `batch_fit`.
     - `--config`: the type of configuration file being provided. One of: astrophot, galfit.
     - `-v`, `--version`: print the current AstroPhot version to screen.
     - `--log`: set the log file name for AstroPhot. Use 'none' to suppress the log file.
     - `-q`: quiet flag to stop command line output, only print to log file.
     - `--dtype`: set the float point precision. Must be one of: float64, float32.
     - `--device`: set the device for AstroPhot to use for computations. Must be one of: cpu, gpu.
+    - `--output`, `--workers`, `--threads`, `--no-resume`: options for batch mode, see `batch_fit`.
 
     If the `filename` argument is not provided, it raises a `RuntimeError`.
     If the `filename` argument is `tutorial` or `tutorials`,
@@ -56,7 +58,13 @@ def run_from_terminal() -> None:
         "filename",
         nargs="?",
         metavar="configfile",
-        help="the path to the configuration file. Or just 'tutorial' to download tutorials.",
+        help="the path to the configuration file. Or just 'tutorial' to download tutorials, or 'batch' to fit a manifest.",
+    )
+    parser.add_argument(
+        "manifest",
+        nargs="?",
+        metavar="manifest",
+        help="the path to the batch manifest file, only used as: astrophot batch manifest.yaml",
     )
     parser.add_argument(
         "--config",
@@ -99,6 +107,32 @@ def run_from_terminal() -> None:
         help="set the device for AstroPhot to use for computations. Must be one of: cpu, gpu",
     )
 
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="AstroPhot_batch.hdf5",
+        metavar="results.hdf5",
+        help="batch mode: the HDF5 file where per object results are written.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="batch mode: number of worker processes used to fit objects in parallel.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        metavar="N",
+        help="batch mode: number of torch threads per worker. Default is cpu count / workers.",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="batch mode: overwrite the output file instead of skipping objects already fit.",
+    )
+
     args = parser.parse_args()
 
     if args.log is not None:
@@ -141,6 +175,18 @@ def run_from_terminal() -> None:
                 )
 
         AP_config.ap_logger.info("collected the tutorials")
+    elif args.filename == "batch":
+        if args.manifest is None:
+            raise RuntimeError(
+                "Please pass a manifest file for batch mode. See 'astrophot --help' for more information."
+            )
+        batch_fit(
+            args.manifest,
+            output=args.output,
+            workers=args.workers,
+            threads_per_worker=args.threads,
+            resume=not args.no_resume,
+        )
     elif args.config == "astrophot":
         basic_config(args.filename)
     elif args.config == "galfit":
@@ -1,5 +1,6 @@
 from .base import *
 from .lm import *
+from .lm_cg import *
 from .oldlm import *
 from .gradient import *
 from .iterative import *
@@ -11,6 +12,9 @@ try:
 except AssertionError as e:
     print("Could not load HMC or NUTS due to:", str(e))
 from .mhmcmc import *
+from .ensemble import *
+from .hamiltonian import *
+from .laplace import *
 
 """
 base: This module defines the base class BaseOptimizer,
@@ -0,0 +1,277 @@
+# Affine invariant ensemble Markov-Chain Monte-Carlo
+import os
+from typing import Optional, Sequence
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from .base import BaseOptimizer
+from .. import AP_config
+from ..errors import SpecificationConflict
+from ..utils.decorators import profiled
+
+__all__ = ["Ensemble"]
+
+
+class Ensemble(BaseOptimizer):
+    """Affine invariant ensemble sampler using the stretch move of
+    Goodman & Weare (2010), as popularized by emcee. The walkers are
+    split into two halves, every walker in one half proposes a move
+    along the line to a random walker of the other half, so all the
+    proposals of a half ensemble can be evaluated together. The
+    likelihood of a half ensemble is evaluated with
+    ``negative_log_likelihood_vectors``, which samples the model for
+    all the walkers in one vectorized call when the model allows it.
+
+    The chain is written into an array of shape (nsamples, nwalkers,
+    nparameters) which is allocated at the start of the fit, or into a
+    memory mapped ``.npy`` file if `chain_file` is given so that long
+    chains need not fit in memory. Every `check_every` steps the
+    integrated autocorrelation time is estimated, sampling stops early
+    once the chain is longer than `tau_factor` autocorrelation times
+    and the estimate has changed by less than `tau_tolerance`. The
+    number of recorded steps is kept in `nsteps`, on an early stop the
+    chain (and the `chain_file`) is shortened to these steps.
+
+    Args:
+      model (AstroPhot_Model): The model which will be sampled.
+      initial_state (Optional[Sequence]): A 1D array with the values for each parameter in the model. Note that these values should be in the form of "as_representation" in the model. The walkers start in a small ball around this state.
+      max_iter (int): The maximum number of ensemble steps. Default 1000
+      nwalkers (int): Number of walkers, must be even and larger than the number of parameters. Default 2 * nparameters + 2
+      initial_walkers (Optional[Sequence]): A (nwalkers, nparameters) array of starting states in representation space, overrides `initial_state`.
+      initial_scatter (float): Standard deviation of the ball of starting walkers around `initial_state`. Default 1e-3
+      stretch (float): Scale parameter of the stretch move. Default 2
+      chain_file (Optional[str]): Write the chain to a memory mapped ``.npy`` file at this path instead of memory.
+      check_every (int): Number of steps between autocorrelation checks, 0 disables early stopping. Default 100
+      tau_factor (float): Chain length in autocorrelation times needed to stop early. Default 50
+      tau_tolerance (float): Relative change in the autocorrelation time between checks needed to stop early. Default 0.01
+
+    """
+
+    def __init__(
+        self,
+        model: "AstroPhot_Model",
+        initial_state: Optional[Sequence] = None,
+        max_iter: int = 1000,
+        **kwargs,
+    ):
+        super().__init__(model, initial_state, max_iter=max_iter, **kwargs)
+
+        nparams = len(self.current_state)
+        self.nwalkers = kwargs.get("nwalkers", 2 * nparams + 2)
+        if self.nwalkers % 2 != 0 or self.nwalkers <= nparams:
+            raise SpecificationConflict(
+                f"Ensemble needs an even number of walkers larger than the number of parameters ({nparams}), not {self.nwalkers}"
+            )
+        self.stretch = kwargs.get("stretch", 2.0)
+        self.chain_file = kwargs.get("chain_file", None)
+        self.check_every = kwargs.get("check_every", 100)
+        self.tau_factor = kwargs.get("tau_factor", 50)
+        self.tau_tolerance = kwargs.get("tau_tolerance", 0.01)
+        self.progress_bar = kwargs.get("progress_bar", True)
+
+        initial_walkers = kwargs.get("initial_walkers", None)
+        if initial_walkers is None:
+            self.walkers = self.current_state + kwargs.get("initial_scatter", 1e-3) * torch.randn(
+                (self.nwalkers, nparams), dtype=AP_config.ap_dtype, device=AP_config.ap_device
+            )
+        else:
+            self.walkers = torch.as_tensor(
+                initial_walkers, dtype=AP_config.ap_dtype, device=AP_config.ap_device
+            )
+        self.log_prob = None
+
+        self.chain = None
+        self.log_prob_chain = None
+        self.nsteps = 0
+        self.tau = None
+        self._accepted = np.zeros(self.nwalkers)
+        self._sampled = 0
+
+    @torch.no_grad()
+    def sample(self, states: torch.Tensor) -> torch.Tensor:
+        """
+        Log posterior (negative of the negative log likelihood) of a batch of representation state vectors
+        """
+        return -self.model.negative_log_likelihood_vectors(states, as_representation=True)
+
+    @torch.no_grad()
+    @profiled("step")
+    def step(self, walkers: torch.Tensor, log_prob: torch.Tensor):
+        """
+        Updates both halves of the ensemble with one stretch move each
+        """
+        walkers = walkers.clone()
+        log_prob = log_prob.clone()
+        half = self.nwalkers // 2
+        nparams = walkers.shape[1]
+        for active, other in (
+            (slice(0, half), slice(half, None)),
+            (slice(half, None), slice(0, half)),
+        ):
+            z = (
+                (self.stretch - 1) * torch.rand(half, dtype=walkers.dtype, device=walkers.device)
+                + 1
+            ) ** 2 / self.stretch
+            partners = walkers[other][torch.randint(half, (half,), device=walkers.device)]
+            proposal = partners + z.unsqueeze(1) * (walkers[active] - partners)
+            proposal_log_prob = self.sample(proposal)
+            log_alpha = (nparams - 1) * torch.log(z) + proposal_log_prob - log_prob[active]
+            accept = (
+                torch.log(torch.rand(half, dtype=walkers.dtype, device=walkers.device)) < log_alpha
+            )
+            walkers[active] = torch.where(accept.unsqueeze(1), proposal, walkers[active])
+            log_prob[active] = torch.where(accept, proposal_log_prob, log_prob[active])
+            self._accepted[active] += accept.cpu().numpy()
+        self._sampled += 1
+        return walkers, log_prob
+
+    def _values(self, walkers: torch.Tensor) -> np.ndarray:
+        return (
+            torch.stack(list(self.model.parameters.vector_transform_rep_to_val(w) for w in walkers))
+            .detach()
+            .cpu()
+            .numpy()
+        )
+
+    def _allocate_chain(self, nsamples: int, nparams: int):
+        shape = (nsamples, self.nwalkers, nparams)
+        if self.chain_file is None:
+            return np.empty(shape)
+        return np.lib.format.open_memmap(self.chain_file, mode="w+", dtype=np.float64, shape=shape)
+
+    def _truncate_chain(self, nsteps: int):
+        """Shorten the chain to its first `nsteps` steps. A memory mapped
+        chain is copied a block at a time into a new file of the right
+        shape which then replaces `chain_file`, so that the file on disk
+        holds only the recorded steps.
+
+        """
+        if not isinstance(self.chain, np.memmap):
+            return self.chain[:nsteps]
+        self.chain.flush()
+        if nsteps == self.chain.shape[0]:
+            return self.chain
+        partial = f"{self.chain_file}.partial"
+        chain = np.lib.format.open_memmap(
+            partial, mode="w+", dtype=self.chain.dtype, shape=(nsteps,) + self.chain.shape[1:]
+        )
+        block = 1000
+        for start in range(0, nsteps, block):
+            stop = min(start + block, nsteps)
+            chain[start:stop] = self.chain[start:stop]
+        chain.flush()
+        del chain
+        self.chain = None
+        os.replace(partial, self.chain_file)
+        return np.load(self.chain_file, mmap_mode="r+")
+
+    @profiled("fit")
+    def fit(
+        self,
+        walkers: Optional[torch.Tensor] = None,
+        nsamples: Optional[int] = None,
+    ):
+        """
+        Runs the ensemble sampler, recording the state of every walker in `chain` after each step
+        """
+
+        if nsamples is None:
+            nsamples = self.max_iter
+        if walkers is not None:
+            self.walkers = torch.as_tensor(
+                walkers, dtype=AP_config.ap_dtype, device=AP_config.ap_device
+            )
+        if self.log_prob is None or walkers is not None:
+            self.log_prob = self.sample(self.walkers)
+
+        self.chain = self._allocate_chain(nsamples, self.walkers.shape[1])
+        self.log_prob_chain = np.empty((nsamples, self.nwalkers))
+        self._accepted = np.zeros(self.nwalkers)
+        self._sampled = 0
+        self.tau = None
+
+        walkers, log_prob = self.walkers, self.log_prob
+        iterator = tqdm(range(nsamples)) if self.progress_bar else range(nsamples)
+        nsteps = nsamples
+        for i in iterator:
+            walkers, log_prob = self.step(walkers, log_prob)
+            self.chain[i] = self._values(walkers)
+            self.log_prob_chain[i] = log_prob.detach().cpu().numpy()
+            if self.check_every > 0 and (i + 1) % self.check_every == 0:
+                tau = self.autocorrelation_time(self.chain[: i + 1])
+                if self.verbose > 0:
+                    AP_config.ap_logger.info(
+                        f"step {i + 1}, acceptance: {np.mean(self.acceptance):.3f}, max tau: {np.max(tau):.1f}"
+                    )
+                converged = (
+                    self.tau is not None
+                    and (i + 1) > self.tau_factor * np.max(tau)
+                    and np.all(np.abs(self.tau - tau) < self.tau_tolerance * tau)
+                )
+                self.tau = tau
+                if converged:
+                    nsteps = i + 1
+                    self.message = (
+                        f"success: chain longer than {self.tau_factor} autocorrelation times"
+                    )
+                    break
+        else:
+            self.message = (
+                "fail: maximum number of steps reached before autocorrelation convergence"
+            )
+
+        self.nsteps = nsteps
+        self.chain = self._truncate_chain(nsteps)
+        self.log_prob_chain = self.log_prob_chain[:nsteps]
+        self.walkers, self.log_prob = walkers, log_prob
+        self.current_state = walkers[torch.argmax(log_prob)]
+        self.model.parameters.vector_set_representation(self.current_state)
+        if self.verbose > 0:
+            AP_config.ap_logger.info(f"{self.message}, acceptance: {np.mean(self.acceptance):.3f}")
+        return self
+
+    @staticmethod
+    def autocorrelation_time(chain: np.ndarray, window_factor: float = 5.0) -> np.ndarray:
+        """Integrated autocorrelation time of each parameter for a chain
+        of shape (nsteps, nwalkers, nparameters). The autocorrelation
+        function is computed with an FFT and averaged over the
+        walkers, the sum is truncated with the automatic window of
+        Sokal (1997) at `window_factor` autocorrelation times.
+
+        """
+        chain = np.asarray(chain)
+        nsteps = chain.shape[0]
+        n = 1 << int(np.ceil(np.log2(2 * nsteps)))
+        x = chain - np.mean(chain, axis=0)
+        f = np.fft.rfft(x, n=n, axis=0)
+        acf = np.fft.irfft(f * np.conjugate(f), axis=0)[:nsteps]
+        acf = np.mean(acf, axis=1)
+        constant = np.all(np.ptp(chain, axis=0) == 0, axis=0)
+        acf = acf / np.where(constant, 1, acf[0])
+        taus = 2.0 * np.cumsum(acf, axis=0) - 1.0
+        tau = np.empty(chain.shape[2])
+        for p in range(chain.shape[2]):
+            window = np.arange(nsteps) < window_factor * taus[:, p]
+            M = np.argmin(window) if not np.all(window) else nsteps - 1
+            tau[p] = taus[M, p]
+        # Anti-correlated chains can give a negative estimate, limit the
+        # effective sample size to nsteps * log10(nsteps) as in Stan
+        tau = np.maximum(tau, 1 / np.log10(max(nsteps, 10)))
+        # A parameter which never changed has no meaningful autocorrelation time
+        tau[constant] = np.inf
+        return tau
+
+    def effective_sample_size(self) -> np.ndarray:
+        """
+        Effective number of independent samples of each parameter in the chain
+        """
+        return self.chain.shape[0] * self.nwalkers / self.autocorrelation_time(self.chain)
+
+    @property
+    def acceptance(self) -> np.ndarray:
+        """
+        Returns the fraction of accepted proposals for each walker.
+        """
+        return self._accepted / max(self._sampled, 1)
@@ -6,6 +6,7 @@ import numpy as np
 
 from .base import BaseOptimizer
 from .. import AP_config
+from ..utils.decorators import profiled
 
 __all__ = ["Grad"]
 
@@ -87,6 +88,7 @@ class Grad(BaseOptimizer):
             loss = torch.sum((Ym - Yt) ** 2 / W) / ndf
         return loss
 
+    @profiled("step")
     def step(self) -> None:
         """Take a single gradient step. Take a single gradient step.
 
@@ -115,6 +117,7 @@ class Grad(BaseOptimizer):
                 AP_config.ap_logger.info(f"gradient: {self.current_state.grad}")
         self.optimizer.step()
 
+    @profiled("fit")
     def fit(self) -> "BaseOptimizer":
         """
         Perform an iterative fit of the model parameters using the specified optimizer.
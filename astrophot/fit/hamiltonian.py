@@ -0,0 +1,523 @@
+# Hamiltonian Monte-Carlo and No U-Turn Sampler on the flat parameter vector
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from .base import BaseOptimizer
+from .ensemble import Ensemble
+from .. import AP_config
+from ..errors import SpecificationConflict
+from ..image import Window_List
+from ..models import Component_Model, Group_Model
+from ..param import Parameter_Node
+from ..utils.decorators import profiled
+
+__all__ = ["Native_HMC", "Native_NUTS"]
+
+
+class _DualAveraging:
+    """Step size adaptation of Hoffman & Gelman (2014), tunes the step
+    size so that the average acceptance statistic reaches `target`.
+
+    """
+
+    def __init__(self, epsilon, target, gamma=0.05, t0=10, kappa=0.75):
+        self.mu = np.log(10 * epsilon)
+        self.target = target
+        self.gamma = gamma
+        self.t0 = t0
+        self.kappa = kappa
+        self.t = 0
+        self.H_bar = 0.0
+        self.log_epsilon_bar = 0.0
+
+    def update(self, accept_stat):
+        self.t += 1
+        w = 1.0 / (self.t + self.t0)
+        self.H_bar = (1 - w) * self.H_bar + w * (self.target - accept_stat)
+        log_epsilon = self.mu - np.sqrt(self.t) / self.gamma * self.H_bar
+        eta = self.t ** (-self.kappa)
+        self.log_epsilon_bar = eta * log_epsilon + (1 - eta) * self.log_epsilon_bar
+        return float(np.exp(log_epsilon))
+
+    @property
+    def epsilon(self):
+        return float(np.exp(self.log_epsilon_bar))
+
+
+class Native_HMC(BaseOptimizer):
+    """Hamiltonian Monte-Carlo sampler which works directly on the flat
+    representation vector of the model parameters, see:
+    https://arxiv.org/abs/1701.02434 . Unlike the ``HMC`` wrapper for
+    Pyro, the potential is a pure function of the representation
+    vector, the parameter DAG is neither walked nor updated during
+    sampling (see ``potential``), and the gradient at
+    the end of each leapfrog step is reused to start the next one (and
+    the next trajectory) so every step costs exactly one gradient
+    evaluation.
+
+    The inverse mass matrix may be dense. Pass a fitted ``LM``
+    optimizer as `inv_mass` to seed it from ``LM.covariance_matrix``,
+    otherwise it is adapted from the samples in the middle half of the
+    warmup. The step size is tuned during warmup with dual averaging.
+
+    Args:
+      model (AstroPhot_Model): The model which will be sampled.
+      initial_state (Optional[Sequence]): A 1D array with the values for each parameter in the model. These values should be in the form of "as_representation" in the model.
+      max_iter (int): The number of samples to draw after warmup. Default 1000
+      epsilon (float): Initial leapfrog step size. Default 0.1
+      leapfrog_steps (int): Number of leapfrog steps for each trajectory. Default 10
+      warmup (int): Number of warmup steps for step size and mass matrix adaptation, not recorded in the chain. Default 100
+      inv_mass (tensor or LM): Inverse mass matrix in the representation space, either 1D (diagonal) or 2D (dense). A fitted LM optimizer may be given to use its covariance matrix. Default None, the identity
+      adapt_mass (bool): Adapt a dense inverse mass matrix during warmup. Default True if no inv_mass is given
+      adapt_step_size (bool): Tune the step size during warmup. Default True
+      target_accept (float): Average acceptance statistic targeted by the step size adaptation. Default 0.8
+      prior (torch.distributions.Distribution): Optional prior on the representation vector, by default the prior is flat.
+      progress_bar (bool): Whether to display a progress bar during sampling. Default True
+
+    """
+
+    def __init__(
+        self,
+        model: "AstroPhot_Model",
+        initial_state: Optional[Sequence] = None,
+        max_iter: int = 1000,
+        **kwargs,
+    ):
+        super().__init__(model, initial_state, max_iter=max_iter, **kwargs)
+
+        self.epsilon = kwargs.get("epsilon", 0.1)
+        self.leapfrog_steps = kwargs.get("leapfrog_steps", 10)
+        self.warmup = kwargs.get("warmup", 100)
+        self.adapt_mass = kwargs.get("adapt_mass", kwargs.get("inv_mass", None) is None)
+        self.adapt_step_size = kwargs.get("adapt_step_size", True)
+        self.target_accept = kwargs.get("target_accept", 0.8)
+        self.prior = kwargs.get("prior", None)
+        self.progress_bar = kwargs.get("progress_bar", True)
+        self.set_inverse_mass(kwargs.get("inv_mass", None))
+
+        self.chain = None
+        self.log_prob_chain = None
+        self.acceptance = None
+        self.gradient_evaluations = 0
+        self._plan = None
+        self._plan_layout = None
+
+    def set_inverse_mass(self, inv_mass=None):
+        """Set the inverse mass matrix (the expected covariance of the
+        samples in the representation space). May be None for the
+        identity, a 1D tensor for a diagonal, a 2D tensor, or a fitted
+        LM optimizer whose covariance matrix is transformed from the
+        natural parameters to the representation space.
+
+        """
+        N = len(self.current_state)
+        if inv_mass is None:
+            inv_mass = torch.ones(N, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        elif hasattr(inv_mass, "covariance_matrix"):
+            inv_mass = self.representation_covariance(inv_mass.covariance_matrix)
+        inv_mass = torch.as_tensor(inv_mass, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        if inv_mass.dim() == 1:
+            inv_mass = torch.diag(inv_mass)
+        if inv_mass.shape != (N, N):
+            raise SpecificationConflict(
+                f"Inverse mass matrix has shape {tuple(inv_mass.shape)}, should be ({N}, {N}) for the model parameters"
+            )
+        inv_mass = (inv_mass + inv_mass.T) / 2
+        # Add jitter until the matrix is positive definite
+        jitter = 1e-10 * torch.mean(torch.abs(torch.diag(inv_mass)))
+        L, info = torch.linalg.cholesky_ex(inv_mass)
+        while info > 0:
+            inv_mass = inv_mass + jitter * torch.eye(
+                N, dtype=inv_mass.dtype, device=inv_mass.device
+            )
+            jitter = jitter * 10
+            L, info = torch.linalg.cholesky_ex(inv_mass)
+        self.inv_mass = inv_mass
+        self._inv_mass_cholesky = L
+
+    @torch.no_grad()
+    def representation_covariance(self, covariance):
+        """Transform a covariance matrix of the natural parameter values
+        (such as ``LM.covariance_matrix``) to the representation space
+        at the current state.
+
+        """
+        values = self.model.parameters.vector_transform_rep_to_val(self.current_state)
+        J = torch.autograd.functional.jacobian(
+            self.model.parameters.vector_transform_val_to_rep, values
+        )
+        return J @ covariance @ J.T
+
+    def _build_plan(self):
+        """Work out how to evaluate the model as a pure function of the
+        value vector. Each model parameter is traced through its links
+        to either a section of the vector (from the compiled
+        ``Parameter_Layout``) or a locked constant, and the component
+        models are grouped by ``Group_Model._batch_spec`` for
+        ``Group_Model._evaluate_batch``. Returns None if any parameter
+        is a function of others, any leaf is masked, or any model
+        cannot be evaluated as a batch.
+
+        """
+        model = self.model
+        if isinstance(model.window, Window_List):
+            return None
+        layout = model.parameters.layout
+        leaves = {}
+        for leaf, direct, start, stop in zip(
+            layout.nodes, layout.direct, layout.starts[:-1], layout.starts[1:]
+        ):
+            leaves[id(leaf)] = (slice(int(start), int(stop)), leaf._value.shape) if direct else None
+        if isinstance(model, Group_Model):
+            entries = list(
+                (sub, sub.window & model.window, model.parameters[sub.name])
+                for sub in model.models.values()
+            )
+        else:
+            entries = [(model, model.window, model.parameters)]
+
+        data = model.target[model.window]
+        shape = tuple(data.data.shape)
+        batches = OrderedDict()
+        for sub, window, parameters in entries:
+            if not isinstance(sub, Component_Model) or sub._batch_failed:
+                return None
+            if torch.any(window.pixel_shape <= 0):
+                continue
+            key = Group_Model._batch_spec(sub, window, parameters)
+            if key is None:
+                return None
+            values = {}
+            for name, node in parameters.nodes.items():
+                while isinstance(node._value, Parameter_Node):
+                    node = node._value
+                if node._value is None:
+                    continue
+                if id(node) in leaves:
+                    if leaves[id(node)] is None:
+                        return None
+                    values[name] = leaves[id(node)]
+                elif isinstance(node._value, torch.Tensor):
+                    # Locked parameters are constant while sampling
+                    values[name] = node.value.detach()
+                else:
+                    return None
+            rows, cols = window.get_other_indices(data)
+            pad = (
+                int(cols.start),
+                shape[1] - int(cols.stop),
+                int(rows.start),
+                shape[0] - int(rows.stop),
+            )
+            batches.setdefault(key, []).append((sub, window, values, pad))
+        mask = data.mask if model.target.has_mask else None
+        return list(batches.values()), data.data, data.weight, mask
+
+    def _plan_likelihood(self, state):
+        """Negative log likelihood of a representation state vector following
+        the plan from ``_build_plan``, only tensor operations on the
+        state are involved.
+
+        """
+        batches, data, weight, mask = self._plan
+        values = self.model.parameters.layout.rep_to_val(state)
+        image = torch.zeros_like(data)
+        for batch in batches:
+            datas = Group_Model._evaluate_batch(
+                list(sub for sub, _, _, _ in batch),
+                list(window for _, window, _, _ in batch),
+                list(
+                    dict(
+                        (name, values[v[0]].reshape(v[1]) if isinstance(v, tuple) else v)
+                        for name, v in entry.items()
+                    )
+                    for _, _, entry, _ in batch
+                ),
+            )
+            for (_, _, _, pad), sub_data in zip(batch, datas):
+                image = image + torch.nn.functional.pad(sub_data, pad)
+        return self.model._batch_chi2(image.unsqueeze(0), data, weight, mask)[0]
+
+    def potential(self, state: torch.Tensor):
+        """Potential energy (negative log posterior) and its gradient at a
+        representation state vector. When the model can be evaluated
+        as a batch (see ``_build_plan``) the likelihood is a pure
+        function of the state and the parameter DAG is not touched,
+        otherwise ``negative_log_likelihood_vectors`` is used.
+
+        """
+        if self._plan_layout is None or not self._plan_layout.valid:
+            self._plan_layout = self.model.parameters.layout
+            self._plan = self._build_plan()
+        with torch.enable_grad():
+            state = state.detach().requires_grad_(True)
+            U = None
+            if self._plan is not None:
+                try:
+                    U = self._plan_likelihood(state)
+                except (RuntimeError, NotImplementedError) as error:
+                    AP_config.ap_logger.warning(
+                        f"{self.model.name} could not be evaluated as a batch, the potential will be evaluated through the parameters. {error}"
+                    )
+                    self._plan = None
+            if U is None:
+                U = self.model.negative_log_likelihood_vectors(
+                    state.unsqueeze(0), as_representation=True, batch_size=1
+                )[0]
+            if self.prior is not None:
+                U = U - torch.sum(self.prior.log_prob(state))
+            (grad,) = torch.autograd.grad(U, state)
+        self.gradient_evaluations += 1
+        return U.detach(), grad
+
+    def _momentum(self):
+        z = torch.randn(
+            len(self.current_state), dtype=AP_config.ap_dtype, device=AP_config.ap_device
+        )
+        # p ~ N(0, M) with M the inverse of inv_mass = L L^T
+        return torch.linalg.solve_triangular(
+            self._inv_mass_cholesky.T, z.unsqueeze(1), upper=True
+        ).squeeze(1)
+
+    def _kinetic(self, p):
+        return 0.5 * torch.dot(p, self.inv_mass @ p)
+
+    def _leapfrog(self, x, p, grad, epsilon):
+        p = p - 0.5 * epsilon * grad
+        x = x + epsilon * (self.inv_mass @ p)
+        U, grad = self.potential(x)
+        p = p - 0.5 * epsilon * grad
+        return x, p, U, grad
+
+    @staticmethod
+    def _accept_stat(log_alpha):
+        log_alpha = float(log_alpha)
+        if not np.isfinite(log_alpha):
+            return 0.0
+        return float(np.exp(min(0.0, log_alpha)))
+
+    @torch.no_grad()
+    @profiled("step")
+    def step(self, current):
+        """Take one HMC trajectory from the current ``(state, potential,
+        gradient)``. Returns the next one and the acceptance
+        statistic.
+
+        """
+        x, U, grad = current
+        p = self._momentum()
+        H0 = U + self._kinetic(p)
+        x1, p1, U1, grad1 = x, p, U, grad
+        for _ in range(self.leapfrog_steps):
+            x1, p1, U1, grad1 = self._leapfrog(x1, p1, grad1, self.epsilon)
+        log_alpha = H0 - (U1 + self._kinetic(p1))
+        accept_stat = self._accept_stat(log_alpha)
+        if torch.isfinite(log_alpha) and np.log(np.random.rand()) < log_alpha.item():
+            return (x1, U1, grad1), accept_stat
+        return current, accept_stat
+
+    @staticmethod
+    def _warmup_covariance(samples):
+        """Regularized sample covariance used as the adapted inverse mass matrix"""
+        n, N = samples.shape
+        if n <= N:
+            covariance = torch.diag(torch.var(samples, dim=0))
+        else:
+            covariance = torch.cov(samples.T)
+        eye = torch.eye(N, dtype=samples.dtype, device=samples.device)
+        return (n / (n + 5)) * covariance + 1e-3 * (5 / (n + 5)) * eye
+
+    @profiled("fit")
+    def fit(
+        self,
+        state: Optional[torch.Tensor] = None,
+        nsamples: Optional[int] = None,
+    ):
+        """Runs the warmup and then draws `nsamples` samples which are
+        recorded in ``chain`` as parameter values.
+
+        """
+        if nsamples is None:
+            nsamples = self.max_iter
+        if state is None:
+            state = self.current_state
+        state = torch.as_tensor(state, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+
+        self.gradient_evaluations = 0
+        U, grad = self.potential(state)
+        current = (state, U, grad)
+        adaptation = _DualAveraging(self.epsilon, self.target_accept)
+        window = (self.warmup // 4, 3 * self.warmup // 4)
+        warmup_samples = []
+
+        self.chain = np.empty((nsamples, len(state)))
+        self.log_prob_chain = np.empty(nsamples)
+        accept_stats = []
+        total = self.warmup + nsamples
+        iterator = tqdm(range(total)) if self.progress_bar else range(total)
+        for i in iterator:
+            current, accept_stat = self.step(current)
+            if i < self.warmup:
+                if self.adapt_step_size:
+                    self.epsilon = adaptation.update(accept_stat)
+                if self.adapt_mass and window[0] <= i < window[1]:
+                    warmup_samples.append(current[0])
+                    if i == window[1] - 1 and len(warmup_samples) > 1:
+                        self.set_inverse_mass(self._warmup_covariance(torch.stack(warmup_samples)))
+                        adaptation = _DualAveraging(self.epsilon, self.target_accept)
+                if i == self.warmup - 1 and self.adapt_step_size:
+                    self.epsilon = adaptation.epsilon
+                continue
+            j = i - self.warmup
+            self.chain[j] = (
+                self.model.parameters.vector_transform_rep_to_val(current[0]).detach().cpu().numpy()
+            )
+            self.log_prob_chain[j] = -current[1].item()
+            accept_stats.append(accept_stat)
+
+        self.acceptance = float(np.mean(accept_stats)) if len(accept_stats) > 0 else None
+        self.current_state = current[0]
+        self.model.parameters.vector_set_representation(self.current_state)
+        if self.verbose > 0:
+            AP_config.ap_logger.info(
+                f"Acceptance: {self.acceptance}, step size: {self.epsilon}, gradient evaluations: {self.gradient_evaluations}"
+            )
+        return self
+
+    def effective_sample_size(self) -> np.ndarray:
+        """
+        Effective number of independent samples of each parameter in the chain
+        """
+        return len(self.chain) / Ensemble.autocorrelation_time(self.chain[:, None, :])
+
+
+class Native_NUTS(Native_HMC):
+    """No U-Turn Sampler variant of ``Native_HMC`` (Hoffman & Gelman
+    2014, https://arxiv.org/abs/1111.4246). Each trajectory is doubled
+    forwards or backwards in time until it starts to turn back on
+    itself, so the number of leapfrog steps need not be tuned. As in
+    Stan and Pyro the sample is drawn from the trajectory in
+    proportion to ``exp(-H)`` (multinomial sampling) rather than with
+    a slice variable, favouring the newest half of the trajectory
+    (https://arxiv.org/abs/1701.02434). The U turn criterion uses the
+    velocities given by the inverse mass matrix, which may be dense
+    (see ``Native_HMC``), with the sum of the momenta along the
+    trajectory as in the generalized criterion of Betancourt.
+
+    Args:
+      max_depth (int): Maximum number of trajectory doublings. Default 10
+      max_energy_error (float): Energy error at which a trajectory is considered divergent. Default 1000
+
+    """
+
+    def __init__(
+        self,
+        model: "AstroPhot_Model",
+        initial_state: Optional[Sequence] = None,
+        max_iter: int = 1000,
+        **kwargs,
+    ):
+        super().__init__(model, initial_state, max_iter=max_iter, **kwargs)
+        self.max_depth = kwargs.get("max_depth", 10)
+        self.max_energy_error = kwargs.get("max_energy_error", 1000.0)
+        self.tree_depths = []
+
+    def _no_uturn(self, minus, plus, rho):
+        """Generalized no U-turn criterion of Betancourt (2013), using the
+        sum of the momenta `rho` along the trajectory from `minus` to
+        `plus` instead of the change in position.
+
+        """
+        rho = rho - (minus[1] + plus[1]) / 2
+        return (
+            torch.dot(self.inv_mass @ minus[1], rho) > 0
+            and torch.dot(self.inv_mass @ plus[1], rho) > 0
+        )
+
+    def _build_tree(self, point, direction, depth, H0):
+        """Build a subtree of ``2**depth`` leapfrog steps from `point` (a
+        ``(state, momentum, potential, gradient)`` tuple). Returns the
+        leftmost and rightmost points, a proposal drawn from the
+        subtree in proportion to ``exp(-H)``, the log of the total
+        weight relative to the initial energy, the sum of the
+        momenta, whether to continue, and the sum and count of the
+        acceptance statistics.
+
+        """
+        if depth == 0:
+            x, p, U, grad = self._leapfrog(point[0], point[1], point[3], direction * self.epsilon)
+            H = U + self._kinetic(p)
+            log_w = (H0 - H).item() if torch.isfinite(H) else -np.inf
+            new = (x, p, U, grad)
+            keep_going = -log_w < self.max_energy_error
+            return new, new, (x, U, grad), log_w, p, keep_going, self._accept_stat(log_w), 1
+
+        minus, plus, proposal, log_w, rho, keep_going, alpha, n_alpha = self._build_tree(
+            point, direction, depth - 1, H0
+        )
+        if keep_going:
+            if direction < 0:
+                minus, _, proposal2, log_w2, rho2, keep_going2, alpha2, n_alpha2 = self._build_tree(
+                    minus, direction, depth - 1, H0
+                )
+            else:
+                _, plus, proposal2, log_w2, rho2, keep_going2, alpha2, n_alpha2 = self._build_tree(
+                    plus, direction, depth - 1, H0
+                )
+            total = np.logaddexp(log_w, log_w2)
+            # uniform progressive sampling within the subtree
+            if np.isfinite(total) and np.log(np.random.rand()) < log_w2 - total:
+                proposal = proposal2
+            log_w = total
+            rho = rho + rho2
+            alpha += alpha2
+            n_alpha += n_alpha2
+            keep_going = keep_going2 and self._no_uturn(minus, plus, rho)
+        return minus, plus, proposal, log_w, rho, keep_going, alpha, n_alpha
+
+    @torch.no_grad()
+    @profiled("step")
+    def step(self, current):
+        """Take one NUTS trajectory from the current ``(state, potential,
+        gradient)``. Returns the next one and the acceptance
+        statistic.
+
+        """
+        x, U, grad = current
+        p = self._momentum()
+        H0 = U + self._kinetic(p)
+        minus = plus = (x, p, U, grad)
+        proposal = current
+        log_w = 0.0
+        rho = p
+        keep_going = True
+        depth = 0
+        alpha = 0.0
+        n_alpha = 0
+        while keep_going and depth < self.max_depth:
+            direction = 1 if np.random.rand() < 0.5 else -1
+            if direction < 0:
+                minus, _, proposal2, log_w2, rho2, keep_going2, alpha2, n_alpha2 = self._build_tree(
+                    minus, direction, depth, H0
+                )
+            else:
+                _, plus, proposal2, log_w2, rho2, keep_going2, alpha2, n_alpha2 = self._build_tree(
+                    plus, direction, depth, H0
+                )
+            if not keep_going2:
+                break
+            # biased progressive sampling favours the new subtree
+            if np.log(np.random.rand()) < log_w2 - log_w:
+                proposal = proposal2
+            log_w = np.logaddexp(log_w, log_w2)
+            rho = rho + rho2
+            alpha += alpha2
+            n_alpha += n_alpha2
+            keep_going = self._no_uturn(minus, plus, rho)
+            depth += 1
+        self.tree_depths.append(depth)
+        return proposal, alpha / max(n_alpha, 1)
@@ -2,6 +2,9 @@
 from typing import Dict, Any, Sequence, Union
 import os
 from time import time
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import random
 
 import numpy as np
@@ -12,22 +15,52 @@ from ..models import AstroPhot_Model
 from .lm import LM
 from ..param import Param_Mask
 from .. import AP_config
+from ..utils.decorators import profiled
 
 __all__ = ["Iter", "Iter_LM"]
 
 
+def _init_worker(dtype, device, num_threads):
+    """Configure a worker process for the parallel Iter optimizer"""
+    AP_config.ap_dtype = dtype
+    AP_config.ap_device = device
+    torch.set_num_threads(num_threads)
+
+
+def _fit_submodel(model, method, method_kwargs):
+    """Fit a single sub model in a worker process, the model target
+    should already have the other models subtracted. Returns the
+    optimized parameter representation and the fit message.
+
+    """
+    res = method(model, **method_kwargs).fit()
+    return model.parameters.vector_representation(), res.message
+
+
 class Iter(BaseOptimizer):
     """Optimizer wrapper that performs optimization iteratively.
 
     This optimizer applies a different optimizer to a group model iteratively.
     It can be used for complex fits or when the number of models to fit is too large to fit in memory.
 
+    With ``workers > 1`` the sub models are split into independent
+    sets, models whose windows (padded by the psf border) do not
+    overlap and which share no parameters. Within an iteration the
+    sets are processed in turn and the models of a set are fit
+    concurrently in a pool of worker processes. Since the models in a
+    set touch disjoint pixels this gives the same result as fitting
+    them one after another. Worker processes are started with
+    ``spawn``, so scripts using this must guard their entry point
+    with ``if __name__ == "__main__":``. Each worker is limited to
+    ``cpu_count // workers`` torch threads.
+
     Args:
         model: An `AstroPhot_Model` object to perform optimization on.
         method: The optimizer class to apply at each iteration step.
         initial_state: Optional initial state for optimization, defaults to None.
         max_iter: Maximum number of iterations, defaults to 100.
         method_kwargs: Keyword arguments to pass to `method`.
+        workers: Number of worker processes used to fit independent models concurrently, defaults to 1 (sequential).
         **kwargs: Additional keyword arguments.
 
     Attributes:
@@ -46,12 +79,21 @@ class Iter(BaseOptimizer):
         initial_state: np.ndarray = None,
         max_iter: int = 100,
         method_kwargs: Dict[str, Any] = {},
+        workers: int = 1,
         **kwargs: Dict[str, Any],
     ) -> None:
         super().__init__(model, initial_state, max_iter=max_iter, **kwargs)
 
         self.method = method
         self.method_kwargs = method_kwargs
+        self.workers = workers
+        self._pool = None
+        if self.workers > 1:
+            self.schedule = self.independent_sets()
+            if self.verbose > 0:
+                AP_config.ap_logger.info(
+                    f"Iter will fit {len(self.model.models)} models in {len(self.schedule)} independent sets"
+                )
         if "relative_tolerance" not in method_kwargs and isinstance(method, LM):
             # Lower tolerance since it's not worth fine tuning a model when its neighbors will be shifting soon anyway
             self.method_kwargs["relative_tolerance"] = 1e-3
@@ -64,6 +106,7 @@ class Iter(BaseOptimizer):
             # subtract masked pixels from degrees of freedom
             self.ndf -= torch.sum(self.model.target[self.model.window].flatten("mask")).item()
 
+    @profiled("sub_step")
     def sub_step(self, model: "AstroPhot_Model") -> None:
         """
         Perform optimization for a single model.
@@ -81,6 +124,46 @@ class Iter(BaseOptimizer):
             AP_config.ap_logger.info(res.message)
         model.target = initial_target
 
+    def parallel_sub_step(self, models: Sequence["AstroPhot_Model"]) -> None:
+        """
+        Perform optimization for a set of independent models concurrently.
+
+        Args:
+            models: Models which do not overlap each other, see `independent_sets`.
+        """
+        if len(models) == 1:
+            self.sub_step(models[0])
+            return
+        # Build each model's target with all other models subtracted
+        initial_targets = []
+        for model in models:
+            self.Y -= model()
+            initial_targets.append(model.target)
+            model.target = model.target[model.window] - self.Y[model.window]
+        results = self._pool.map(
+            _fit_submodel, models, repeat(self.method), repeat(self.method_kwargs)
+        )
+        # Collect the optimized parameters and add the models back in
+        for model, initial_target, (state, message) in zip(models, initial_targets, results):
+            model.target = initial_target
+            model.parameters.vector_set_representation(
+                state.to(dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+            )
+            model.parameters.flat_detach()
+            self.Y += model()
+            if self.verbose > 1:
+                AP_config.ap_logger.info(f"{model.name}: {message}")
+
+    def independent_sets(self) -> list:
+        """Split the sub models into sets which can be fit at the same
+        time, see `Group_Model.independent_sets`.
+
+        Returns:
+            list: list of lists of models, each inner list is an independent set
+        """
+        return self.model.independent_sets()
+
+    @profiled("step")
     def step(self) -> None:
         """
         Perform a single iteration of optimization.
@@ -88,11 +171,18 @@ class Iter(BaseOptimizer):
         if self.verbose > 0:
             AP_config.ap_logger.info("--------iter-------")
 
-        # Fit each model individually
-        for model in self.model.models.values():
-            if self.verbose > 0:
-                AP_config.ap_logger.info(model.name)
-            self.sub_step(model)
+        if self.workers > 1:
+            # Fit each set of independent models concurrently
+            for models in self.schedule:
+                if self.verbose > 0:
+                    AP_config.ap_logger.info(", ".join(model.name for model in models))
+                self.parallel_sub_step(models)
+        else:
+            # Fit each model individually
+            for model in self.model.models.values():
+                if self.verbose > 0:
+                    AP_config.ap_logger.info(model.name)
+                self.sub_step(model)
         # Update the current state
         self.current_state = self.model.parameters.vector_representation()
 
@@ -135,6 +225,7 @@ class Iter(BaseOptimizer):
 
         self.iteration += 1
 
+    @profiled("fit")
     def fit(self) -> "BaseOptimizer":
         """
         Fit the models to the target.
@@ -145,6 +236,17 @@ class Iter(BaseOptimizer):
         self.iteration = 0
         self.Y = self.model(parameters=self.current_state, as_representation=True)
         start_fit = time()
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(
+                    AP_config.ap_dtype,
+                    AP_config.ap_device,
+                    max(1, os.cpu_count() // self.workers),
+                ),
+            )
         try:
             while True:
                 self.step()
@@ -164,6 +266,10 @@ class Iter(BaseOptimizer):
 
         except KeyboardInterrupt:
             self.message = self.message + "fail interrupted"
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
 
         self.model.parameters.vector_set_representation(self.res())
         if self.verbose > 1:
@@ -221,6 +327,7 @@ class Iter_LM(BaseOptimizer):
             # subtract masked pixels from degrees of freedom
             self.ndf -= torch.sum(self.model.target[self.model.window].flatten("mask")).item()
 
+    @profiled("step")
     def step(self):
         # These store the chunking information depending on which chunk mode is selected
         param_ids = list(self.model.parameters.vector_identities())
@@ -305,6 +412,7 @@ class Iter_LM(BaseOptimizer):
 
         self.iteration += 1
 
+    @profiled("fit")
     def fit(self):
         self.iteration = 0
 
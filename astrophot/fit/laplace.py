@@ -0,0 +1,250 @@
+# Laplace approximation of the posterior about the LM best fit
+from typing import Callable, Iterator, Optional, Sequence
+
+import torch
+
+from .lm import LM
+from .. import AP_config
+from ..models import Group_Model
+from ..utils.decorators import profiled
+
+__all__ = ("Laplace",)
+
+
+class Laplace(LM):
+    """Laplace approximation of the posterior. The parameters are fit
+    with the Levenberg-Marquardt algorithm (see `LM`), then the
+    posterior is approximated by a multivariate Gaussian centered on
+    the best fit with precision matrix equal to the hessian
+    :math:`J^TWJ` in the natural parameter space.
+
+    Rather than inverting the hessian as `LM.covariance_matrix` does,
+    a Cholesky factorization :math:`H = LL^T` is kept. Marginal
+    variances are then computed with triangular solves and posterior
+    samples are drawn as :math:`\\mu + L^{-T}z` with :math:`z` a
+    standard normal vector, so the covariance matrix is never formed.
+    For group models the jacobian is stored in block form (see
+    `Jacobian_Blocks`) and the parameters are split into independent
+    sets, component models which share no pixels and no parameters
+    have no cross terms in the hessian, so each set is factorized on
+    its own. For a large field of mostly isolated sources this turns
+    one factorization of size Nparameters into many small ones.
+
+    The factorization is computed at the end of `fit`, or at the
+    current state by calling `factorize` directly if the model is
+    already fit (for example by passing ``max_iter=0``).
+
+    Args:
+      model: The model to be fit and sampled.
+      initial_state (Sequence): Initial values for the parameters in representation space.
+      max_iter (int): Maximum number of LM iterations before the posterior is factorized. Default 100
+      block_jacobian (bool): Use the block sparse jacobian and factorize the independent parameter sets separately. Default True for group models, False otherwise.
+      jitter (float): Relative jitter added to the hessian diagonal (and increased tenfold until the factorization succeeds) if it is not positive definite. Default 1e-10
+
+    Here is some basic usage of the Laplace posterior:
+
+    .. code-block:: python
+
+      import astrophot as ap
+
+      # build and initialize a model
+      # ...
+
+      laplace = ap.fit.Laplace(model).fit()
+
+      # Marginal uncertainty of every parameter
+      sigma = torch.sqrt(laplace.marginal_variance())
+
+      # Posterior draws in natural parameter values
+      samples = laplace.sample(1000)
+
+      # Posterior of a derived quantity
+      mags = laplace.propagate(lambda m: m.total_magnitude(), 1000)
+
+    """
+
+    def __init__(
+        self,
+        model,
+        initial_state: Sequence = None,
+        max_iter: int = 100,
+        **kwargs,
+    ):
+        kwargs.setdefault("block_jacobian", isinstance(model, Group_Model))
+        super().__init__(model, initial_state, max_iter=max_iter, **kwargs)
+
+        self.jitter = kwargs.get("jitter", 1e-10)
+        # List of (parameter indices, cholesky factor) for each independent parameter set
+        self.cholesky = None
+        self.mode = None
+
+    @profiled("fit")
+    def fit(self) -> "Laplace":
+        """Fit the model with LM, then factorize the hessian at the best
+        fit parameters.
+
+        """
+        if self.max_iter > 0:
+            super().fit()
+        self.factorize()
+        return self
+
+    @torch.no_grad()
+    def _factor(self, hess: torch.Tensor) -> torch.Tensor:
+        # Parameters which do not affect the image would make the hessian singular
+        unconstrained = torch.diag(hess) == 0
+        if torch.any(unconstrained):
+            AP_config.ap_logger.warning(
+                "WARNING: Hessian is singular, likely at least one model is non-physical. Will massage Hessian to continue but results should be inspected."
+            )
+            hess = hess + torch.diag(unconstrained.to(dtype=hess.dtype))
+        L, info = torch.linalg.cholesky_ex(hess)
+        jitter = self.jitter * torch.mean(torch.diag(hess))
+        while info.item() != 0:
+            L, info = torch.linalg.cholesky_ex(
+                hess + jitter * torch.eye(len(hess), dtype=hess.dtype, device=hess.device)
+            )
+            jitter = jitter * 10
+        return L
+
+    @torch.no_grad()
+    def factorize(self) -> None:
+        """Compute the hessian in natural parameter units at the current
+        state and store its Cholesky factorization, block by block
+        for independent parameter sets when the jacobian is in block
+        form.
+
+        """
+        self.mode = self.model.parameters.vector_transform_rep_to_val(self.current_state)
+        if self.block_jacobian:
+            J = self.jacobian_natural(parameters=self.mode)
+            W = self.W if self.mask is None else self.W * self.mask
+            self.cholesky = list(
+                (index, self._factor(J.hessian(W, index))) for index in J.components()
+            )
+        else:
+            self.update_hess_grad(natural=True)
+            self.cholesky = [
+                (
+                    torch.arange(len(self.mode), device=AP_config.ap_device),
+                    self._factor(self.hess),
+                )
+            ]
+        self.model.parameters.vector_set_representation(self.current_state)
+        self._covariance_matrix = None
+
+    @torch.no_grad()
+    def marginal_variance(self, chunk_size: int = 256) -> torch.Tensor:
+        """Diagonal of the covariance matrix. With :math:`H^{-1} =
+        L^{-T}L^{-1}` the variance of each parameter is the sum of
+        squares of the corresponding column of :math:`L^{-1}`, these
+        columns are found with triangular solves `chunk_size` at a
+        time so only a (block size, chunk_size) matrix is ever held.
+
+        """
+        if self.cholesky is None:
+            self.factorize()
+        variance = torch.zeros(len(self.mode), dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        for index, L in self.cholesky:
+            eye = torch.eye(len(index), dtype=L.dtype, device=L.device)
+            for start in range(0, len(index), chunk_size):
+                columns = torch.linalg.solve_triangular(
+                    L, eye[:, start : start + chunk_size], upper=False
+                )
+                variance[index[start : start + chunk_size]] = torch.sum(columns**2, dim=0)
+        return variance
+
+    @property
+    @torch.no_grad()
+    def covariance_matrix(self) -> torch.Tensor:
+        """The full covariance matrix assembled from the factorization,
+        zero between independent parameter sets. Prefer
+        `marginal_variance` or `sample` for large models.
+
+        """
+        if self._covariance_matrix is not None:
+            return self._covariance_matrix
+        if self.cholesky is None:
+            self.factorize()
+        cov = torch.zeros(
+            (len(self.mode), len(self.mode)), dtype=AP_config.ap_dtype, device=AP_config.ap_device
+        )
+        for index, L in self.cholesky:
+            cov[index[:, None], index[None, :]] = torch.cholesky_inverse(L)
+        self._covariance_matrix = cov
+        return cov
+
+    @torch.no_grad()
+    def update_uncertainty(self) -> None:
+        """Set the uncertainty of each parameter to the square root of its
+        marginal variance.
+
+        """
+        if self.cholesky is None:
+            self.factorize()
+        variance = self.marginal_variance()
+        if torch.all(torch.isfinite(variance)):
+            try:
+                self.model.parameters.vector_set_uncertainty(torch.sqrt(variance))
+            except RuntimeError as e:
+                AP_config.ap_logger.warning(f"Unable to update uncertainty due to: {e}")
+        else:
+            AP_config.ap_logger.warning(
+                "Unable to update uncertainty due to non finite marginal variance"
+            )
+
+    @torch.no_grad()
+    def sample_batches(self, nsamples: int, batch_size: int = 1000) -> Iterator[torch.Tensor]:
+        """Generate posterior samples of the natural parameter values in
+        batches of (at most) `batch_size` rows.
+
+        """
+        if self.cholesky is None:
+            self.factorize()
+        for start in range(0, nsamples, batch_size):
+            z = torch.randn(
+                (len(self.mode), min(batch_size, nsamples - start)),
+                dtype=AP_config.ap_dtype,
+                device=AP_config.ap_device,
+            )
+            for index, L in self.cholesky:
+                # Solve L^T x = z so that x has covariance (L L^T)^-1
+                z[index] = torch.linalg.solve_triangular(L.T, z[index], upper=True)
+            yield self.mode + z.T
+
+    def sample(self, nsamples: int, batch_size: int = 1000) -> torch.Tensor:
+        """
+        Returns a (nsamples, nparameters) tensor of posterior samples of the natural parameter values
+        """
+        return torch.cat(list(self.sample_batches(nsamples, batch_size)))
+
+    @torch.no_grad()
+    def propagate(
+        self,
+        function: Callable,
+        nsamples: int,
+        batch_size: int = 1000,
+        samples: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Posterior samples of a derived quantity. The model parameters
+        are set to each posterior sample in turn and ``function(model)``
+        is evaluated, for example ``lambda m: m.total_magnitude()``. The
+        model is returned to the best fit parameters afterwards.
+
+        Args:
+          function (Callable): Takes the model and returns a tensor
+          nsamples (int): Number of posterior samples
+          batch_size (int): Number of samples drawn at once
+          samples (Optional[torch.Tensor]): Evaluate on these (nsamples, nparameters) natural parameter values instead of drawing new samples
+
+        """
+        batches = self.sample_batches(nsamples, batch_size) if samples is None else [samples]
+        results = []
+        try:
+            for batch in batches:
+                for values in batch:
+                    self.model.parameters.vector_set_values(values)
+                    results.append(torch.as_tensor(function(self.model)))
+        finally:
+            self.model.parameters.vector_set_representation(self.current_state)
+        return torch.stack(results)
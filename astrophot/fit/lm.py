@@ -7,7 +7,10 @@ import numpy as np
 
 from .base import BaseOptimizer
 from .. import AP_config
-from ..errors import OptimizeStop
+from ..errors import OptimizeStop, SpecificationConflict
+from ..image import Jacobian_Blocks, Window_List
+from ..utils.decorators import profiled
+from ..utils.profiling import profiler
 
 __all__ = ("LM",)
 
@@ -121,6 +124,8 @@ class LM(BaseOptimizer):
       Lup and Ldn (optional): These adjust the step sizes for the damping parameter. Default is 5 and 3 respectively.
       L0 (optional): This is the starting damping parameter. For easy problems with good initialization, this can be set lower. Default is 1.
       acceleration (optional): Controls the use of geodesic acceleration, which can be helpful in some scenarios. Set 1 for full acceleration, 0 for no acceleration. Default is 0.
+      stream_chunksize (optional): If given, the image is walked in tiles with at most this many pixels on a side. The hessian and gradient are accumulated one tile jacobian at a time and the geodesic acceleration uses tile by tile Jacobian-vector products, so the full jacobian is never held in memory. Only available for single image targets. Default is None (no streaming).
+      block_jacobian (optional): If True, the jacobian is stored as a block sparse `Jacobian_Blocks` object with one block per component model and the hessian/gradient are accumulated block by block. This greatly reduces memory for group models with many small components. Default is False.
 
     Here is some basic usage of the LM optimizer:
 
@@ -171,9 +176,19 @@ class LM(BaseOptimizer):
         )
         # The forward model which computes the output image given input parameters
         self.forward = partial(model, as_representation=True)
+        # Store the jacobian as one block per component model rather than a dense Npixels * Nparameters tensor
+        self.block_jacobian = kwargs.get("block_jacobian", False)
+        jacobian = model.block_jacobian if self.block_jacobian else model.jacobian
+        # Size of the image tiles (in pixels) used to accumulate the hessian and gradient, None means the full jacobian is used
+        self.stream_chunksize = kwargs.get("stream_chunksize", None)
+        if self.stream_chunksize is not None and isinstance(self.fit_window, Window_List):
+            raise SpecificationConflict("LM stream_chunksize is only available for single images")
         # Compute the jacobian in representation units (defined for -inf, inf)
-        self.jacobian = partial(model.jacobian, as_representation=True)
-        self.jacobian_natural = partial(model.jacobian, as_representation=False)
+        self.jacobian = partial(jacobian, as_representation=True)
+        self.jacobian_natural = partial(jacobian, as_representation=False)
+        # Compute the model image and the jacobian in a single evaluation
+        self.value_and_jacobian = partial(model.value_and_jacobian, as_representation=True)
+        self.value_and_jacobian_natural = partial(model.value_and_jacobian, as_representation=False)
         # Maximum number of iterations of the algorithm
         self.max_iter = max_iter
         # Maximum number of steps while searching for chi^2 improvement on a single jacobian evaluation
@@ -246,6 +261,7 @@ class LM(BaseOptimizer):
         self.L = max(1e-9, self.L / self._Ldn)
 
     @torch.no_grad()
+    @profiled("step")
     def step(self, chi2) -> torch.Tensor:
         """Performs one step of the LM algorithm. Computes Jacobian, infers
         hessian and gradient, solves for step vector and iterates on
@@ -253,11 +269,8 @@ class LM(BaseOptimizer):
         in chi2 is found. Used internally.
 
         """
-        Y0 = self.forward(parameters=self.current_state).flatten("data")
-        J = self.jacobian(parameters=self.current_state).flatten("data")
+        Y0, J = self._linearize()
         r = self._r(Y0, self.Y, self.W)
-        self.hess = self._hess(J, self.W)
-        self.grad = self._grad(J, self.W, Y0, self.Y)
         init_chi2 = chi2
         nostep = True
         best = (torch.zeros_like(self.current_state), init_chi2, self.L)
@@ -271,17 +284,15 @@ class LM(BaseOptimizer):
                 self.L = 1.0
 
             # compute LM update step
-            h = self._h(self.L, self.grad, self.hess)
+            h = self._direction(self.L)
 
             # Compute goedesic acceleration
             Y1 = self.forward(parameters=self.current_state + d * h).flatten("data")
 
             rh = self._r(Y1, self.Y, self.W)
 
-            rpp = self._rpp(J, d, rh - r, self.W, h)
-
             if self.L > 1e-4:
-                a = -self._h(self.L, rpp, self.hess) / 2
+                a = self._acceleration(J, d, rh - r, h)
             else:
                 a = torch.zeros_like(h)
 
@@ -356,6 +367,32 @@ class LM(BaseOptimizer):
 
         return best
 
+    def _linearize(self):
+        # Model image at the current state, and the jacobian (None when streaming), also updates the hessian and gradient
+        if self.stream_chunksize is None:
+            Y0, J = self._value_and_jacobian(self.current_state)
+            self.hess = self._hess(J, self.W)
+            self.grad = self._grad(J, self.W, Y0, self.Y)
+        else:
+            Y0 = self.forward(parameters=self.current_state).flatten("data")
+            J = None
+            self.hess, self.grad = self._stream_hess_grad(
+                self.jacobian, self.current_state, Y0, self.Y
+            )
+        return Y0, J
+
+    def _direction(self, L) -> torch.Tensor:
+        # Solve the damped normal equations for the LM step
+        return self._h(L, self.grad, self.hess)
+
+    def _acceleration(self, J, d, dr, h) -> torch.Tensor:
+        # Geodesic acceleration from the finite difference of the residuals along h
+        if J is None:
+            rpp = self._stream_rpp(d, dr, self.W, h)
+        else:
+            rpp = self._rpp(J, d, dr, self.W, h)
+        return -self._h(self.L, rpp, self.hess) / 2
+
     @staticmethod
     @torch.no_grad()
     def _h(L, grad, hess) -> torch.Tensor:
@@ -363,10 +400,11 @@ class LM(BaseOptimizer):
         D = torch.ones_like(hess) - I
         # Alternate damping scheme
         # (hess + 1e-2 * L**2 * I) * (1 + L**2 * I) ** 2 / (1 + L**2),
-        h = torch.linalg.solve(
-            hess * (I + D / (1 + L)) + L * I * (1 + torch.diag(hess)),
-            grad,
-        )
+        with profiler.stage("linalg.solve", "LM"):
+            h = torch.linalg.solve(
+                hess * (I + D / (1 + L)) + L * I * (1 + torch.diag(hess)),
+                grad,
+            )
 
         return h
 
@@ -384,8 +422,28 @@ class LM(BaseOptimizer):
         else:
             return W[self.mask] * (Y[self.mask] - Ypred[self.mask])
 
+    def _value_and_jacobian(self, state, natural=False):
+        # Flattened model image and jacobian, from a single model evaluation when possible
+        if self.block_jacobian:
+            jacobian = self.jacobian_natural if natural else self.jacobian
+            J = jacobian(parameters=state)
+            return self.forward(parameters=self.current_state).flatten("data"), J
+        value_and_jacobian = self.value_and_jacobian_natural if natural else self.value_and_jacobian
+        Ypred, J = value_and_jacobian(parameters=state)
+        return Ypred.flatten("data"), J.flatten("data")
+
+    def _full_pixels(self, V) -> torch.Tensor:
+        # Expand a (possibly masked) pixel vector to the full image with zeros in masked pixels
+        if self.mask is None:
+            return V
+        full = torch.zeros(self.mask.shape, dtype=V.dtype, device=V.device)
+        full[self.mask] = V
+        return full
+
     @torch.no_grad()
     def _hess(self, J, W) -> torch.Tensor:
+        if isinstance(J, Jacobian_Blocks):
+            return J.hessian(W if self.mask is None else W * self.mask)
         if self.mask is None:
             return J.T @ (W.view(len(W), -1) * J)
         else:
@@ -393,6 +451,8 @@ class LM(BaseOptimizer):
 
     @torch.no_grad()
     def _grad(self, J, W, Y, Ypred) -> torch.Tensor:
+        if isinstance(J, Jacobian_Blocks):
+            return -J.rmatvec(self._full_pixels(self._r(Y, Ypred, W)))
         if self.mask is None:
             return -J.T @ self._r(Y, Ypred, W)
         else:
@@ -400,11 +460,55 @@ class LM(BaseOptimizer):
 
     @torch.no_grad()
     def _rpp(self, J, d, dr, W, h):
+        if isinstance(J, Jacobian_Blocks):
+            dr = self._full_pixels(dr)
+            if self.mask is not None:
+                W = W * self.mask
+            return J.rmatvec((2 / d) * ((dr / d - W * J.matvec(h))))
         if self.mask is None:
             return J.T @ ((2 / d) * ((dr / d - W * (J @ h))))
         else:
             return J[self.mask].T @ ((2 / d) * ((dr / d - W[self.mask] * (J[self.mask] @ h))))
 
+    def _tiles(self):
+        # Walk the fitting window in tiles, giving a function to select the tile pixels from a flattened pixel vector
+        window = self.model.target[self.fit_window].window
+        shape = tuple(reversed(window.pixel_shape.tolist()))
+        for subwindow, pixels in window.chunk_pixels(self.stream_chunksize):
+            yield subwindow, (
+                lambda V, pixels=pixels: V.view(shape)[
+                    pixels[1][0] : pixels[1][1], pixels[0][0] : pixels[0][1]
+                ].reshape(-1)
+            )
+
+    @torch.no_grad()
+    def _stream_hess_grad(self, jacobian, state, Y, Ypred):
+        hess = torch.zeros(
+            (len(state), len(state)), dtype=AP_config.ap_dtype, device=AP_config.ap_device
+        )
+        grad = torch.zeros(len(state), dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        W = self.W if self.mask is None else self.W * self.mask
+        for subwindow, tile in self._tiles():
+            J = jacobian(parameters=state, window=subwindow).flatten("data")
+            W_tile = tile(W)
+            hess += J.T @ (W_tile.view(-1, 1) * J)
+            grad -= J.T @ (W_tile * (tile(Y) - tile(Ypred)))
+        return hess, grad
+
+    @torch.no_grad()
+    def _stream_rpp(self, d, dr, W, h):
+        dr = self._full_pixels(dr)
+        if self.mask is not None:
+            W = W * self.mask
+        rpp = torch.zeros_like(h)
+        for subwindow, tile in self._tiles():
+            forward = lambda P: self.forward(parameters=P, window=subwindow).flatten("data")
+            _, Jh = torch.autograd.functional.jvp(forward, self.current_state, h)
+            v = (2 / d) * (tile(dr) / d - tile(W) * Jh)
+            _, JTv = torch.autograd.functional.vjp(forward, self.current_state, v)
+            rpp += JTv
+        return rpp
+
     @torch.no_grad()
     def update_hess_grad(self, natural=False) -> None:
         """Updates the stored hessian matrix and gradient vector. This can be
@@ -415,16 +519,21 @@ class LM(BaseOptimizer):
 
         """
         if natural:
-            J = self.jacobian_natural(
-                parameters=self.model.parameters.vector_transform_rep_to_val(self.current_state)
-            ).flatten("data")
+            jacobian = self.jacobian_natural
+            state = self.model.parameters.vector_transform_rep_to_val(self.current_state)
         else:
-            J = self.jacobian(parameters=self.current_state).flatten("data")
-        Ypred = self.forward(parameters=self.current_state).flatten("data")
+            jacobian = self.jacobian
+            state = self.current_state
+        if self.stream_chunksize is not None:
+            Ypred = self.forward(parameters=self.current_state).flatten("data")
+            self.hess, self.grad = self._stream_hess_grad(jacobian, state, self.Y, Ypred)
+            return
+        Ypred, J = self._value_and_jacobian(state, natural=natural)
         self.hess = self._hess(J, self.W)
         self.grad = self._grad(J, self.W, self.Y, Ypred)
 
     @torch.no_grad()
+    @profiled("fit")
     def fit(self) -> BaseOptimizer:
         """This performs the fitting operation. It iterates the LM step
         function until convergence is reached. Includes a message
@@ -0,0 +1,166 @@
+# Matrix free Levenberg-Marquardt with conjugate gradient steps
+from typing import Sequence
+
+import torch
+
+from .lm import LM
+from ..utils.profiling import profiler
+
+__all__ = ("LM_CG",)
+
+
+class LM_CG(LM):
+    """Matrix free variant of the Levenberg-Marquardt algorithm (see
+    `LM`) for models with very many parameters. The standard LM
+    builds the Npixels x Nparameters jacobian and the Nparameters x
+    Nparameters hessian, then solves the damped normal equations
+    with a dense solve for every trial damping value, which is cubic
+    in the number of parameters.
+
+    Here the jacobian is never formed. The model evaluation is
+    recorded once per step and products with the transposed jacobian
+    :math:`J^Tu` are computed by back propagation through it. Products
+    with the jacobian :math:`Jv` are the derivative of the linear map
+    :math:`u \\to J^Tu` along :math:`v`, found by back propagation
+    through the graph of that first back propagation, so neither
+    product needs a new evaluation of the model. The damped normal
+    equations
+
+    .. math::
+
+      \\left(\\frac{H}{1+\\lambda} + \\lambda\\,{\\rm diag}\\left(\\frac{D}{1+\\lambda} + 1 + D\\right)\\right)h = g
+
+    with :math:`H = J^TWJ` and :math:`D = {\\rm diag}(H)` (the same
+    damping as `LM`) are then solved with the conjugate gradient
+    method, preconditioned by the diagonal of the damped matrix. The
+    diagonal of the hessian is estimated once per step from
+    `diagonal_probes` random Rademacher vectors :math:`z` as the mean of
+    :math:`(J^TW^{1/2}z)^2`. Each solve is warm started from the
+    previous step direction, which is usually close to the solution
+    since the damping changes little between steps.
+
+    The covariance matrix (and so `update_uncertainty`) still uses the
+    explicit hessian as in `LM`, it is computed only once after the
+    fit.
+
+    Args:
+      model: The model to be optimized.
+      initial_state (Sequence): Initial values for the parameters to be optimized.
+      max_iter (int): Maximum number of iterations for the algorithm.
+      cg_max_iter (int): Maximum number of conjugate gradient iterations per solve. Default 50
+      cg_tolerance (float): Relative residual at which the conjugate gradient solve stops, LM steps only need to be approximate. Default 1e-2
+      diagonal_probes (int): Number of random vectors used to estimate the hessian diagonal. Default 10
+
+    See `LM` for the remaining arguments.
+
+    """
+
+    def __init__(
+        self,
+        model,
+        initial_state: Sequence = None,
+        max_iter: int = 100,
+        **kwargs,
+    ):
+        super().__init__(model, initial_state, max_iter=max_iter, **kwargs)
+
+        self.cg_max_iter = kwargs.get("cg_max_iter", 50)
+        self.cg_tolerance = kwargs.get("cg_tolerance", 1e-2)
+        self.diagonal_probes = kwargs.get("diagonal_probes", 10)
+        # weights with zero for masked pixels, applied to full image pixel vectors
+        self.W_full = self.W if self.mask is None else self.W * self.mask
+        # Number of conjugate gradient iterations for every solve
+        self.cg_iterations = []
+        self._previous_direction = None
+        self._graph = None
+
+    def _jvp(self, v) -> torch.Tensor:
+        # J v as the derivative of the linear map u -> J^T u, reusing the graph recorded in _linearize
+        state, Y0, u, JTu = self._graph
+        return torch.autograd.grad(JTu, u, v, retain_graph=True)[0]
+
+    def _vjp(self, u) -> torch.Tensor:
+        # J^T u by back propagation through the graph recorded in _linearize
+        state, Y0, _, _ = self._graph
+        return torch.autograd.grad(Y0, state, u, retain_graph=True)[0]
+
+    def _hvp(self, v) -> torch.Tensor:
+        return self._vjp(self.W_full * self._jvp(v))
+
+    def _linearize(self):
+        # Record the model evaluation once, along with the (linear in u) graph of J^T u
+        with torch.enable_grad():
+            state = self.current_state.detach().clone().requires_grad_(True)
+            Y0 = self.forward(parameters=state).flatten("data")
+            u = torch.zeros_like(Y0, requires_grad=True)
+            JTu = torch.autograd.grad(Y0, state, u, create_graph=True)[0]
+        self._graph = (state, Y0, u, JTu)
+        self.grad = -self._vjp(self._full_pixels(self._r(Y0.detach(), self.Y, self.W)))
+
+        # Hutchinson estimate of the hessian diagonal
+        self.hess_diag = torch.zeros_like(self.current_state)
+        for _ in range(self.diagonal_probes):
+            z = torch.randint(0, 2, Y0.shape, device=Y0.device).to(dtype=Y0.dtype) * 2 - 1
+            self.hess_diag += self._vjp(torch.sqrt(self.W_full) * z) ** 2
+        self.hess_diag /= max(1, self.diagonal_probes)
+        return Y0.detach(), None
+
+    def _solve(self, L, b, x0=None) -> torch.Tensor:
+        """Solve the damped normal equations for the vector `b` with
+        preconditioned conjugate gradients, starting from `x0`.
+
+        """
+        damping = L * (self.hess_diag / (1 + L) + 1 + self.hess_diag)
+        A = lambda v: self._hvp(v) / (1 + L) + damping * v
+        M = self.hess_diag + L * (1 + self.hess_diag)
+        M = torch.where(M > 0, M, torch.ones_like(M))
+
+        bnorm = torch.linalg.norm(b)
+        x = torch.zeros_like(b)
+        r = b.clone()
+        if x0 is not None:
+            r0 = b - A(x0)
+            # Only use the warm start if it is closer to the solution than zero
+            if torch.linalg.norm(r0) < bnorm:
+                x, r = x0.clone(), r0
+        z = r / M
+        p = z.clone()
+        rz = torch.dot(r, z)
+        iteration = 0
+        with profiler.stage("cg", "LM"):
+            for iteration in range(self.cg_max_iter):
+                if torch.linalg.norm(r) <= self.cg_tolerance * bnorm:
+                    break
+                Ap = A(p)
+                alpha = rz / torch.dot(p, Ap)
+                x = x + alpha * p
+                r = r - alpha * Ap
+                z = r / M
+                rz_new = torch.dot(r, z)
+                p = z + (rz_new / rz) * p
+                rz = rz_new
+        self.cg_iterations.append(iteration)
+        return x
+
+    def _direction(self, L) -> torch.Tensor:
+        h = self._solve(L, self.grad, self._previous_direction)
+        self._previous_direction = h
+        return h
+
+    def _acceleration(self, J, d, dr, h) -> torch.Tensor:
+        dr = self._full_pixels(dr)
+        rpp = self._vjp((2 / d) * (dr / d - self.W_full * self._jvp(h)))
+        return -self._solve(self.L, rpp) / 2
+
+    @torch.no_grad()
+    def step(self, chi2) -> torch.Tensor:
+        """Performs one LM step (see `LM.step`) with matrix free solves. The
+        accepted step is kept to warm start the next solve.
+
+        """
+        try:
+            res = super().step(chi2)
+        finally:
+            self._graph = None
+        self._previous_direction = res[0]
+        return res
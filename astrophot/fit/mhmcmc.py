@@ -5,6 +5,7 @@ from tqdm import tqdm
 import numpy as np
 from .base import BaseOptimizer
 from .. import AP_config
+from ..utils.decorators import profiled
 
 __all__ = ["MHMCMC"]
 
@@ -41,6 +42,7 @@ class MHMCMC(BaseOptimizer):
         self._accepted = 0
         self._sampled = 0
 
+    @profiled("fit")
     def fit(
         self,
         state: Optional[torch.Tensor] = None,
@@ -99,6 +101,7 @@ class MHMCMC(BaseOptimizer):
         return self.model.negative_log_likelihood(parameters=state, as_representation=True)
 
     @torch.no_grad()
+    @profiled("step")
     def step(self, state: torch.Tensor, chi2: torch.Tensor) -> torch.Tensor:
         """
         Takes one step of the HMC sampler by integrating along a path initiated with a random momentum.
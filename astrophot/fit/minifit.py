@@ -7,6 +7,7 @@ from .base import BaseOptimizer
 from ..models import AstroPhot_Model
 from .lm import LM
 from .. import AP_config
+from ..utils.decorators import profiled
 
 __all__ = ["MiniFit"]
 
@@ -32,6 +33,7 @@ class MiniFit(BaseOptimizer):
         self.downsample_factor = downsample_factor
         self.max_pixels = max_pixels
 
+    @profiled("fit")
     def fit(self) -> BaseOptimizer:
         initial_target = self.model.target
         target_area = self.model.target[self.model.window]
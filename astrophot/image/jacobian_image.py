@@ -1,12 +1,13 @@
 from typing import List
 
+import numpy as np
 import torch
 
 from .image_object import Image, Image_List
 from .. import AP_config
 from ..errors import SpecificationConflict, InvalidImage
 
-__all__ = ["Jacobian_Image", "Jacobian_Image_List"]
+__all__ = ["Jacobian_Image", "Jacobian_Image_List", "Jacobian_Blocks"]
 
 
 ######################################################################
@@ -81,7 +82,7 @@ class Jacobian_Image(Image):
             raise InvalidImage("Jacobian images can only add with each other, not: type(other)")
 
         # exclude null jacobian images
-        if other.data is None:
+        if other.data is None or len(other.parameters) == 0:
             return self
         if self.data is None:
             return other
@@ -90,31 +91,32 @@ class Jacobian_Image(Image):
 
         self_indices = other.window.get_other_indices(self)
         other_indices = self.window.get_other_indices(other)
-        for i, other_identity in enumerate(other.parameters):
-            if other_identity in self.parameters:
-                other_loc = self.parameters.index(other_identity)
-            else:
-                self.set_data(
-                    torch.cat(
-                        (
-                            self.data,
-                            torch.zeros(
-                                self.data.shape[0],
-                                self.data.shape[1],
-                                1,
-                                dtype=AP_config.ap_dtype,
-                                device=AP_config.ap_device,
-                            ),
+
+        # Extend the jacobian once for all the new parameters rather than once per parameter
+        new_parameters = list(pid for pid in other.parameters if pid not in self.parameters)
+        if len(new_parameters) > 0:
+            self.set_data(
+                torch.cat(
+                    (
+                        self.data,
+                        torch.zeros(
+                            self.data.shape[0],
+                            self.data.shape[1],
+                            len(new_parameters),
+                            dtype=AP_config.ap_dtype,
+                            device=AP_config.ap_device,
                         ),
-                        dim=2,
                     ),
-                    require_shape=False,
-                )
-                self.parameters.append(other_identity)
-                other_loc = -1
-            self.data[self_indices[0], self_indices[1], other_loc] += other.data[
-                other_indices[0], other_indices[1], i
-            ]
+                    dim=2,
+                ),
+                require_shape=False,
+            )
+            self.parameters += new_parameters
+        param_loc = dict((pid, i) for i, pid in enumerate(self.parameters))
+        other_loc = list(param_loc[pid] for pid in other.parameters)
+        self.data[self_indices[0], self_indices[1], other_loc] += other.data[
+            other_indices[0], other_indices[1], :
+        ]
         return self
 
 
@@ -173,3 +175,229 @@ class Jacobian_Image_List(Image_List, Jacobian_Image):
             for self_image, other_image in zip(self.image_list, other):
                 self_image += other_image
         return self
+
+
+######################################################################
+class Jacobian_Blocks(object):
+    """Block sparse representation of the jacobian for a multi component
+    model.
+
+    A dense Jacobian_Image for a group model stores Npixels *
+    Nparameters values, even though each component model only has
+    derivatives within its own window and only for its own
+    parameters. Here each component contributes a block which stores
+    its (window, parameter) slice of the full jacobian. The products
+    needed by the fitting routines (:math:`J^TWJ`, :math:`J^Tv`, and
+    :math:`Jh`) are then accumulated block by block so the dense
+    jacobian is never constructed. Pixel vectors are always in the
+    flattened order of the target image (or image list) that the
+    blocks were constructed on.
+
+    Args:
+      parameters (List[str]): identities for every parameter (column) in the full jacobian
+      target (Image): the target image (or image list) cropped to the fitting window
+
+    """
+
+    def __init__(self, parameters: List[str], target: Image):
+        self.parameters = list(parameters)
+        if len(self.parameters) != len(set(self.parameters)):
+            raise SpecificationConflict("Every parameter should be unique upon jacobian creation")
+        self._parameter_index = dict((pid, i) for i, pid in enumerate(self.parameters))
+
+        images = target.image_list if isinstance(target, Image_List) else [target]
+        self.identities = list(image.identity for image in images)
+        self.windows = list(image.window for image in images)
+        self.image_shapes = list(tuple(image.data.shape) for image in images)
+        self.image_offsets = [0]
+        for shape in self.image_shapes:
+            self.image_offsets.append(self.image_offsets[-1] + shape[0] * shape[1])
+        self.blocks = []
+        # pixel bounds (image, row start, row end, column start, column end) for each block
+        self._bounds = np.zeros((0, 5), dtype=int)
+
+    @property
+    def shape(self):
+        """Shape of the equivalent dense flattened jacobian"""
+        return (self.image_offsets[-1], len(self.parameters))
+
+    def index(self, other):
+        """Index of the target image which matches the identity of other"""
+        return self.identities.index(other.identity)
+
+    def add_block(self, jacobian: Jacobian_Image):
+        """Store the non-zero block from a component model jacobian. The
+        jacobian must have been evaluated on one of the images used to
+        construct this object, or be a list of such jacobians.
+
+        """
+        if isinstance(jacobian, Jacobian_Image_List):
+            for image in jacobian.image_list:
+                self.add_block(image)
+            return self
+        if jacobian.data is None or len(jacobian.parameters) == 0 or jacobian.data.numel() == 0:
+            return self
+
+        image_index = self.identities.index(jacobian.target_identity)
+        window = self.windows[image_index]
+        rows, cols = window.get_self_indices(jacobian.window)
+        local_rows, local_cols = jacobian.window.get_self_indices(window)
+        bounds = (
+            image_index,
+            int(rows.start),
+            int(rows.stop),
+            int(cols.start),
+            int(cols.stop),
+        )
+        if bounds[2] <= bounds[1] or bounds[4] <= bounds[3]:
+            return self
+        self.blocks.append(
+            (
+                jacobian.data[local_rows, local_cols],
+                torch.tensor(
+                    list(self._parameter_index[pid] for pid in jacobian.parameters),
+                    dtype=torch.long,
+                    device=AP_config.ap_device,
+                ),
+            )
+        )
+        self._bounds = np.concatenate((self._bounds, np.array([bounds], dtype=int)))
+        return self
+
+    def __iadd__(self, other):
+        return self.add_block(other)
+
+    def _pixel_view(self, vector, image_index):
+        return vector[self.image_offsets[image_index] : self.image_offsets[image_index + 1]].view(
+            self.image_shapes[image_index]
+        )
+
+    def components(self) -> List[torch.Tensor]:
+        """Split the parameters into independent sets. Two parameters are
+        linked when they appear in the same block, or in two blocks
+        which overlap on the image, so the hessian is block diagonal
+        over the returned sets (up to a permutation). Parameters which
+        are in no block form sets of their own.
+
+        """
+        parent = np.arange(len(self.parameters))
+
+        def root(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        indices = list(index.cpu().numpy() for _, index in self.blocks)
+        for i, b_i in enumerate(self._bounds):
+            links = list(indices[i][1:])
+            b_j = self._bounds[i + 1 :]
+            overlap = (
+                (b_j[:, 0] == b_i[0])
+                & (b_j[:, 1] < b_i[2])
+                & (b_j[:, 2] > b_i[1])
+                & (b_j[:, 3] < b_i[4])
+                & (b_j[:, 4] > b_i[3])
+            )
+            links += list(indices[j][0] for j in np.flatnonzero(overlap) + i + 1)
+            for link in links:
+                parent[root(link)] = root(indices[i][0])
+
+        roots = np.array(list(root(i) for i in range(len(self.parameters))), dtype=int)
+        return list(
+            torch.tensor(np.flatnonzero(roots == r), dtype=torch.long, device=AP_config.ap_device)
+            for r in np.unique(roots)
+        )
+
+    def hessian(self, weight: torch.Tensor, parameters: torch.Tensor = None) -> torch.Tensor:
+        """Compute :math:`J^TWJ` for a flattened weight vector, masked pixels
+        should simply have zero weight. Only pairs of blocks which
+        overlap on the image contribute cross terms. If `parameters`
+        (indices of a set from `components`) is given, only the
+        hessian block for those parameters is computed.
+
+        """
+        if parameters is None:
+            parameters = torch.arange(len(self.parameters), device=AP_config.ap_device)
+        # Position of each parameter in the output hessian, -1 for parameters not included
+        lookup = torch.full((len(self.parameters),), -1, dtype=torch.long, device=parameters.device)
+        lookup[parameters] = torch.arange(len(parameters), device=parameters.device)
+        hess = torch.zeros(
+            (len(parameters), len(parameters)),
+            dtype=AP_config.ap_dtype,
+            device=AP_config.ap_device,
+        )
+        for i, (data_i, index_i) in enumerate(self.blocks):
+            local_i = lookup[index_i]
+            if torch.any(local_i < 0):
+                continue
+            b_i = self._bounds[i]
+            W = self._pixel_view(weight, b_i[0])
+            # Diagonal block
+            J_i = data_i.reshape(-1, len(index_i))
+            hess[local_i[:, None], local_i[None, :]] += J_i.T @ (
+                W[b_i[1] : b_i[2], b_i[3] : b_i[4]].reshape(-1, 1) * J_i
+            )
+
+            # Cross terms with all later blocks that overlap this one
+            b_j = self._bounds[i + 1 :]
+            overlap = (
+                (b_j[:, 0] == b_i[0])
+                & (b_j[:, 1] < b_i[2])
+                & (b_j[:, 2] > b_i[1])
+                & (b_j[:, 3] < b_i[4])
+                & (b_j[:, 4] > b_i[3])
+            )
+            for j in np.flatnonzero(overlap) + i + 1:
+                data_j, index_j = self.blocks[j]
+                local_j = lookup[index_j]
+                if torch.any(local_j < 0):
+                    continue
+                r0 = max(b_i[1], self._bounds[j][1])
+                r1 = min(b_i[2], self._bounds[j][2])
+                c0 = max(b_i[3], self._bounds[j][3])
+                c1 = min(b_i[4], self._bounds[j][4])
+                J_io = data_i[r0 - b_i[1] : r1 - b_i[1], c0 - b_i[3] : c1 - b_i[3]].reshape(
+                    -1, len(index_i)
+                )
+                J_jo = data_j[
+                    r0 - self._bounds[j][1] : r1 - self._bounds[j][1],
+                    c0 - self._bounds[j][3] : c1 - self._bounds[j][3],
+                ].reshape(-1, len(index_j))
+                sub = J_io.T @ (W[r0:r1, c0:c1].reshape(-1, 1) * J_jo)
+                hess[local_i[:, None], local_j[None, :]] += sub
+                hess[local_j[:, None], local_i[None, :]] += sub.T
+        return hess
+
+    def rmatvec(self, vector: torch.Tensor) -> torch.Tensor:
+        """Compute :math:`J^Tv` for a flattened pixel vector"""
+        res = torch.zeros(
+            len(self.parameters), dtype=AP_config.ap_dtype, device=AP_config.ap_device
+        )
+        for (data, index), b in zip(self.blocks, self._bounds):
+            v = self._pixel_view(vector, b[0])[b[1] : b[2], b[3] : b[4]]
+            res.index_add_(0, index, data.reshape(-1, len(index)).T @ v.reshape(-1))
+        return res
+
+    def matvec(self, vector: torch.Tensor) -> torch.Tensor:
+        """Compute :math:`Jh` for a parameter vector, returns a flattened pixel vector"""
+        res = torch.zeros(self.shape[0], dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        for (data, index), b in zip(self.blocks, self._bounds):
+            self._pixel_view(res, b[0])[b[1] : b[2], b[3] : b[4]] += data @ vector[index]
+        return res
+
+    def flatten(self, attribute: str = "data") -> torch.Tensor:
+        """Construct the equivalent dense flattened jacobian. This defeats the
+        purpose of the block representation and is mostly useful for
+        testing.
+
+        """
+        if attribute != "data":
+            raise InvalidImage(f"Jacobian blocks only store data, not {attribute}")
+        res = torch.zeros(self.shape, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        for (data, index), b in zip(self.blocks, self._bounds):
+            view = res[self.image_offsets[b[0]] : self.image_offsets[b[0] + 1]].view(
+                *self.image_shapes[b[0]], len(self.parameters)
+            )
+            view[b[1] : b[2], b[3] : b[4], index] += data
+        return res
@@ -1,11 +1,134 @@
+from collections import OrderedDict
+
+import numpy as np
 import torch
 from astropy.wcs import WCS as AstropyWCS
 
 from .. import AP_config
 from .wcs import WCS
 from ..errors import ConflicingWCS, SpecificationConflict
+from ..utils.operations import is_traced
+
+__all__ = ["Window", "Window_List", "Grid_Cache", "coordinate_grid_cache"]
+
+
+class Grid_Cache:
+    """Least recently used cache for the coordinate meshgrids of windows.
+
+    Sampling a model asks its window for the tangent plane coordinates
+    of every pixel (or pixel corner, or simpsons sub-pixel point),
+    which means building an arange, a meshgrid, and a matrix multiply
+    through `pixel_to_plane`. This happens several times per model
+    evaluation even though the window rarely changes, so the grids are
+    stored here. Entries are keyed by the kind of grid and the window
+    geometry: pixel shape, reference points, pixelscale, dtype, and
+    device. Shifting, padding, or cropping a window changes its key so
+    stale grids are never returned, while copies of a window share
+    their grids. The least recently used entries are evicted once the
+    total size exceeds `max_bytes`. Windows with traced (forward mode
+    dual) reference points are never cached.
+
+    The cached grids are shared between callers and must not be
+    modified in place.
+
+    Args:
+      max_bytes (int): memory budget for the cached tensors. Default 256MB
+      max_entries (int): maximum number of cached grids. Default 256
+
+    """
 
-__all__ = ["Window", "Window_List"]
+    def __init__(self, max_bytes=2**28, max_entries=256):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.enabled = True
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(window, kind):
+        """Key for a grid of the given kind on `window`, None if the
+        window geometry is traced and the grid cannot be cached.
+
+        """
+        if any(
+            is_traced(tensor)
+            for tensor in (window.pixelscale, window.reference_imageij, window.reference_imagexy)
+        ):
+            return None
+        return (
+            kind,
+            tuple(window.pixel_shape.tolist()),
+            tuple(window.reference_imageij.tolist()),
+            tuple(window.reference_imagexy.tolist()),
+            tuple(window.pixelscale.flatten().tolist()),
+            AP_config.ap_dtype,
+            str(AP_config.ap_device),
+        )
+
+    def get(self, window, kind, compute):
+        """Return the cached grid of `kind` for `window`, or evaluate
+        `compute()` and store the result.
+
+        """
+        key = self.make_key(window, kind) if self.enabled else None
+        if key is None:
+            return compute()
+
+        grid = self._entries.get(key, None)
+        if grid is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return grid
+        self.misses += 1
+
+        grid = compute()
+        size = grid.element_size() * grid.numel()
+        if size > self.max_bytes:
+            return grid
+        self._entries[key] = grid
+        self.nbytes += size
+        while self.nbytes > self.max_bytes or len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+        return grid
+
+    def _remove(self, key):
+        grid = self._entries.pop(key)
+        self.nbytes -= grid.element_size() * grid.numel()
+
+    @property
+    def hit_rate(self):
+        """Fraction of grid requests served from the cache"""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self):
+        """Summary of the cache usage as a dictionary"""
+        return {
+            "entries": len(self),
+            "nbytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
+
+    def clear(self):
+        """Remove all cached grids and reset the hit/miss counters"""
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return f"Grid_Cache: {len(self)} entries, {self.nbytes / 2**20:.1f}MB, hits: {self.hits}, misses: {self.misses}, hit rate: {self.hit_rate:.2f}"
+
+
+# Shared cache of window coordinate grids
+coordinate_grid_cache = Grid_Cache()
 
 
 class Window(WCS):
@@ -364,6 +487,33 @@ class Window(WCS):
         self.pixel_shape = pixels[:, 1] - pixels[:, 0]
         return self
 
+    def chunk_pixels(self, chunksize):
+        """Break the window into a grid of sub windows with at most
+        `chunksize` pixels on a side. Yields each sub window along with
+        the pixel range it covers in this window in the format:
+        [[xmin, xmax],[ymin,ymax]]
+
+        """
+        pixel_shape = np.int64(self.pixel_shape.detach().cpu().numpy())
+        Ncells = np.int64(np.ceil(pixel_shape / chunksize))
+        # Round the cell size up so that no cell, including the last, is larger than chunksize
+        cellsize = np.int64(np.ceil(pixel_shape / Ncells))
+
+        for nx in range(Ncells[0]):
+            for ny in range(Ncells[1]):
+                # The last cell takes the remaining pixels up to the edge
+                pixels = (
+                    (
+                        int(cellsize[0] * nx),
+                        int(pixel_shape[0] if nx == Ncells[0] - 1 else cellsize[0] * (nx + 1)),
+                    ),
+                    (
+                        int(cellsize[1] * ny),
+                        int(pixel_shape[1] if ny == Ncells[1] - 1 else cellsize[1] * (ny + 1)),
+                    ),
+                )
+                yield self.copy().crop_to_pixel(pixels), pixels
+
     def pad_pixel(self, pixels):
         """
         [pad all sides] or
@@ -393,6 +543,10 @@ class Window(WCS):
         of every pixel.
 
         """
+        return coordinate_grid_cache.get(self, "center", self._get_coordinate_meshgrid)
+
+    @torch.no_grad()
+    def _get_coordinate_meshgrid(self):
         pix = self.pixel_shape.to(dtype=AP_config.ap_dtype)
         xsteps = torch.arange(pix[0], dtype=AP_config.ap_dtype, device=AP_config.ap_device)
         ysteps = torch.arange(pix[1], dtype=AP_config.ap_dtype, device=AP_config.ap_device)
@@ -410,6 +564,10 @@ class Window(WCS):
         of every pixel.
 
         """
+        return coordinate_grid_cache.get(self, "corner", self._get_coordinate_corner_meshgrid)
+
+    @torch.no_grad()
+    def _get_coordinate_corner_meshgrid(self):
         pix = self.pixel_shape.to(dtype=AP_config.ap_dtype)
         xsteps = (
             torch.arange(pix[0] + 1, dtype=AP_config.ap_dtype, device=AP_config.ap_device) - 0.5
@@ -433,6 +591,10 @@ class Window(WCS):
         points than the standard :meth:`get_coordinate_meshgrid`.
 
         """
+        return coordinate_grid_cache.get(self, "simps", self._get_coordinate_simps_meshgrid)
+
+    @torch.no_grad()
+    def _get_coordinate_simps_meshgrid(self):
         pix = self.pixel_shape.to(dtype=AP_config.ap_dtype)
         xsteps = (
             0.5
@@ -1,35 +1,73 @@
 from typing import Optional, Union
 import io
 from copy import deepcopy
+from types import SimpleNamespace
 
 import numpy as np
 import torch
 from torch.autograd.functional import jacobian as torchjac
+import torch.autograd.forward_ad as fwAD
 
 from ..param import Parameter_Node, Param_Mask
-from ..utils.decorators import default_internal
+from ..utils.decorators import default_internal, profiled
 from ..utils.interpolate import (
     _shift_Lanczos_kernel_torch,
     simpsons_kernel,
     curvature_kernel,
-    interp2d,
 )
 from ..image import (
     Window,
     Jacobian_Image,
+    Jacobian_Blocks,
     Window_List,
     PSF_Image,
 )
 from ..utils.operations import (
     fft_convolve_torch,
+    small_kernel_rfft2,
+    psf_fft_cache,
     grid_integrate,
+    grid_integrate_plan,
+    plan_integrate,
     single_quad_integrate,
+    bucket_size,
+    compile_cache,
 )
+from ..utils.profiling import profiler
 from ..errors import SpecificationConflict
 from .core_model import AstroPhot_Model
 from .. import AP_config
 
 
+class _Batch_Value:
+    """Holds the value of one parameter for `_Batch_Parameters`"""
+
+    prof = None
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Batch_Parameters:
+    """Stand in for the Parameter_Node of a model while it is evaluated
+    with plain tensors, for example a batch of models evaluated with
+    ``torch.vmap`` or a compiled evaluation. Indexing by parameter name
+    gives an object holding the value for the model being evaluated.
+
+    """
+
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, key):
+        return _Batch_Value(self.values.get(key, None))
+
+
+def _compiled_evaluate_kernel(model, X, Y, values, image):
+    """Function which is passed to torch.compile by `_evaluate_sample`"""
+    return model.evaluate_model(X=X, Y=Y, image=image, parameters=_Batch_Parameters(values))
+
+
 @default_internal
 def angular_metric(self, X, Y, image=None, parameters=None):
     return torch.atan2(Y, X)
@@ -79,11 +117,102 @@ def build_parameters(self):
             raise ValueError(f"unrecognized parameter specification for {p}")
 
 
+def _precision_dtype(self):
+    """The dtype used to evaluate the model brightness and psf
+    convolution, float32 in mixed precision mode or None if the
+    evaluation uses ``AP_config.ap_dtype``. The model
+    ``precision_mode`` overrides ``AP_config.ap_precision_mode``.
+
+    """
+    mode = AP_config.ap_precision_mode if self.precision_mode is None else self.precision_mode
+    if mode == "full":
+        return None
+    elif mode == "mixed":
+        return None if AP_config.ap_dtype == torch.float32 else torch.float32
+    raise SpecificationConflict(
+        f"{self.name} has unknown precision mode: {mode}. Should be one of: full, mixed"
+    )
+
+
+def _evaluate_sample(self, X=None, Y=None, image=None, parameters=None, **kwargs):
+    """Evaluate the model brightness for the sampling and integration
+    steps. By default this is simply `evaluate_model`. When
+    ``compile_mode`` is set the evaluation is run with
+    ``torch.compile``, the coordinates are padded (replicating the
+    edge) to a bucketed shape so that windows of similar size share
+    one compiled artefact (see `Compile_Cache`). Evaluations carrying
+    forward mode derivatives, such as the jacobian, and models with
+    profile parameters are always evaluated eagerly.
+
+    In mixed precision mode the coordinates (already relative to the
+    model center) and parameter values are cast to float32 for the
+    evaluation and the brightness is returned as
+    ``AP_config.ap_dtype``, so the sums over sub pixels and pixels
+    which follow are accumulated in full precision.
+
+    """
+    dtype = self._precision_dtype()
+    mixed = dtype is not None and X is not None and X.dtype != dtype
+    eager = lambda: self.evaluate_model(X=X, Y=Y, image=image, parameters=parameters, **kwargs)
+    if not mixed and (self.compile_mode is None or X.dim() != 2 or len(kwargs) > 0):
+        return eager()
+    values = {}
+    traced = False
+    for name, node in parameters.nodes.items():
+        if node.prof is not None:
+            return eager()
+        value = node.value
+        if isinstance(value, torch.Tensor):
+            traced = traced or fwAD.unpack_dual(value).tangent is not None
+            if mixed:
+                value = value.to(dtype)
+        values[name] = value
+    if mixed:
+        X, Y = X.to(dtype), Y.to(dtype)
+        parameters = _Batch_Parameters(values)
+        eager = lambda: self.evaluate_model(
+            X=X, Y=Y, image=image, parameters=parameters, **kwargs
+        ).to(AP_config.ap_dtype)
+    if self.compile_mode is None or X.dim() != 2 or len(kwargs) > 0 or traced:
+        return eager()
+
+    shape = tuple(X.shape)
+    padded = tuple(bucket_size(size, self.compile_bucket) for size in shape)
+    pad = (0, padded[1] - shape[1], 0, padded[0] - shape[0])
+    key = (
+        type(self),
+        padded,
+        self.sampling_mode,
+        X.dtype,
+        str(X.device),
+        self.compile_mode,
+        self.compile_backend,
+    )
+    result = compile_cache.run(
+        key,
+        _compiled_evaluate_kernel,
+        (
+            self,
+            torch.nn.functional.pad(X.unsqueeze(0), pad, mode="replicate").squeeze(0),
+            torch.nn.functional.pad(Y.unsqueeze(0), pad, mode="replicate").squeeze(0),
+            values,
+            SimpleNamespace(pixel_area=image.pixel_area, north=image.north),
+        ),
+        lambda: torch.nn.functional.pad(eager().unsqueeze(0), pad).squeeze(0),
+        mode=None if self.compile_mode == "default" else self.compile_mode,
+        backend=self.compile_backend,
+    )
+    return result[: shape[0], : shape[1]].to(AP_config.ap_dtype)
+
+
 def _sample_init(self, image, parameters, center):
     if self.sampling_mode == "midpoint":
         Coords = image.get_coordinate_meshgrid()
         X, Y = Coords - center[..., None, None]
-        mid = self.evaluate_model(X=X, Y=Y, image=image, parameters=parameters)
+        mid = self._evaluate_sample(X=X, Y=Y, image=image, parameters=parameters)
+        # too few pixels to estimate the curvature (can happen for thin slices of a window)
+        if min(mid.shape) < 3:
+            return mid, mid
         kernel = curvature_kernel(AP_config.ap_dtype, AP_config.ap_device)
         # convolve curvature kernel to numericall compute second derivative
         curvature = torch.nn.functional.pad(
@@ -99,7 +228,7 @@ def _sample_init(self, image, parameters, center):
     elif self.sampling_mode == "simpsons":
         Coords = image.get_coordinate_simps_meshgrid()
         X, Y = Coords - center[..., None, None]
-        dens = self.evaluate_model(X=X, Y=Y, image=image, parameters=parameters)
+        dens = self._evaluate_sample(X=X, Y=Y, image=image, parameters=parameters)
         kernel = simpsons_kernel(dtype=AP_config.ap_dtype, device=AP_config.ap_device)
         # midpoint is just every other sample in the simpsons grid
         mid = dens[1::2, 1::2]
@@ -115,7 +244,7 @@ def _sample_init(self, image, parameters, center):
             X=X,
             Y=Y,
             image_header=image.header,
-            eval_brightness=self.evaluate_model,
+            eval_brightness=self._evaluate_sample,
             eval_parameters=parameters,
             dtype=AP_config.ap_dtype,
             device=AP_config.ap_device,
@@ -125,12 +254,14 @@ def _sample_init(self, image, parameters, center):
     elif self.sampling_mode == "trapezoid":
         Coords = image.get_coordinate_corner_meshgrid()
         X, Y = Coords - center[..., None, None]
-        dens = self.evaluate_model(X=X, Y=Y, image=image, parameters=parameters)
+        dens = self._evaluate_sample(X=X, Y=Y, image=image, parameters=parameters)
         kernel = (
             torch.ones((1, 1, 2, 2), dtype=AP_config.ap_dtype, device=AP_config.ap_device) / 4.0
         )
         trapz = torch.nn.functional.conv2d(dens.view(1, 1, *dens.shape), kernel, padding="valid")
-        trapz = trapz.squeeze()
+        trapz = trapz.view(trapz.shape[-2:])
+        if min(trapz.shape) < 3:
+            return trapz, trapz
         kernel = curvature_kernel(AP_config.ap_dtype, AP_config.ap_device)
         curvature = torch.nn.functional.pad(
             torch.nn.functional.conv2d(
@@ -155,7 +286,7 @@ def _integrate_reference(self, image_data, image_header, parameters):
 def _sample_integrate(self, deep, reference, image, parameters, center):
     if self.integrate_mode == "none":
         pass
-    elif self.integrate_mode == "threshold":
+    elif self.integrate_mode in ("threshold", "stencil"):
         Coords = image.get_coordinate_meshgrid()
         X, Y = Coords - center[..., None, None]
         ref = self._integrate_reference(
@@ -163,46 +294,109 @@ def _sample_integrate(self, deep, reference, image, parameters, center):
         )  # fixme, error can be over 100% on initial sampling reference is invalid
         error = torch.abs((deep - reference))
         select = error > (self.sampling_tolerance * ref)
-        intdeep = grid_integrate(
-            X=X[select],
-            Y=Y[select],
-            image_header=image.header,
-            eval_brightness=self.evaluate_model,
-            eval_parameters=parameters,
-            dtype=AP_config.ap_dtype,
-            device=AP_config.ap_device,
-            quad_level=self.integrate_quad_level,
-            gridding=self.integrate_gridding,
-            max_depth=self.integrate_max_depth,
-            reference=self.sampling_tolerance * ref,
-        )
+        if profiler.enabled:
+            profiler.count("refined_pixels", torch.count_nonzero(select), self)
+        plan = self._integrate_cached_plan(select, image.header, parameters)
+        if plan is None:
+            intdeep, plan = grid_integrate_plan(
+                X=X[select],
+                Y=Y[select],
+                image_header=image.header,
+                eval_brightness=self._evaluate_sample,
+                eval_parameters=parameters,
+                dtype=AP_config.ap_dtype,
+                device=AP_config.ap_device,
+                quad_level=self.integrate_quad_level,
+                gridding=self.integrate_gridding,
+                max_depth=self.integrate_max_depth,
+                reference=self.sampling_tolerance * ref,
+            )
+            self._integrate_store_plan(plan, select, image.header, parameters)
+        else:
+            intdeep = plan_integrate(
+                X=X[select],
+                Y=Y[select],
+                plan=plan,
+                eval_brightness=self._evaluate_sample,
+                eval_parameters=parameters,
+            )
         deep[select] = intdeep
     else:
         raise SpecificationConflict(
-            f"{self.name} has unknown integration mode: {self.integrate_mode}. Should be one of: none, threshold"
+            f"{self.name} has unknown integration mode: {self.integrate_mode}. Should be one of: none, threshold, stencil"
         )
     return deep
 
 
+def _integrate_state(self, image_header, parameters):
+    """Values which determine the sub pixel integration plan, the
+    pixel grid, integration settings, and the (primal) parameter
+    values.
+
+    """
+    settings = (
+        tuple(image_header.pixelscale.detach().flatten().tolist()),
+        self.sampling_tolerance,
+        self.integrate_quad_level,
+        self.integrate_gridding,
+        self.integrate_max_depth,
+    )
+    values = tuple(
+        fwAD.unpack_dual(P.value).primal.detach().flatten()
+        for P in parameters.flat(include_locked=True, include_links=False).values()
+    )
+    if len(values) > 0:
+        values = torch.cat(values)
+    else:
+        values = torch.zeros(0, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+    return settings, values
+
+
+def _integrate_cached_plan(self, select, image_header, parameters):
+    """Returns the stored sub pixel integration plan if it is still
+    valid. The plan is reused while the same pixels are selected for
+    integration and no parameter has moved by more than
+    ``integrate_cache_tolerance`` (relative) since the plan was made.
+
+    """
+    cache = getattr(self, "_integrate_cache", None)
+    if cache is None or self.integrate_cache_tolerance is None:
+        return None
+    settings, values = self._integrate_state(image_header, parameters)
+    if (
+        settings != cache["settings"]
+        or select.shape != cache["select"].shape
+        or values.shape != cache["values"].shape
+        or not torch.equal(select, cache["select"])
+    ):
+        return None
+    limit = self.integrate_cache_tolerance * torch.clamp(torch.abs(cache["values"]), min=1.0)
+    if torch.any(torch.abs(values - cache["values"]) > limit):
+        return None
+    return cache["plan"]
+
+
+def _integrate_store_plan(self, plan, select, image_header, parameters):
+    if self.integrate_cache_tolerance is None:
+        return
+    settings, values = self._integrate_state(image_header, parameters)
+    self._integrate_cache = {
+        "settings": settings,
+        "values": values,
+        "select": select.detach().clone(),
+        "plan": plan,
+    }
+
+
 def _shift_psf(self, psf, shift, shift_method="bilinear", keep_pad=True):
     if shift_method == "bilinear":
-        psf_data = torch.nn.functional.pad(psf.data, (1, 1, 1, 1))
-        X, Y = torch.meshgrid(
-            torch.arange(
-                psf_data.shape[1],
-                dtype=AP_config.ap_dtype,
-                device=AP_config.ap_device,
-            )
-            - shift[0],
-            torch.arange(
-                psf_data.shape[0],
-                dtype=AP_config.ap_dtype,
-                device=AP_config.ap_device,
-            )
-            - shift[1],
-            indexing="xy",
-        )
-        shift_psf = interp2d(psf_data, X.clone(), Y.clone())
+        # Full convolution with the 3x3 shift kernel, so the flux is kept at the psf edges
+        kernel = self._shift_kernel(shift, shift_method)
+        psf_data = torch.nn.functional.pad(psf.data, (2, 2, 2, 2))
+        shift_psf = torch.nn.functional.conv2d(
+            psf_data.view(1, 1, *psf_data.shape),
+            torch.flip(kernel, dims=(0, 1)).view(1, 1, *kernel.shape),
+        ).squeeze()
         if not keep_pad:
             shift_psf = shift_psf[1:-1, 1:-1]
 
@@ -230,31 +424,251 @@ def _shift_psf(self, psf, shift, shift_method="bilinear", keep_pad=True):
     return shift_psf
 
 
-def _sample_convolve(self, image, shift, psf, shift_method="bilinear"):
-    """
-    image: Image object with image.data pixel matrix
-    shift: the amount of shifting to do in pixel units
-    psf: a PSF_Image object
+def _shift_kernel(self, shift, shift_method="bilinear"):
+    """Normalized kernel whose (full) convolution with a psf gives the
+    subpixel shifted psf of `_shift_psf`, ``(h + 2r, w + 2r)`` pixels
+    for a ``(h, w)`` psf and a kernel of ``2r + 1`` pixels.
+
     """
-    if shift is not None:
-        shift_psf = self._shift_psf(psf, shift, shift_method)
+    if shift_method == "bilinear":
+        # Linear interpolation weights, a zero shift takes the negative branch as a floor would
+        zero = torch.zeros_like(shift[0])
+        weights = list(
+            torch.where(s > 0, torch.stack((zero, 1 - s, s)), torch.stack((-s, 1 + s, zero)))
+            for s in (shift[0], shift[1])
+        )
+        kernel = torch.outer(weights[1], weights[0])
+    elif "lanczos" in shift_method:
+        lanczos_order = int(shift_method[shift_method.find(":") + 1 :])
+        # conv2d correlates, the same shift by convolution uses the flipped kernel
+        kernel = torch.flip(
+            _shift_Lanczos_kernel_torch(
+                -shift[0],
+                -shift[1],
+                lanczos_order,
+                AP_config.ap_dtype,
+                AP_config.ap_device,
+            ),
+            dims=(0, 1),
+        )
     else:
-        shift_psf = psf.data
-    shift_psf = shift_psf / torch.sum(shift_psf)
+        raise SpecificationConflict(f"unrecognized subpixel shift method: {shift_method}")
+    return kernel / torch.sum(kernel)
+
+
+def _psf_kernel(self, shape, shift, psf, shift_method="bilinear", dtype=None):
+    """Normalized (and possibly shifted) psf ready to convolve with an
+    image of the given pixel shape. For fft convolution this is the
+    rfft2 of the psf along with the psf pixel shape, for direct
+    convolution it is the psf pixels. If `dtype` is given the psf is
+    cast to it after normalizing.
+
+    The normalized unshifted psf (or its rfft2) is cached for a fixed
+    psf image. For fft convolution a subpixel shift is then applied
+    in Fourier space as the product with the transform of the small
+    shift kernel (see `_shift_kernel`), so shifted kernels reuse the
+    cached transform.
+
+    """
+
+    def normalized_psf(shift=None):
+        if shift is not None:
+            shift_psf = self._shift_psf(psf, shift, shift_method)
+        else:
+            shift_psf = psf.data
+        shift_psf = shift_psf / torch.sum(shift_psf)
+        return shift_psf if dtype is None else shift_psf.to(dtype)
+
+    def transformed_psf():
+        shift_psf = normalized_psf()
+        return torch.fft.rfft2(shift_psf, s=shape), shift_psf.shape
+
+    key = None
+    if psf is self.psf:
+        key = psf_fft_cache.make_key(psf.data, self.psf_convolve_mode, tuple(shape), dtype)
 
     if self.psf_convolve_mode == "fft":
-        image.data = fft_convolve_torch(image.data, shift_psf, img_prepadded=True)
+        if shift is None:
+            return psf_fft_cache.get(key, psf.data, transformed_psf)
+        kernel = self._shift_kernel(shift, shift_method)
+        psf_shape = tuple(p + k - 1 for p, k in zip(psf.data.shape, kernel.shape))
+        if psf_shape[0] > shape[0] or psf_shape[1] > shape[1]:
+            # The shifted psf would not fit in the padded image
+            shift_psf = normalized_psf(shift)
+            return torch.fft.rfft2(shift_psf, s=shape), shift_psf.shape
+        psf_fft, _ = psf_fft_cache.get(key, psf.data, transformed_psf)
+        if dtype is not None:
+            kernel = kernel.to(dtype)
+        return psf_fft * small_kernel_rfft2(kernel, shape), psf_shape
     elif self.psf_convolve_mode == "direct":
-        image.data = torch.nn.functional.conv2d(
-            image.data.view(1, 1, *image.data.shape),
+        if shift is None:
+            return psf_fft_cache.get(key, psf.data, normalized_psf)
+        return normalized_psf(shift)
+    raise ValueError(f"unrecognized psf_convolve_mode: {self.psf_convolve_mode}")
+
+
+def _convolve_data(self, data, shift, psf, shift_method="bilinear"):
+    """Convolve a pixel matrix with the (possibly shifted) psf. The
+    matrix should include a border of at least
+    ``psf.psf_border_int`` pixels on each side, within which the
+    result is not valid.
+
+    """
+    dtype = self._precision_dtype()
+    if dtype is not None:
+        data = data.to(dtype)
+    kernel = self._psf_kernel(data.shape, shift, psf, shift_method, dtype=dtype)
+    if self.psf_convolve_mode == "fft":
+        psf_fft, psf_shape = kernel
+        data = fft_convolve_torch(
+            data, psf_fft, psf_fft=True, img_prepadded=True, psf_shape=psf_shape
+        )
+    else:
+        data = torch.nn.functional.conv2d(
+            data.view(1, 1, *data.shape),
             torch.flip(
-                shift_psf.view(1, 1, *shift_psf.shape),
+                kernel.view(1, 1, *kernel.shape),
                 dims=(2, 3),
             ),
             padding="same",
         ).squeeze()
+    return data.to(AP_config.ap_dtype)
+
+
+def _sample_convolve(self, image, shift, psf, shift_method="bilinear"):
+    """
+    image: Image object with image.data pixel matrix
+    shift: the amount of shifting to do in pixel units
+    psf: a PSF_Image object
+    """
+
+    image.data = self._convolve_data(image.data, shift, psf, shift_method)
+
+
+def _psf_window(self, image, deep, psf, parameters):
+    """Pixel bounds ``((row start, row stop), (column start, column
+    stop))`` of the core region which is convolved when ``psf_mode``
+    is window. With ``psf_window_radius`` the core is a square of that
+    half width (arcsec) around the model center. Otherwise the core
+    covers the pixels where convolution would change the model by
+    more than a tolerance, estimated from the laplacian of
+    the samples as ``sigma^2 / 2 * laplacian`` where ``sigma^2`` is the
+    psf variance along one axis, relative to the larger of the pixel
+    value and the integration reference (see `_integrate_reference`).
+    The tolerance is ``psf_window_tolerance``. The core always
+    includes the psf footprint around the center.
+
+    """
+    H, W = deep.shape
+    border_x, border_y = psf.psf_border_int.tolist()
+    center = fwAD.unpack_dual(parameters["center"].value).primal
+    center_x, center_y = image.plane_to_pixel(center).detach().tolist()
+    if self.psf_window_radius is not None:
+        radius = float(self.psf_window_radius / image.pixel_length)
+        bounds = [center_y - radius, center_y + radius, center_x - radius, center_x + radius]
     else:
-        raise ValueError(f"unrecognized psf_convolve_mode: {self.psf_convolve_mode}")
+        bounds = [
+            center_y - border_y,
+            center_y + border_y,
+            center_x - border_x,
+            center_x + border_x,
+        ]
+        if min(H, W) >= 3:
+            data = fwAD.unpack_dual(deep).primal.detach()
+            psf_data = psf.data.detach()
+            psf_data = psf_data / torch.sum(psf_data)
+            psf_y = torch.arange(psf_data.shape[0], dtype=psf_data.dtype, device=psf_data.device)
+            psf_x = torch.arange(psf_data.shape[1], dtype=psf_data.dtype, device=psf_data.device)
+            psf_y = psf_y - torch.sum(psf_data * psf_y[:, None])
+            psf_x = psf_x - torch.sum(psf_data * psf_x[None, :])
+            variance = torch.sum(psf_data * (psf_y[:, None] ** 2 + psf_x[None, :] ** 2)) / 2
+            laplacian = torch.nn.functional.pad(
+                torch.nn.functional.conv2d(
+                    data.view(1, 1, *data.shape),
+                    curvature_kernel(data.dtype, data.device).view(1, 1, 3, 3),
+                    padding="valid",
+                ),
+                (1, 1, 1, 1),
+                mode="replicate",
+            ).squeeze()
+            ref = fwAD.unpack_dual(self._integrate_reference(data, image.header, parameters)).primal
+            select = variance / 2 * torch.abs(laplacian) > self.psf_window_tolerance * torch.clamp(
+                torch.abs(data), min=ref
+            )
+            rows = torch.nonzero(torch.any(select, dim=1)).flatten()
+            cols = torch.nonzero(torch.any(select, dim=0)).flatten()
+            if len(rows) > 0:
+                bounds = [
+                    min(bounds[0], rows[0].item()),
+                    max(bounds[1], rows[-1].item()),
+                    min(bounds[2], cols[0].item()),
+                    max(bounds[3], cols[-1].item()),
+                ]
+    return (
+        (max(0, int(np.floor(bounds[0]))), min(H, int(np.ceil(bounds[1])) + 1)),
+        (max(0, int(np.floor(bounds[2]))), min(W, int(np.ceil(bounds[3])) + 1)),
+    )
+
+
+def _sample_convolve_window(self, image, shift, psf, core, shift_method="bilinear"):
+    """Convolve only the `core` region (see `_psf_window`) of the image
+    with the psf, the rest of the image is passed through. Only a sub
+    image of the core plus twice the psf border is convolved, which
+    gives the exact convolution for the core and a band of one psf
+    border around it. Across that band the result blends linearly
+    from the convolved to the unconvolved pixels so there is no step
+    at the edge of the core.
+
+    The samples are taken on a grid moved by the subpixel `shift`,
+    which the shifted psf moves back in the core. The passed through
+    pixels are moved back by convolving them with the small shift
+    kernel alone (see `_shift_kernel`).
+
+    """
+    (row_start, row_stop), (col_start, col_stop) = core
+    passthrough = image.data
+    if shift is not None:
+        kernel = self._shift_kernel(shift, shift_method)
+        passthrough = torch.nn.functional.conv2d(
+            passthrough.view(1, 1, *passthrough.shape),
+            torch.flip(kernel, dims=(0, 1)).view(1, 1, *kernel.shape),
+            padding="same",
+        ).squeeze()
+    if row_stop <= row_start or col_stop <= col_start:
+        image.data = passthrough
+        return
+    H, W = image.data.shape
+    border_x, border_y = psf.psf_border_int.tolist()
+
+    # Region which blends between convolved and unconvolved pixels
+    blend = (
+        slice(max(0, row_start - border_y), min(H, row_stop + border_y)),
+        slice(max(0, col_start - border_x), min(W, col_stop + border_x)),
+    )
+    # Region which is convolved, the blend region is exact within it
+    sub = (
+        slice(max(0, row_start - 2 * border_y), min(H, row_stop + 2 * border_y)),
+        slice(max(0, col_start - 2 * border_x), min(W, col_stop + 2 * border_x)),
+    )
+    convolved = self._convolve_data(image.data[sub], shift, psf, shift_method)[
+        blend[0].start - sub[0].start : blend[0].stop - sub[0].start,
+        blend[1].start - sub[1].start : blend[1].stop - sub[1].start,
+    ]
+
+    def ramp(start, stop, core_start, core_stop, border):
+        index = torch.arange(start, stop, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        distance = torch.clamp(core_start - index, min=0) + torch.clamp(
+            index - (core_stop - 1), min=0
+        )
+        return 1 - distance / (border + 1)
+
+    weight = (
+        ramp(blend[0].start, blend[0].stop, row_start, row_stop, border_y)[:, None]
+        * ramp(blend[1].start, blend[1].stop, col_start, col_stop, border_x)[None, :]
+    )
+    data = passthrough.clone()
+    data[blend] = weight * convolved + (1 - weight) * passthrough[blend]
+    image.data = data
 
 
 @torch.no_grad()
@@ -290,6 +704,38 @@ def jacobian(
     Returns:
       Jacobian_Image: A Jacobian_Image object containing the computed Jacobian matrix.
 
+    """
+    return self.value_and_jacobian(
+        parameters=parameters,
+        as_representation=as_representation,
+        window=window,
+        pass_jacobian=pass_jacobian,
+        **kwargs,
+    )[1]
+
+
+@torch.no_grad()
+@profiled("jacobian")
+def value_and_jacobian(
+    self,
+    parameters: Optional[torch.Tensor] = None,
+    as_representation: bool = False,
+    window: Optional[Window] = None,
+    pass_jacobian: Optional[Jacobian_Image] = None,
+    **kwargs,
+):
+    """Compute the model image and the Jacobian matrix for this model in a
+    single pass.
+
+    Forward mode automatic differentiation evaluates the model image
+    (the primal) alongside every column of the Jacobian, so the model
+    image is captured from the same traversal rather than sampling
+    the model a second time. See `jacobian` for details on the
+    arguments.
+
+    Returns:
+      Tuple[Model_Image, Jacobian_Image]: The sampled model and its Jacobian
+
     """
     if window is None:
         window = self.window
@@ -298,9 +744,12 @@ def jacobian(
             window = window.window_list[pass_jacobian.index(self.target)]
         window = self.window & window
 
-    # skip jacobian calculation if no parameters match criteria
-    if torch.sum(self.parameters.vector_mask()) == 0 or window.overlap_frac(self.window) <= 0:
-        return self.target[window].jacobian_image()
+    # skip the calculation if the window doesn't overlap the model
+    if torch.any(window.pixel_shape <= 0) or window.overlap_frac(self.window) <= 0:
+        return (
+            self.target[self.window].model_image(),
+            self.target[self.window].jacobian_image(),
+        )
 
     # Set the parameters if provided and check the size of the parameter list
     if parameters is not None:
@@ -308,6 +757,11 @@ def jacobian(
             self.parameters.vector_set_representation(parameters)
         else:
             self.parameters.vector_set_values(parameters)
+
+    # no jacobian needed if no parameters match criteria
+    if torch.sum(self.parameters.vector_mask()) == 0:
+        return self(window=window), self.target[self.window].jacobian_image()
+
     if torch.sum(self.parameters.vector_mask()) > self.jacobian_chunksize:
         return self._chunk_jacobian(
             as_representation=as_representation,
@@ -321,30 +775,83 @@ def jacobian(
             **kwargs,
         )
 
-    # Compute the jacobian
-    full_jac = torchjac(
-        lambda P: self(
+    # Compute the jacobian, the model image is the primal of the forward mode evaluation
+    primal = []
+
+    def model_data(P):
+        model = self(
             image=None,
             parameters=P,
             as_representation=as_representation,
             window=window,
-        ).data,
-        (
-            self.parameters.vector_representation().detach()
-            if as_representation
-            else self.parameters.vector_values().detach()
-        ),
-        strategy="forward-mode",
-        vectorize=True,
-        create_graph=False,
-    )
+        )
+        primal.append((model, fwAD.unpack_dual(model.data).primal))
+        return model.data
+
+    with profiler.stage("torchjac", self):
+        full_jac = torchjac(
+            model_data,
+            (
+                self.parameters.vector_representation().detach()
+                if as_representation
+                else self.parameters.vector_values().detach()
+            ),
+            strategy="forward-mode",
+            vectorize=True,
+            create_graph=False,
+        )
+    profiler.allocation("jacobian", full_jac, self)
 
     # Store the jacobian as a Jacobian_Image object
     jac_img = self.target[window].jacobian_image(
         parameters=self.parameters.vector_identities(),
         data=full_jac,
     )
-    return jac_img
+    model_img, model_data = primal[0]
+    model_img.data = model_data
+    return model_img, jac_img
+
+
+@torch.no_grad()
+def block_jacobian(
+    self,
+    parameters: Optional[torch.Tensor] = None,
+    as_representation: bool = False,
+    window: Optional[Window] = None,
+    pass_jacobian: Optional[Jacobian_Blocks] = None,
+    **kwargs,
+):
+    """Compute the Jacobian for this model and store it as a block in a
+    `Jacobian_Blocks` object. For a single model this holds the same
+    information as the `jacobian` method, it is mostly used to let
+    group models collect the jacobians of their components without
+    building a dense Npixels * Nparameters tensor.
+
+    Args:
+      parameters (Optional[torch.Tensor]): A 1D parameter tensor to override the current model's parameters.
+      as_representation (bool): Indicates if the parameters argument is provided as real values or representations in the (-inf, inf) range. Default is False.
+      window (Optional[Window]): A window object specifying the region of interest in the image.
+      pass_jacobian (Optional[Jacobian_Blocks]): A block jacobian to add this model's block into.
+
+    Returns:
+      Jacobian_Blocks: the block jacobian with this model's block added.
+
+    """
+    if pass_jacobian is None:
+        pass_jacobian = Jacobian_Blocks(
+            parameters=self.parameters.vector_identities(),
+            target=self.target[self.window if window is None else window],
+        )
+    elif isinstance(window, Window_List):
+        window = window.window_list[pass_jacobian.index(self.target)]
+
+    pass_jacobian += self.jacobian(
+        parameters=parameters,
+        as_representation=as_representation,
+        window=window,
+        **kwargs,
+    )
+    return pass_jacobian
 
 
 @torch.no_grad()
@@ -364,7 +871,7 @@ def _chunk_image_jacobian(
     the full Jacobian as a separate tensor.
 
     This is for internal use and should be called by the
-    `self.jacobian` function when appropriate.
+    `self.value_and_jacobian` function when appropriate.
 
     """
 
@@ -373,27 +880,16 @@ def _chunk_image_jacobian(
         parameters=pids,
     )
 
-    pixel_shape = window.pixel_shape.detach().cpu().numpy()
-    Ncells = np.int64(np.round(np.ceil(pixel_shape / self.image_chunksize)))
-    cellsize = np.int64(np.round(window.pixel_shape / Ncells))
-
-    for nx in range(Ncells[0]):
-        for ny in range(Ncells[1]):
-            subwindow = window.copy()
-            subwindow.crop_to_pixel(
-                (
-                    (cellsize[0] * nx, min(pixel_shape[0], cellsize[0] * (nx + 1))),
-                    (cellsize[1] * ny, min(pixel_shape[1], cellsize[1] * (ny + 1))),
-                )
-            )
-            jac_img += self.jacobian(
-                parameters=None,
-                as_representation=as_representation,
-                window=subwindow,
-                **kwargs,
-            )
+    for subwindow, _ in window.chunk_pixels(self.image_chunksize):
+        jac_img += self.jacobian(
+            parameters=None,
+            as_representation=as_representation,
+            window=subwindow,
+            **kwargs,
+        )
 
-    return jac_img
+    # sampling in sub-images slightly changes the integration, so the model image is sampled on the full window
+    return self(window=window), jac_img
 
 
 @torch.no_grad()
@@ -411,8 +907,8 @@ def _chunk_jacobian(
     list of parameters into chunks as determined by
     `self.jacobian_chunksize` evaluates the Jacobian only for those,
     it then builds up the full Jacobian as a separate tensor. This is
-    for internal use and should be called by the `self.jacobian`
-    function when appropriate.
+    for internal use and should be called by the
+    `self.value_and_jacobian` function when appropriate.
 
     """
     pids = self.parameters.vector_identities()
@@ -420,18 +916,23 @@ def _chunk_jacobian(
         parameters=pids,
     )
 
+    model_img = None
     for ichunk in range(0, len(pids), self.jacobian_chunksize):
         mask = torch.zeros(len(pids), dtype=torch.bool, device=AP_config.ap_device)
         mask[ichunk : ichunk + self.jacobian_chunksize] = True
         with Param_Mask(self.parameters, mask):
-            jac_img += self.jacobian(
+            sub_model, sub_jac = self.value_and_jacobian(
                 parameters=None,
                 as_representation=as_representation,
                 window=window,
                 **kwargs,
             )
+        # every chunk samples the full model image, only the first needs to be kept
+        if model_img is None:
+            model_img = sub_model
+        jac_img += sub_jac
 
-    return jac_img
+    return model_img, jac_img
 
 
 def load(self, filename: Union[str, dict, io.TextIOBase] = "AstroPhot.yaml", new_name=None):
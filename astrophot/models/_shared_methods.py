@@ -1,8 +1,9 @@
 import functools
 
-from scipy.stats import binned_statistic, iqr
+from scipy.stats import iqr
 import numpy as np
 import torch
+import torch.autograd.forward_ad as fwAD
 from scipy.optimize import minimize
 
 from ..utils.initialize import isophotes
@@ -13,7 +14,13 @@ from ..utils.parametric_profiles import (
     spline_torch,
     moffat_torch,
     nuker_torch,
+    sersic_torch_derivatives,
+    gaussian_torch_derivatives,
+    exponential_torch_derivatives,
+    moffat_torch_derivatives,
+    nuker_torch_derivatives,
 )
+from ..utils.operations import binned_percentiles
 from ..utils.conversions.coordinates import (
     Rotate_Cartesian,
 )
@@ -89,11 +96,8 @@ def _sample_image(image, transform, metric, parameters, rad_bins=None):
     else:
         rad_bins = np.array(rad_bins)
     raveldat = dat.ravel()
-    I = (
-        binned_statistic(R, raveldat, statistic="median", bins=rad_bins)[0]
-    ) / image.pixel_area.item()
-    sigma = lambda d: iqr(d, rng=[16, 84]) / 2
-    S = binned_statistic(R, raveldat, statistic=sigma, bins=rad_bins)[0] / image.pixel_area.item()
+    low, I, high = binned_percentiles(R, raveldat, rad_bins) / image.pixel_area.item()
+    S = (high - low) / 2
     R = (rad_bins[:-1] + rad_bins[1:]) / 2
 
     # Ensure enough values are positive
@@ -116,6 +120,32 @@ def _sample_image(image, transform, metric, parameters, rad_bins=None):
     return R, I, S
 
 
+def _hessian_uncertainty(residual, x):
+    """Estimate the uncertainty of the best fit parameters of a least
+    squares problem from the curvature at the minimum. The jacobian of
+    the residuals is found by central finite differences, then the
+    covariance is approximated as ``s^2 (J^T J)^-1`` where ``s^2`` is
+    the residual variance. This needs ``2 * len(x)`` evaluations of
+    the residuals instead of a full refit for each bootstrap sample.
+
+    """
+    x = np.array(x, dtype=np.float64)
+    r = residual(x)
+    J = np.zeros((len(r), len(x)))
+    for i in range(len(x)):
+        h = 1e-5 * max(abs(x[i]), 1.0)
+        step = np.zeros(len(x))
+        step[i] = h
+        J[:, i] = (residual(x + step) - residual(x - step)) / (2 * h)
+    # Samples where the profile is not defined (eg log of a negative) carry no information
+    finite = np.isfinite(r) & np.all(np.isfinite(J), axis=1)
+    r = r[finite]
+    J = J[finite]
+    s2 = np.sum(r**2) / max(1, len(r) - len(x))
+    cov = s2 * np.linalg.pinv(J.T @ J)
+    return np.sqrt(np.abs(np.diag(cov)))
+
+
 # General parametric
 ######################################################################
 @torch.no_grad()
@@ -147,19 +177,20 @@ def parametric_initialize(
             f"initialization fit not successful for {model.name}, falling back to defaults"
         )
 
-    if force_uncertainty is None:
+    if force_uncertainty is None and model.initialize_uncertainty == "hessian":
+        unc = _hessian_uncertainty(lambda x: I - np.log10(prof_func(R, *x)), res.x)
+    elif force_uncertainty is None:
         reses = []
         for i in range(10):
             N = np.random.randint(0, len(R), len(R))
             reses.append(minimize(optim, x0=x0, args=(R[N], I[N]), method="Nelder-Mead"))
+        unc = np.std(list(subres.x for subres in reses), axis=0)
     for param, resx, x0x in zip(params, res.x, x0):
         with Param_Unlock(parameters[param]), Param_SoftLimits(parameters[param]):
             if parameters[param].value is None:
                 parameters[param].value = resx if res.success else x0x
             if force_uncertainty is None and parameters[param].uncertainty is None:
-                parameters[param].uncertainty = np.std(
-                    list(subres.x[params.index(param)] for subres in reses)
-                )
+                parameters[param].uncertainty = unc[params.index(param)]
             elif force_uncertainty is not None:
                 parameters[param].uncertainty = force_uncertainty[params.index(param)]
 
@@ -245,7 +276,9 @@ def parametric_segment_initialize(
             x0=x0,
             method="Nelder-Mead",
         )
-        if force_uncertainty is None:
+        if force_uncertainty is None and model.initialize_uncertainty == "hessian":
+            segunc = _hessian_uncertainty(lambda x: flux - np.log10(prof_func(R, *x)), res.x)
+        elif force_uncertainty is None:
             reses = []
             for i in range(10):
                 N = np.random.randint(0, len(R), len(R))
@@ -256,11 +289,12 @@ def parametric_segment_initialize(
                         method="Nelder-Mead",
                     )
                 )
+            segunc = np.std(list(subres.x for subres in reses), axis=0)
         for i, param in enumerate(params):
             if was_none[i]:
                 val[param][r] = res.x[i] if res.success else x0[i]
                 if force_uncertainty is None and model[param].uncertainty is None:
-                    unc[r] = np.std(list(subres.x[params.index(param)] for subres in reses))
+                    unc[r] = segunc[params.index(param)]
                 elif force_uncertainty is not None:
                     unc[r] = force_uncertainty[params.index(param)][r]
 
@@ -276,6 +310,10 @@ def radial_evaluate_model(self, X=None, Y=None, image=None, parameters=None):
     if X is None:
         Coords = image.get_coordinate_meshgrid()
         X, Y = Coords - parameters["center"].value[..., None, None]
+    if self.jacobian_mode == "analytic":
+        analytic = analytic_evaluate_model(self, X, Y, image, parameters, inclined=False)
+        if analytic is not None:
+            return analytic
     return self.radial_model(
         self.radius_metric(X, Y, image=image, parameters=parameters),
         image=image,
@@ -288,6 +326,10 @@ def transformed_evaluate_model(self, X=None, Y=None, image=None, parameters=None
     if X is None or Y is None:
         Coords = image.get_coordinate_meshgrid()
         X, Y = Coords - parameters["center"].value[..., None, None]
+    if self.jacobian_mode == "analytic":
+        analytic = analytic_evaluate_model(self, X, Y, image, parameters, inclined=True)
+        if analytic is not None:
+            return analytic
     X, Y = self.transform_coordinates(X, Y, image, parameters)
     return self.radial_model(
         self.radius_metric(X, Y, image=image, parameters=parameters),
@@ -307,6 +349,78 @@ def inclined_transform_coordinates(self, X, Y, image=None, parameters=None):
     )
 
 
+# Analytic Jacobian
+######################################################################
+def analytic_evaluate_model(self, X, Y, image, parameters, inclined):
+    """Evaluate a radial model whose forward mode derivatives are built
+    from closed form partial derivatives. The coordinates and parameter
+    values are split into their primal and tangent, the brightness and
+    its partials with respect to the coordinates and each parameter are
+    computed once from the primals (see `radial_derivatives`), and the
+    tangent of the result is their sum weighted by the input
+    tangents. Everything downstream of the evaluation (integration and
+    psf convolution) is linear in the brightness, so it carries these
+    columns exactly as it would the automatic derivatives.
+
+    With `inclined` the coordinates are first rotated by the position
+    angle and scaled by the axis ratio as in
+    `inclined_transform_coordinates`.
+
+    Returns None if the model has no closed form derivatives or nothing
+    carries a tangent, in which case the standard evaluation should be
+    used.
+
+    """
+    from ._model_methods import _Batch_Parameters, radius_metric
+
+    if not hasattr(self, "radial_derivatives") or type(self).radius_metric is not radius_metric:
+        return None
+    if inclined and type(self).transform_coordinates is not inclined_transform_coordinates:
+        return None
+    X, tX = fwAD.unpack_dual(X)
+    Y, tY = fwAD.unpack_dual(Y)
+    values = {}
+    tangents = {}
+    for name in self._parameter_order:
+        if parameters[name].value is None or parameters[name].prof is not None:
+            return None
+        values[name], tangents[name] = fwAD.unpack_dual(parameters[name].value)
+    if tX is None and tY is None and all(T is None for T in tangents.values()):
+        return None
+    primal = _Batch_Parameters(values)
+
+    if inclined:
+        theta = values["PA"] - image.north
+        c, s = torch.cos(theta), torch.sin(theta)
+        q = values["q"]
+        Xs = c * X + s * Y
+        Ys = (c * Y - s * X) / q
+    else:
+        Xs, Ys = X, Y
+    R = self.radius_metric(Xs, Ys, image=image, parameters=primal)
+    I, dI_dR, partials = self.radial_derivatives(R, image=image, parameters=primal)
+    dI_dXs = dI_dR * Xs / R
+    dI_dYs = dI_dR * Ys / R
+
+    tangent = torch.zeros_like(I)
+    if inclined:
+        if tX is not None:
+            tangent = tangent + (dI_dXs * c - dI_dYs * s / q) * tX
+        if tY is not None:
+            tangent = tangent + (dI_dXs * s + dI_dYs * c / q) * tY
+        partials["PA"] = dI_dXs * q * Ys - dI_dYs * Xs / q
+        partials["q"] = -dI_dYs * Ys / q
+    else:
+        if tX is not None:
+            tangent = tangent + dI_dXs * tX
+        if tY is not None:
+            tangent = tangent + dI_dYs * tY
+    for name, partial in partials.items():
+        if tangents[name] is not None:
+            tangent = tangent + partial * tangents[name]
+    return fwAD.make_dual(I, tangent)
+
+
 # Exponential
 ######################################################################
 @default_internal
@@ -327,6 +441,13 @@ def exponential_iradial_model(self, i, R, image=None, parameters=None):
     )
 
 
+@default_internal
+def exponential_radial_derivatives(self, R, image=None, parameters=None):
+    Ie = image.pixel_area * 10 ** parameters["Ie"].value
+    I, dI_dR, dI_dRe, dI_dIe = exponential_torch_derivatives(R, parameters["Re"].value, Ie)
+    return I, dI_dR, {"Re": dI_dRe, "Ie": dI_dIe * Ie * np.log(10)}
+
+
 # Sersic
 ######################################################################
 @default_internal
@@ -349,6 +470,15 @@ def sersic_iradial_model(self, i, R, image=None, parameters=None):
     )
 
 
+@default_internal
+def sersic_radial_derivatives(self, R, image=None, parameters=None):
+    Ie = image.pixel_area * 10 ** parameters["Ie"].value
+    I, dI_dR, dI_dn, dI_dRe, dI_dIe = sersic_torch_derivatives(
+        R, parameters["n"].value, parameters["Re"].value, Ie
+    )
+    return I, dI_dR, {"n": dI_dn, "Re": dI_dRe, "Ie": dI_dIe * Ie * np.log(10)}
+
+
 # Moffat
 ######################################################################
 @default_internal
@@ -371,6 +501,15 @@ def moffat_iradial_model(self, i, R, image=None, parameters=None):
     )
 
 
+@default_internal
+def moffat_radial_derivatives(self, R, image=None, parameters=None):
+    I0 = image.pixel_area * 10 ** parameters["I0"].value
+    I, dI_dR, dI_dn, dI_dRd, dI_dI0 = moffat_torch_derivatives(
+        R, parameters["n"].value, parameters["Rd"].value, I0
+    )
+    return I, dI_dR, {"n": dI_dn, "Rd": dI_dRd, "I0": dI_dI0 * I0 * np.log(10)}
+
+
 # Nuker Profile
 ######################################################################
 @default_internal
@@ -397,6 +536,30 @@ def nuker_iradial_model(self, i, R, image=None, parameters=None):
     )
 
 
+@default_internal
+def nuker_radial_derivatives(self, R, image=None, parameters=None):
+    Ib = image.pixel_area * 10 ** parameters["Ib"].value
+    I, dI_dR, dI_dRb, dI_dIb, dI_dalpha, dI_dbeta, dI_dgamma = nuker_torch_derivatives(
+        R,
+        parameters["Rb"].value,
+        Ib,
+        parameters["alpha"].value,
+        parameters["beta"].value,
+        parameters["gamma"].value,
+    )
+    return (
+        I,
+        dI_dR,
+        {
+            "Rb": dI_dRb,
+            "Ib": dI_dIb * Ib * np.log(10),
+            "alpha": dI_dalpha,
+            "beta": dI_dbeta,
+            "gamma": dI_dgamma,
+        },
+    )
+
+
 # Gaussian
 ######################################################################
 @default_internal
@@ -417,6 +580,13 @@ def gaussian_iradial_model(self, i, R, image=None, parameters=None):
     )
 
 
+@default_internal
+def gaussian_radial_derivatives(self, R, image=None, parameters=None):
+    flux = image.pixel_area * 10 ** parameters["flux"].value
+    I, dI_dR, dI_dsigma, dI_dflux = gaussian_torch_derivatives(R, parameters["sigma"].value, flux)
+    return I, dI_dR, {"sigma": dI_dsigma, "flux": dI_dflux * flux * np.log(10)}
+
+
 # Spline
 ######################################################################
 @torch.no_grad()
@@ -519,19 +689,13 @@ def spline_segment_initialize(
             )
         TCHOOSE = TCHOOSE.ravel()
         I = (
-            binned_statistic(
-                R.ravel()[TCHOOSE], raveldat[TCHOOSE], statistic="median", bins=rad_bins
-            )[0]
+            binned_percentiles(R.ravel()[TCHOOSE], raveldat[TCHOOSE], rad_bins, (50,))[0]
         ) / target.pixel_area.item()
         N = np.isfinite(I)
         if not np.all(N):
             I[np.logical_not(N)] = np.interp(profR[np.logical_not(N)], profR[N], I[N])
-        S = binned_statistic(
-            R.ravel(),
-            raveldat,
-            statistic=lambda d: iqr(d, rng=[16, 84]) / 2,
-            bins=rad_bins,
-        )[0]
+        low, high = binned_percentiles(R.ravel(), raveldat, rad_bins, (16, 84))
+        S = (high - low) / 2
         N = np.isfinite(S)
         if not np.all(N):
             S[np.logical_not(N)] = np.interp(profR[np.logical_not(N)], profR[N], S[N])
@@ -611,17 +775,14 @@ def relspline_initialize(self, target=None, parameters=None, **kwargs):
     rad_bins = [profR[0]] + list((profR[:-1] + profR[1:]) / 2) + [profR[-1] * 100]
     raveldat = target_dat.ravel()
 
-    I = (
-        binned_statistic(R.ravel(), raveldat, statistic="median", bins=rad_bins)[0]
-    ) / target.pixel_area.item()
+    low, I, high = binned_percentiles(R.ravel(), raveldat, rad_bins)
+    I = I / target.pixel_area.item()
     N = np.isfinite(I)
     if not np.all(N):
         I[np.logical_not(N)] = np.interp(profR[np.logical_not(N)], profR[N], I[N])
     if I[-1] >= I[-2]:
         I[-1] = I[-2] / 2
-    S = binned_statistic(
-        R.ravel(), raveldat, statistic=lambda d: iqr(d, rng=[16, 84]) / 2, bins=rad_bins
-    )[0]
+    S = (high - low) / 2
     N = np.isfinite(S)
     if not np.all(N):
         S[np.logical_not(N)] = np.interp(profR[np.logical_not(N)], profR[N], S[N])
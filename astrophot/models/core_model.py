@@ -1,4 +1,5 @@
 import io
+import os
 from typing import Optional
 
 import torch
@@ -6,8 +7,8 @@ import yaml
 import numpy as np
 
 from ..utils.conversions.dict_to_hdf5 import dict_to_hdf5, hdf5_to_dict
-from ..utils.decorators import ignore_numpy_warnings, default_internal
-from ..image import Window, Target_Image, Target_Image_List
+from ..utils.decorators import ignore_numpy_warnings, default_internal, profiled
+from ..image import Window, Window_List, Target_Image, Target_Image_List
 from ..param import Parameter_Node
 from ._shared_methods import select_target, select_sample
 from .. import AP_config
@@ -22,6 +23,16 @@ def all_subclasses(cls):
     )
 
 
+def available_memory():
+    """Free memory in bytes on the device used by AstroPhot"""
+    if AP_config.ap_device != "cpu" and torch.cuda.is_available():
+        return torch.cuda.mem_get_info()[0]
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 2**30
+
+
 ######################################################################
 class AstroPhot_Model(object):
     """Core class for all AstroPhot models and model like objects. This
@@ -93,6 +104,10 @@ class AstroPhot_Model(object):
     default_uncertainty = 1e-2  # During initialization, uncertainty will be assumed 1% of initial value if no uncertainty is given
     usable = False
     model_names = []
+    # Fraction of the free device memory used by one chunk of `sample_vectors`
+    batch_memory_fraction = 0.25
+    # Approximate number of tensors the size of the window held for each vector in `sample_vectors`
+    batch_memory_factor = 16
     special_kwargs = ["parameters", "filename", "model_type", "usable"]
 
     def __new__(cls, *, filename=None, model_type=None, **kwargs):
@@ -255,6 +270,107 @@ class AstroPhot_Model(object):
 
         return chi2
 
+    def vector_batch_size(self, window=None):
+        """Number of parameter vectors which `sample_vectors` evaluates
+        together. This is estimated from the number of pixels in the
+        window so that a batch uses at most ``batch_memory_fraction``
+        of the free memory on the device.
+
+        """
+        if window is None:
+            window = self.window
+        if isinstance(window, Window_List):
+            npixels = sum(torch.prod(win.pixel_shape).item() for win in window.window_list)
+        else:
+            npixels = torch.prod(window.pixel_shape).item()
+        element_size = torch.tensor((), dtype=AP_config.ap_dtype).element_size()
+        per_vector = max(1, npixels) * element_size * self.batch_memory_factor
+        return max(1, int(self.batch_memory_fraction * available_memory() // per_vector))
+
+    @profiled("sample_vectors")
+    def sample_vectors(self, parameters, as_representation=False, window=None, batch_size=None):
+        """Sample the model for many parameter vectors at once. The model
+        parameters are left unchanged. Models which can be evaluated
+        as a batch (see ``Group_Model._batch_spec``) are sampled with
+        one vectorized call for each chunk of `batch_size` vectors,
+        other models are sampled one vector at a time.
+
+        Args:
+          parameters (torch.Tensor): 2D tensor of shape (B, N) where each row is a parameter vector, see ``parameters.vector_values``
+          as_representation (bool): Indicates if the parameters are given as representations in the (-inf,inf) range. Default False
+          window (Optional[Window]): Window in which to sample the model, default is the model window
+          batch_size (Optional[int]): Number of vectors evaluated together, default is set by ``vector_batch_size``
+
+        Returns:
+          torch.Tensor: tensor of shape (B, H, W) with the model pixels for each vector, or a tuple of these for each image when the target is a ``Target_Image_List``
+
+        """
+        if window is None:
+            window = self.window
+        parameters = torch.as_tensor(
+            parameters, dtype=AP_config.ap_dtype, device=AP_config.ap_device
+        )
+        if batch_size is None:
+            batch_size = self.vector_batch_size(window)
+        initial = self.parameters.vector_values().detach().clone()
+        try:
+            chunks = list(
+                self._sample_vector_chunk(chunk, as_representation, window)
+                for chunk in torch.split(parameters, batch_size)
+            )
+        finally:
+            self.parameters.vector_set_values(initial)
+        if isinstance(window, Window_List):
+            return tuple(torch.cat(images, dim=0) for images in zip(*chunks))
+        return torch.cat(chunks, dim=0)
+
+    def negative_log_likelihood_vectors(self, parameters, as_representation=False, batch_size=None):
+        """Negative log likelihood (see ``negative_log_likelihood``) for
+        many parameter vectors at once, evaluated with
+        ``sample_vectors``. The model parameters are left unchanged.
+
+        Returns:
+          torch.Tensor: 1D tensor with the negative log likelihood of each parameter vector
+
+        """
+        models = self.sample_vectors(
+            parameters, as_representation=as_representation, batch_size=batch_size
+        )
+        data = self.target[self.window]
+        if isinstance(data, Target_Image_List):
+            masks = data.mask if self.target.has_mask else (None,) * len(models)
+            return sum(
+                self._batch_chi2(mo, da.data, wgt, ma)
+                for mo, da, wgt, ma in zip(models, data, data.weight, masks)
+            )
+        return self._batch_chi2(
+            models, data.data, data.weight, data.mask if self.target.has_mask else None
+        )
+
+    @staticmethod
+    def _batch_chi2(models, data, weight, mask=None):
+        chi2 = (models - data) ** 2 * weight
+        if mask is not None:
+            return torch.sum(chi2[:, torch.logical_not(mask)], dim=-1) / 2.0
+        return torch.sum(chi2, dim=(-2, -1)) / 2.0
+
+    def _sample_vector_chunk(self, vectors, as_representation, window):
+        """Sample the model for each of a chunk of parameter vectors, see
+        ``sample_vectors``. Subclasses which can evaluate the vectors
+        together override this.
+
+        """
+        images = []
+        for vector in vectors:
+            if as_representation:
+                self.parameters.vector_set_representation(vector)
+            else:
+                self.parameters.vector_set_values(vector)
+            images.append(self.sample(window=window).data)
+        if isinstance(window, Window_List):
+            return tuple(torch.stack(data) for data in zip(*images))
+        return torch.stack(images)
+
     def jacobian(
         self,
         parameters=None,
@@ -262,6 +378,24 @@ class AstroPhot_Model(object):
     ):
         raise NotImplementedError("please use a subclass of AstroPhot_Model")
 
+    def value_and_jacobian(
+        self,
+        parameters=None,
+        as_representation=False,
+        window=None,
+        **kwargs,
+    ):
+        """Return the sampled model image and its jacobian. Subclasses which
+        can produce both from a single evaluation override this, by
+        default the model is simply sampled and then the jacobian is
+        computed.
+
+        """
+        jac = self.jacobian(
+            parameters=parameters, as_representation=as_representation, window=window, **kwargs
+        )
+        return self(window=window), jac
+
     @default_internal
     def total_flux(self, parameters=None, window=None):
         F = self(parameters=parameters, window=window, image=None)
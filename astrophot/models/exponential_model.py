@@ -72,6 +72,7 @@ class Exponential_Galaxy(Galaxy_Model):
         parametric_initialize(self, parameters, target, _wrap_exp, ("Re", "Ie"), _x0_func)
 
     from ._shared_methods import exponential_radial_model as radial_model
+    from ._shared_methods import exponential_radial_derivatives as radial_derivatives
 
 
 class Exponential_PSF(PSF_Model):
@@ -110,6 +111,7 @@ class Exponential_PSF(PSF_Model):
         parametric_initialize(self, parameters, target, _wrap_exp, ("Re", "Ie"), _x0_func)
 
     from ._shared_methods import exponential_radial_model as radial_model
+    from ._shared_methods import exponential_radial_derivatives as radial_derivatives
     from ._shared_methods import radial_evaluate_model as evaluate_model
 
 
@@ -68,6 +68,7 @@ class Gaussian_Galaxy(Galaxy_Model):
         parametric_initialize(self, parameters, target, _wrap_gauss, ("sigma", "flux"), _x0_func)
 
     from ._shared_methods import gaussian_radial_model as radial_model
+    from ._shared_methods import gaussian_radial_derivatives as radial_derivatives
 
 
 class Gaussian_SuperEllipse(SuperEllipse_Galaxy):
@@ -287,6 +288,7 @@ class Gaussian_PSF(PSF_Model):
         parametric_initialize(self, parameters, target, _wrap_gauss, ("sigma", "flux"), _x0_func)
 
     from ._shared_methods import gaussian_radial_model as radial_model
+    from ._shared_methods import gaussian_radial_derivatives as radial_derivatives
     from ._shared_methods import radial_evaluate_model as evaluate_model
 
 
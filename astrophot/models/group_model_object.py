@@ -1,9 +1,14 @@
 from typing import Optional, Sequence
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
 
+import numpy as np
 import torch
 
 from .core_model import AstroPhot_Model
+from .model_object import Component_Model
 from .. import AP_config
 from ..image import (
     Image,
@@ -15,15 +20,61 @@ from ..image import (
     Model_Image,
     Model_Image_List,
     Jacobian_Image,
+    Jacobian_Blocks,
+    PSF_Image,
+)
+from ..utils.decorators import ignore_numpy_warnings, default_internal, profiled
+from ..utils.profiling import profiler
+from ..utils.interpolate import simpsons_kernel, curvature_kernel
+from ..utils.operations import (
+    fft_convolve_torch,
+    small_kernel_rfft2,
+    single_quad_integrate,
+    grid_integrate,
 )
-from ..utils.decorators import ignore_numpy_warnings, default_internal
 from ._shared_methods import select_target
-from ..param import Parameter_Node
+from ._model_methods import _Batch_Parameters
+from ..param import Parameter_Node, Param_Unlock
 from ..errors import InvalidTarget
 
 __all__ = ["Group_Model"]
 
 
+def _initialize_worker(dtype, device, num_threads):
+    """Configure a worker process for parallel group initialization"""
+    AP_config.ap_dtype = dtype
+    AP_config.ap_device = device
+    torch.set_num_threads(num_threads)
+
+
+def _leaf_states(node, path=()):
+    """Collect the value and uncertainty of every leaf parameter below
+    a node which holds its own value, keyed by the name path to the
+    leaf.
+
+    """
+    states = {}
+    for name, child in node.nodes.items():
+        if child.branch:
+            states.update(_leaf_states(child, path + (name,)))
+        elif isinstance(child._value, torch.Tensor):
+            states[":".join(path + (name,))] = (
+                child.value.detach().cpu(),
+                None if child.uncertainty is None else child.uncertainty.detach().cpu(),
+            )
+    return states
+
+
+def _initialize_submodel(model):
+    """Initialize a single sub model in a worker process, the model
+    target should already have the previously initialized models
+    subtracted. Returns the initialized parameter values.
+
+    """
+    model.initialize()
+    return _leaf_states(model.parameters)
+
+
 class Group_Model(AstroPhot_Model):
     """Model object which represents a list of other models. For each
     general AstroPhot model method, this calls all the appropriate
@@ -43,6 +94,11 @@ class Group_Model(AstroPhot_Model):
     model_type = f"group {AstroPhot_Model.model_type}"
     usable = True
 
+    # Sample sub models which share a type and configuration together in one vectorized call
+    batch_sample = True
+    # Minimum number of matching sub models before they are sampled as a batch
+    batch_min_size = 4
+
     def __init__(
         self,
         *,
@@ -56,6 +112,7 @@ class Group_Model(AstroPhot_Model):
             )
         self._psf_mode = "none"
         self._param_tuple = None
+        self._batch_failed = set()
         self.models = OrderedDict()
         super().__init__(name=name, **kwargs)
         if models is not None:
@@ -132,22 +189,137 @@ class Group_Model(AstroPhot_Model):
     @ignore_numpy_warnings
     @select_target
     @default_internal
-    def initialize(self, target: Optional[Image] = None, parameters=None, **kwargs):
+    def initialize(
+        self, target: Optional[Image] = None, parameters=None, workers: int = 1, **kwargs
+    ):
         """
         Initialize each model in this group. Does this by iteratively initializing a model then subtracting it from a copy of the target.
 
+        With ``workers > 1`` the models are split into independent sets
+        (see `independent_sets`) and the models in each set are
+        initialized concurrently in a pool of worker processes before
+        all of them are subtracted. Worker processes are started with
+        ``spawn``, so scripts using this must guard their entry point
+        with ``if __name__ == "__main__":``.
+
         Args:
           target (Optional["Target_Image"]): A Target_Image instance to use as the source for initializing the model parameters on this image.
+          workers (int): Number of worker processes used to initialize independent models concurrently. Default: 1 (sequential)
         """
         self._param_tuple = None
         super().initialize(target=target, parameters=parameters)
 
-        target_copy = target.copy()
-        for model in self.models.values():
-            if not model.is_initialized:
-                print("Initializing: ", model.name)
-            model.initialize(target=target_copy, parameters=parameters[model.name])
-            target_copy -= model(parameters=parameters[model.name])
+        # Only the pixels covered by the group are needed for the residuals
+        target_copy = target[self.window].copy()
+        if workers > 1:
+            schedule = self.independent_sets()
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize_worker,
+                initargs=(
+                    AP_config.ap_dtype,
+                    AP_config.ap_device,
+                    max(1, os.cpu_count() // workers),
+                ),
+            )
+        else:
+            schedule = list([model] for model in self.models.values())
+            pool = None
+        try:
+            for models in schedule:
+                for model in models:
+                    if not model.is_initialized:
+                        print("Initializing: ", model.name)
+                if len(models) > 1:
+                    self._parallel_initialize(models, target_copy, parameters, pool)
+                else:
+                    models[0].initialize(target=target_copy, parameters=parameters[models[0].name])
+                for model in models:
+                    target_copy -= model(parameters=parameters[model.name])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def _parallel_initialize(self, models, target, parameters, pool):
+        """Initialize a set of independent models concurrently. Each model
+        is sent to a worker with only its own window of the residual
+        target, the initialized parameter values are then copied back.
+
+        """
+        initial_targets = []
+        for model in models:
+            initial_targets.append(model.target)
+            model.target = target[model.window].copy()
+        try:
+            results = list(pool.map(_initialize_submodel, models))
+        finally:
+            for model, initial_target in zip(models, initial_targets):
+                model.target = initial_target
+        for model, states in zip(models, results):
+            for path, (value, uncertainty) in states.items():
+                node = parameters[model.name][path]
+                with Param_Unlock(node):
+                    node.value = value.to(dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+                    if uncertainty is not None:
+                        node.uncertainty = uncertainty.to(
+                            dtype=AP_config.ap_dtype, device=AP_config.ap_device
+                        )
+
+    def independent_sets(self) -> list:
+        """Split the sub models into sets which do not interact. An
+        overlap graph is built where two models are linked if their
+        windows, padded by the psf border, overlap or if they share a
+        parameter. The graph is then coloured greedily (largest degree
+        first) so that models with the same colour are independent.
+
+        Returns:
+            list: list of lists of models, each inner list is an independent set
+        """
+        models = list(self.models.values())
+        N = len(models)
+        if any(isinstance(model.window, Window_List) for model in models):
+            # Overlap is only resolved for single image windows
+            return list([model] for model in models)
+
+        # Pixel bounds of each model window in the group window
+        bounds = np.zeros((N, 4), dtype=int)
+        for i, model in enumerate(models):
+            rows, cols = self.window.get_self_indices(model.window)
+            border = np.zeros(2, dtype=int)
+            if ("full" in model.psf_mode or "window" in model.psf_mode) and model.psf is not None:
+                psf = model.psf.target if isinstance(model.psf, AstroPhot_Model) else model.psf
+                border = psf.psf_border_int.detach().cpu().numpy()
+            bounds[i] = (
+                int(cols.start) - border[0],
+                int(rows.start) - border[1],
+                int(cols.stop) + border[0],
+                int(rows.stop) + border[1],
+            )
+        overlap = (
+            (bounds[:, None, 0] < bounds[None, :, 2])
+            & (bounds[None, :, 0] < bounds[:, None, 2])
+            & (bounds[:, None, 1] < bounds[None, :, 3])
+            & (bounds[None, :, 1] < bounds[:, None, 3])
+        )
+
+        # Models sharing a parameter must be handled separately
+        owners = {}
+        for i, model in enumerate(models):
+            for identity in model.parameters.flat(include_locked=False).keys():
+                owners.setdefault(identity, []).append(i)
+        for shared in owners.values():
+            overlap[np.ix_(shared, shared)] = True
+        np.fill_diagonal(overlap, False)
+
+        # Greedy graph colouring
+        colour = np.full(N, -1, dtype=int)
+        for i in np.argsort(-np.sum(overlap, axis=1), kind="stable"):
+            used = set(colour[overlap[i]])
+            colour[i] = next(c for c in range(N) if c not in used)
+        return list(
+            list(models[i] for i in range(N) if colour[i] == c) for c in range(np.max(colour) + 1)
+        )
 
     def fit_mask(self) -> torch.Tensor:
         """Returns a mask for the target image which is the combination of all
@@ -180,6 +352,7 @@ class Group_Model(AstroPhot_Model):
                 mask[group_indices] &= model.fit_mask()[model_indices]
         return mask
 
+    @profiled("sample")
     def sample(
         self,
         image: Optional[Image] = None,
@@ -208,6 +381,7 @@ class Group_Model(AstroPhot_Model):
 
         working_image = image[window].blank_copy()
 
+        batches = OrderedDict()
         for model in self.models.values():
             if window is not None and isinstance(window, Window_List):
                 indices = self.target.match_indices(model.target)
@@ -219,18 +393,477 @@ class Group_Model(AstroPhot_Model):
                     use_window = window.window_list[indices]
             else:
                 use_window = window
-            if sample_window:
-                # Will sample the model fit window then add to the image
-                working_image += model(window=use_window, parameters=parameters[model.name])
+            if sample_window and not isinstance(use_window, Window_List):
+                # only sample each model within its own window, same as for the jacobian
+                use_window = model.window & use_window
+                # skip models which do not overlap the requested window
+                if torch.any(use_window.pixel_shape <= 0):
+                    continue
+            key = self._batch_key(model, use_window, parameters[model.name])
+            if key is None:
+                self._sample_model(model, working_image, use_window, parameters, sample_window)
             else:
-                # Will sample the entire image
-                model(working_image, window=use_window, parameters=parameters[model.name])
+                batches.setdefault(key, []).append((model, use_window))
+
+        for key, batch in batches.items():
+            if len(batch) >= self.batch_min_size:
+                try:
+                    self._sample_batch(batch, parameters, working_image)
+                    continue
+                except (RuntimeError, NotImplementedError) as error:
+                    AP_config.ap_logger.warning(
+                        f"{self.name} could not sample {key[0].__name__} models as a batch, they will be sampled individually. {error}"
+                    )
+                    self._batch_failed.add(key)
+            for model, use_window in batch:
+                self._sample_model(model, working_image, use_window, parameters, sample_window)
 
         image += working_image
 
         return image
 
+    def _sample_vector_chunk(self, vectors, as_representation, window):
+        """Sample the group for a chunk of parameter vectors, see
+        ``sample_vectors``. Each sub model which can be sampled in a
+        batch (see ``_batch_key``) is evaluated for all the vectors in
+        one vectorized call, the others are sampled one vector at a
+        time. A single vector is sampled as usual, which batches the
+        sub models with each other instead.
+
+        """
+        if len(vectors) == 1 or isinstance(window, Window_List):
+            return super()._sample_vector_chunk(vectors, as_representation, window)
+        image = self.make_model_image(window=window)
+        shape = tuple(image.data.shape)
+        # The image for each vector is built out of place so gradients reach the vectors
+        batch = list(
+            torch.zeros(shape, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+            for _ in vectors
+        )
+
+        def set_vector(vector):
+            if as_representation:
+                self.parameters.vector_set_representation(vector)
+            else:
+                self.parameters.vector_set_values(vector)
+
+        def add(index, data, use_window):
+            rows, cols = use_window.get_other_indices(image)
+            rows = (int(rows.start), int(rows.stop))
+            cols = (int(cols.start), int(cols.stop))
+            padded = torch.nn.functional.pad(
+                data[image.window.get_other_indices(use_window)],
+                (cols[0], shape[1] - cols[1], rows[0], shape[0] - rows[1]),
+            )
+            batch[index] = batch[index] + padded
+
+        individual = []
+        batched = OrderedDict()
+        for model in self.models.values():
+            use_window = model.window & image.window
+            if torch.any(use_window.pixel_shape <= 0):
+                continue
+            key = self._batch_key(model, use_window, self.parameters[model.name])
+            if key is None:
+                individual.append((model, use_window))
+            else:
+                batched[model.name] = (model, use_window, key)
+
+        # Read the parameter values of every vector from the DAG once
+        values = dict((name, []) for name in batched)
+        for vector in vectors:
+            set_vector(vector)
+            for name in batched:
+                values[name].append(
+                    dict(
+                        (key, value.clone())
+                        for key, value in self._batch_values(self.parameters[name]).items()
+                    )
+                )
+
+        for name, (model, use_window, key) in batched.items():
+            try:
+                datas = self._evaluate_batch(
+                    [model] * len(vectors), [use_window] * len(vectors), values[name]
+                )
+            except (RuntimeError, NotImplementedError) as error:
+                AP_config.ap_logger.warning(
+                    f"{self.name} could not sample {name} as a batch, parameter vectors will be sampled individually. {error}"
+                )
+                self._batch_failed.add(key)
+                individual.append((model, use_window))
+                continue
+            for i, data in enumerate(datas):
+                add(i, data, use_window)
+
+        for i, vector in enumerate(vectors):
+            if len(individual) == 0:
+                break
+            set_vector(vector)
+            for model, use_window in individual:
+                add(
+                    i,
+                    model(window=use_window, parameters=self.parameters[model.name]).data,
+                    use_window,
+                )
+        return torch.stack(batch)
+
+    @staticmethod
+    def _sample_model(model, working_image, window, parameters, sample_window):
+        """Sample a single sub model and add it to the working image."""
+        if sample_window:
+            # Will sample the model fit window then add to the image
+            working_image += model(window=window, parameters=parameters[model.name])
+        else:
+            # Will sample the entire image
+            model(working_image, window=window, parameters=parameters[model.name])
+
+    def _batch_key(self, model, window, parameters):
+        """Key which is shared by all sub models that can be sampled together
+        in one batch. Models must have the same type, target, psf,
+        sampling configuration, and parameter shapes. Returns None if
+        the model must be sampled on its own.
+
+        """
+        if not self.batch_sample or not isinstance(model, Component_Model):
+            return None
+        key = self._batch_spec(model, window, parameters)
+        if key in self._batch_failed:
+            return None
+        return key
+
+    @staticmethod
+    def _batch_spec(model, window, parameters):
+        """Configuration of a component model which must match for models
+        to be sampled together by ``_evaluate_batch``, see
+        ``_batch_key``. Returns None if the model cannot be sampled
+        in a batch.
+
+        """
+        # The batch reproduces the standard sampling steps, these must not be overloaded
+        for method in ("sample", "_sample_init", "_sample_integrate"):
+            if getattr(type(model), method) is not getattr(Component_Model, method):
+                return None
+        if isinstance(window, Window_List) or torch.any(window.pixel_shape < 3):
+            return None
+        if model.sampling_mode not in ("midpoint", "simpsons", "trapezoid") and not (
+            "quad" in model.sampling_mode
+        ):
+            return None
+        if model.integrate_mode not in ("none", "threshold"):
+            return None
+        if "full" in model.psf_mode:
+            if not isinstance(model.psf, PSF_Image):
+                return None
+        elif model.psf_mode != "none":
+            return None
+        spec = []
+        for name, node in parameters.nodes.items():
+            # Profile information is specific to each model
+            if node.prof is not None:
+                return None
+            value = node.value
+            spec.append((name, None if value is None else tuple(value.shape)))
+        key = (
+            type(model),
+            id(model.target),
+            id(model.psf) if "full" in model.psf_mode else None,
+            tuple(repr(getattr(model, attr)) for attr in model.track_attrs),
+            tuple(spec),
+        )
+        return key
+
+    @profiled("sample_batch")
+    def _sample_batch(self, batch, parameters, image):
+        """Sample a batch of sub models which share a type and configuration
+        (see ``_batch_key``) in one vectorized call and add the
+        results into ``image`` within each model window.
+
+        """
+        models = list(model for model, _ in batch)
+        profiler.count("batched_models", len(models), self)
+        windows = list(window for _, window in batch)
+        values = list(self._batch_values(parameters[model.name]) for model in models)
+        for window, data in zip(windows, self._evaluate_batch(models, windows, values)):
+            image.data[window.get_other_indices(image)] += data[
+                image.window.get_other_indices(window)
+            ]
+
+    @staticmethod
+    def _batch_values(parameters):
+        """Values of the parameters of one model for ``_evaluate_batch``"""
+        return dict(
+            (name, node.value) for name, node in parameters.nodes.items() if node.value is not None
+        )
+
+    @classmethod
+    def _evaluate_batch(cls, models, windows, values):
+        """Evaluate a batch of component models which share a type and
+        configuration (see ``_batch_spec``) in one vectorized
+        call. Each model window is padded to a common shape so the
+        coordinates can be stacked, the models are evaluated with
+        ``torch.vmap``, then the sampling, psf convolution, and
+        cropping steps of ``Component_Model.sample`` are applied to
+        the whole stack. The pixels selected for sub pixel
+        integration are gathered from all models and integrated
+        together, each with the parameters of its own model. The same
+        model may appear several times with different ``values``, a
+        dictionary of parameter values for each entry.
+
+        Returns:
+          list: model pixels for each entry within its window
+
+        """
+        model = models[0]
+        full_psf = "full" in model.psf_mode
+        centers = torch.stack(list(value["center"] for value in values))
+
+        # Construct the working window for each model, as in Component_Model.sample
+        working_windows = list(window.copy() for window in windows)
+        shifts = None
+        if full_psf:
+            psf = model.psf
+            psf_upscale = torch.round(windows[0].pixel_length / psf.pixel_length).int()
+            working_windows = list(
+                working_window.rescale_pixel(1 / psf_upscale).pad_pixel(psf.psf_border_int)
+                for working_window in working_windows
+            )
+            # Sub pixel shift to align each model with the center of a pixel
+            if model.psf_subpixel_shift != "none":
+                shifts = []
+                for working_window, center in zip(working_windows, centers):
+                    pixel_center = working_window.plane_to_pixel(center)
+                    shifts.append(pixel_center - torch.round(pixel_center))
+                    working_window.pixel_shift(shifts[-1])
+                shifts = torch.stack(shifts)
+
+        # Pad every window to a common shape and stack the coordinates
+        pixel_shapes = torch.stack(
+            list(working_window.pixel_shape for working_window in working_windows)
+        )
+        max_shape = torch.max(pixel_shapes, dim=0).values
+        padded_windows = list(
+            working_window.copy().pad_pixel(
+                torch.cat((torch.zeros_like(max_shape), max_shape - pixel_shape))
+            )
+            for working_window, pixel_shape in zip(working_windows, pixel_shapes)
+        )
+
+        def coordinates(meshgrid):
+            Coords = torch.stack(list(getattr(window, meshgrid)() for window in padded_windows))
+            return (
+                Coords[:, 0] - centers[:, 0, None, None],
+                Coords[:, 1] - centers[:, 1, None, None],
+            )
+
+        # Evaluate all the models at once using a stacked version of their parameters
+        params = list(_Batch_Parameters(value) for value in values)
+        values = dict(
+            (name, torch.stack(list(value[name] for value in values))) for name in values[0]
+        )
+        header_image = Model_Image(window=working_windows[0])
+        precision = model._precision_dtype()
+
+        def evaluate(V, X, Y, image):
+            if precision is not None:
+                # mixed precision, evaluate in float32 and accumulate in full precision
+                V = dict((name, value.to(precision)) for name, value in V.items())
+                X, Y = X.to(precision), Y.to(precision)
+            return torch.vmap(
+                lambda v, x, y: model.evaluate_model(
+                    X=x, Y=y, image=image, parameters=_Batch_Parameters(v)
+                )
+            )(V, X, Y).to(AP_config.ap_dtype)
+
+        def batch_evaluate(X, Y, image=None, parameters=None):
+            return evaluate(values, X, Y, image)
+
+        def point_evaluate(X, Y, image=None, parameters=None, index=None):
+            # Each pixel is evaluated with the parameters of the model given by index
+            if index.numel() == 0:
+                return torch.zeros_like(X)
+            index = index.reshape(-1)
+            V = dict((name, value[index]) for name, value in values.items())
+            return evaluate(V, X.reshape(len(index), -1), Y.reshape(len(index), -1), image).reshape(
+                X.shape
+            )
+
+        dtype, device = AP_config.ap_dtype, AP_config.ap_device
+        rows, cols = pixel_shapes[:, 1], pixel_shapes[:, 0]
+        X = None
+        if model.sampling_mode == "midpoint":
+            X, Y = coordinates("get_coordinate_meshgrid")
+            deep = batch_evaluate(X, Y, header_image)
+            reference = deep + cls._batch_curvature(deep, rows, cols)
+        elif model.sampling_mode == "simpsons":
+            dens = batch_evaluate(*coordinates("get_coordinate_simps_meshgrid"), header_image)
+            reference = dens[:, 1::2, 1::2]
+            deep = torch.nn.functional.conv2d(
+                dens.unsqueeze(1),
+                simpsons_kernel(dtype=dtype, device=device),
+                stride=2,
+                padding="valid",
+            ).squeeze(1)
+        elif model.sampling_mode == "trapezoid":
+            dens = batch_evaluate(*coordinates("get_coordinate_corner_meshgrid"), header_image)
+            kernel = torch.ones((1, 1, 2, 2), dtype=dtype, device=device) / 4.0
+            deep = torch.nn.functional.conv2d(dens.unsqueeze(1), kernel, padding="valid").squeeze(1)
+            reference = deep + cls._batch_curvature(deep, rows, cols)
+        else:
+            quad_level = int(model.sampling_mode[model.sampling_mode.find(":") + 1 :])
+            X, Y = coordinates("get_coordinate_meshgrid")
+            deep, reference = single_quad_integrate(
+                X=X,
+                Y=Y,
+                image_header=header_image.header,
+                eval_brightness=batch_evaluate,
+                eval_parameters=None,
+                dtype=dtype,
+                device=device,
+                quad_level=quad_level,
+            )
+
+        # Pixels within each model's own window
+        H, W = deep.shape[-2:]
+        inside = (
+            torch.arange(H, device=device)[None, :, None] < rows[:, None, None].to(device)
+        ) & (torch.arange(W, device=device)[None, None, :] < cols[:, None, None].to(device))
+        shapes = list(zip(rows.tolist(), cols.tolist()))
+
+        # Super-resolve and integrate where needed, the selected pixels from all models are integrated together
+        if model.integrate_mode == "threshold":
+            if X is None:
+                X, Y = coordinates("get_coordinate_meshgrid")
+            tolerance = model.sampling_tolerance * torch.stack(
+                list(
+                    submodel._integrate_reference(deep[i, :h, :w], header_image.header, param)
+                    for i, (submodel, param, (h, w)) in enumerate(zip(models, params, shapes))
+                )
+            )
+            select = (torch.abs(deep - reference) > tolerance[:, None, None]) & inside
+            index = torch.arange(len(models), device=device)[:, None, None].expand_as(deep)[select]
+            deep = deep.clone()
+            deep[select] = grid_integrate(
+                X=X[select],
+                Y=Y[select],
+                image_header=header_image.header,
+                eval_brightness=point_evaluate,
+                eval_parameters=None,
+                dtype=dtype,
+                device=device,
+                quad_level=model.integrate_quad_level,
+                gridding=model.integrate_gridding,
+                max_depth=model.integrate_max_depth,
+                reference=tolerance[index],
+                index=index,
+            )
+
+        # Convolve the PSF
+        if full_psf:
+            deep = cls._batch_convolve(model, deep * inside, shifts, psf)
+            border_x, border_y = psf.psf_border_int.tolist()
+            psf_upscale = int(psf_upscale)
+
+        # Crop each model to its window
+        results = []
+        for i, submodel in enumerate(models):
+            h, w = shapes[i]
+            data = deep[i, :h, :w]
+            if full_psf:
+                data = data[border_y : h - border_y, border_x : w - border_x]
+                if psf_upscale > 1:
+                    MS, NS = data.shape[0] // psf_upscale, data.shape[1] // psf_upscale
+                    data = (
+                        data[: MS * psf_upscale, : NS * psf_upscale]
+                        .reshape(MS, psf_upscale, NS, psf_upscale)
+                        .sum(axis=(1, 3))
+                    )
+            if submodel.mask is not None:
+                data = data * torch.logical_not(submodel.mask)
+            results.append(data)
+        return results
+
+    @staticmethod
+    def _batch_curvature(data, rows, cols):
+        """Curvature estimate for a stack of padded model samples. The edges
+        are replicated at the border of each model's own window, so
+        the result matches sampling each model individually.
+
+        """
+        kernel = curvature_kernel(AP_config.ap_dtype, AP_config.ap_device)
+        curvature = torch.nn.functional.conv2d(
+            data.unsqueeze(1), kernel.view(1, 1, *kernel.shape), padding="valid"
+        ).squeeze(1)
+        H, W = data.shape[-2:]
+        device = data.device
+        row_index = torch.minimum(
+            (torch.arange(H, device=device) - 1).clamp(min=0)[None],
+            (rows.to(device=device, dtype=torch.int64) - 3)[:, None],
+        )
+        col_index = torch.minimum(
+            (torch.arange(W, device=device) - 1).clamp(min=0)[None],
+            (cols.to(device=device, dtype=torch.int64) - 3)[:, None],
+        )
+        batch_index = torch.arange(data.shape[0], device=device)[:, None, None]
+        return curvature[batch_index, row_index[:, :, None], col_index[:, None, :]]
+
+    @staticmethod
+    def _batch_convolve(model, data, shifts, psf):
+        """Convolve a stack of padded model samples with the psf, shifted
+        individually for each model if needed.
+
+        """
+        shape = data.shape[-2:]
+        precision = model._precision_dtype()
+        if precision is not None:
+            data = data.to(precision)
+        kernel = None
+        if shifts is None:
+            kernel = model._psf_kernel(shape, None, psf, model.psf_subpixel_shift, dtype=precision)
+        elif model.psf_convolve_mode == "fft":
+            # Shift the cached psf transform in Fourier space, see Component_Model._psf_kernel
+            shift_kernel = torch.vmap(
+                lambda shift: model._shift_kernel(shift, model.psf_subpixel_shift)
+            )(shifts)
+            psf_shape = tuple(p + k - 1 for p, k in zip(psf.data.shape, shift_kernel.shape[-2:]))
+            if psf_shape[0] <= shape[0] and psf_shape[1] <= shape[1]:
+                psf_fft, _ = model._psf_kernel(shape, None, psf, dtype=precision)
+                if precision is not None:
+                    shift_kernel = shift_kernel.to(precision)
+                kernel = (psf_fft * small_kernel_rfft2(shift_kernel, shape), psf_shape)
+        if kernel is None:
+            shift_psf = torch.vmap(
+                lambda shift: model._shift_psf(psf, shift, model.psf_subpixel_shift)
+            )(shifts)
+            shift_psf = shift_psf / torch.sum(shift_psf, dim=(-2, -1), keepdim=True)
+            if precision is not None:
+                shift_psf = shift_psf.to(precision)
+            if model.psf_convolve_mode == "fft":
+                kernel = (torch.fft.rfft2(shift_psf, s=shape), shift_psf.shape[-2:])
+            else:
+                kernel = shift_psf
+
+        if model.psf_convolve_mode == "fft":
+            psf_fft, psf_shape = kernel
+            return fft_convolve_torch(
+                data, psf_fft, psf_fft=True, img_prepadded=True, psf_shape=psf_shape
+            ).to(AP_config.ap_dtype)
+        elif model.psf_convolve_mode == "direct":
+            kernel = kernel.expand(data.shape[0], *kernel.shape[-2:])
+            return (
+                torch.nn.functional.conv2d(
+                    data.unsqueeze(0),
+                    torch.flip(kernel.unsqueeze(1), dims=(2, 3)),
+                    padding="same",
+                    groups=data.shape[0],
+                )
+                .squeeze(0)
+                .to(AP_config.ap_dtype)
+            )
+        raise ValueError(f"unrecognized psf_convolve_mode: {model.psf_convolve_mode}")
+
     @torch.no_grad()
+    @profiled("jacobian")
     def jacobian(
         self,
         parameters: Optional[torch.Tensor] = None,
@@ -282,6 +915,104 @@ class Group_Model(AstroPhot_Model):
 
         return jac_img
 
+    @torch.no_grad()
+    @profiled("jacobian")
+    def value_and_jacobian(
+        self,
+        parameters: Optional[torch.Tensor] = None,
+        as_representation: bool = False,
+        pass_jacobian: Optional[Jacobian_Image] = None,
+        window: Optional[Window] = None,
+        **kwargs,
+    ):
+        """Compute the model image and the jacobian for this model. Each sub
+        model returns its image along with its jacobian from a single
+        evaluation, these are then added into the group model image
+        and jacobian. See `jacobian` for details on the arguments.
+
+        Returns:
+          Tuple[Model_Image, Jacobian_Image]: The sampled model and its Jacobian
+
+        """
+        if window is None:
+            window = self.window
+        self._param_tuple = None
+
+        if parameters is not None:
+            if as_representation:
+                self.parameters.vector_set_representation(parameters)
+            else:
+                self.parameters.vector_set_values(parameters)
+
+        if pass_jacobian is None:
+            jac_img = self.target[window].jacobian_image(
+                parameters=self.parameters.vector_identities()
+            )
+        else:
+            jac_img = pass_jacobian
+        model_img = self.make_model_image(window=window)
+
+        for model in self.models.values():
+            sub_model, sub_jac = model.value_and_jacobian(
+                as_representation=as_representation,
+                pass_jacobian=jac_img,
+                window=window,
+            )
+            model_img += sub_model
+            if not isinstance(model, Group_Model):
+                jac_img += sub_jac
+
+        return model_img, jac_img
+
+    @torch.no_grad()
+    @profiled("jacobian")
+    def block_jacobian(
+        self,
+        parameters: Optional[torch.Tensor] = None,
+        as_representation: bool = False,
+        pass_jacobian: Optional[Jacobian_Blocks] = None,
+        window: Optional[Window] = None,
+        **kwargs,
+    ):
+        """Compute the jacobian for this model in block sparse form. Each sub
+        model contributes a block covering only its own window and
+        parameters, so memory scales with the sum of the component
+        jacobians rather than Npixels * Nparameters. See
+        `Jacobian_Blocks` for the operations available on the result.
+
+        Args:
+          parameters (Optional[torch.Tensor]): 1D parameter vector to overwrite current values
+          as_representation (bool): Indicates if the "parameters" argument is in the form of the real values, or as representations in the (-inf,inf) range. Default False
+          pass_jacobian (Optional["Jacobian_Blocks"]): A block jacobian pre-constructed to be passed along instead of constructing a new one
+
+        """
+        if window is None:
+            window = self.window
+        self._param_tuple = None
+
+        if parameters is not None:
+            if as_representation:
+                self.parameters.vector_set_representation(parameters)
+            else:
+                self.parameters.vector_set_values(parameters)
+
+        if pass_jacobian is None:
+            jac_blocks = Jacobian_Blocks(
+                parameters=self.parameters.vector_identities(),
+                target=self.target[window],
+            )
+        else:
+            jac_blocks = pass_jacobian
+
+        for model in self.models.values():
+            model.block_jacobian(
+                as_representation=as_representation,
+                pass_jacobian=jac_blocks,
+                window=window,
+            )
+
+        return jac_blocks
+
     def __iter__(self):
         return (mod for mod in self.models.values())
 
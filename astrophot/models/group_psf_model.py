@@ -1,10 +1,12 @@
 from typing import Optional
 
+from .core_model import AstroPhot_Model
 from .group_model_object import Group_Model
 from ..image import PSF_Image
 from ..image import PSF_Image, Image, Window, Model_Image, Model_Image_List, Window_List
 from ..errors import InvalidTarget
 from ..param import Parameter_Node
+from ..utils.decorators import profiled
 
 __all__ = ["PSF_Group_Model"]
 
@@ -15,6 +17,9 @@ class PSF_Group_Model(Group_Model):
     usable = True
     normalize_psf = True
 
+    # The group image is normalized after sampling so the model image cannot be collected from the sub model jacobians
+    value_and_jacobian = AstroPhot_Model.value_and_jacobian
+
     @property
     def psf_mode(self):
         return "none"
@@ -40,6 +45,7 @@ class PSF_Group_Model(Group_Model):
             for model in self.models.values():
                 model.target = tar
 
+    @profiled("sample")
     def sample(
         self,
         image: Optional[Image] = None,
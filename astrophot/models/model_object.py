@@ -14,7 +14,8 @@ from ..image import (
 )
 from ..param import Parameter_Node, Param_Unlock, Param_SoftLimits
 from ..utils.initialize import center_of_mass
-from ..utils.decorators import ignore_numpy_warnings, default_internal
+from ..utils.decorators import ignore_numpy_warnings, default_internal, profiled
+from ..utils.profiling import profiler
 from ._shared_methods import select_target
 from .. import AP_config
 from ..errors import InvalidTarget
@@ -34,15 +35,21 @@ class Component_Model(AstroPhot_Model):
     Attributes:
       parameter_specs (dict): Specifications for the model parameters.
       _parameter_order (tuple): Fixed order of parameters.
-      psf_mode (str): Technique and scope for PSF convolution.
+      psf_mode (str): Scope for PSF convolution. One of none, full, window where window convolves only a core region (see psf_window_radius) and passes the rest of the model through, blending between the two over one psf border. Default: none
+      psf_window_radius (float): Half width (arcsec) of the core region around the model center which is convolved when psf_mode is window. Default: None which selects the region where the estimated change from convolution exceeds psf_window_tolerance
+      psf_window_tolerance (float): Relative change from convolution above which pixels are convolved when psf_mode is window and no psf_window_radius is given. Default: 1e-3
       sampling_mode (str): Method for initial sampling of model. Can be one of midpoint, trapezoid, simpson. Default: midpoint
       sampling_tolerance (float): accuracy to which each pixel should be evaluated. Default: 1e-2
-      integrate_mode (str): Integration scope for the model. One of none, threshold, full where threshold will select which pixels to integrate while full (in development) will integrate all pixels. Default: threshold
+      integrate_mode (str): Integration scope for the model. One of none, threshold, stencil, full where threshold will select which pixels to integrate while full (in development) will integrate all pixels. The stencil mode is the same as threshold, both integrate with the non-recursive `grid_integrate_plan`. Default: threshold
       integrate_max_depth (int): Maximum recursion depth when performing sub pixel integration.
       integrate_gridding (int): Amount by which to subdivide pixels when doing recursive pixel integration.
       integrate_quad_level (int): The initial quadrature level for sub pixel integration. Please always choose an odd number 3 or higher.
       softening (float): Softening length used for numerical stability and integration stability to avoid discontinuities (near R=0). Effectively has units of arcsec. Default: 1e-5
       jacobian_chunksize (int): Maximum size of parameter list before jacobian will be broken into smaller chunks.
+      jacobian_mode (str): How jacobian columns are computed. One of autodiff, analytic where analytic uses the closed form derivatives of the sersic, exponential, gaussian, moffat, and nuker profiles which are then integrated and convolved like the model image. Default: autodiff
+      initialize_uncertainty (str): How parameter uncertainties are estimated by the initial profile fits. One of bootstrap, hessian. Default: bootstrap
+      precision_mode (str): One of full, mixed. In mixed precision the model brightness, jacobian columns, and psf convolution are evaluated in float32 while pixel sums, the jacobian, and the fit statistics use ``AP_config.ap_dtype``. Default: None which follows ``AP_config.ap_precision_mode``
+      compile_mode (str): If set, model evaluation during sampling is compiled with torch.compile using this mode (default, reduce-overhead, max-autotune). See ``astrophot.utils.operations.compile_cache.report()`` for compile times and speedups. Default: None
       special_kwargs (list): Parameters which are treated specially by the model object and should not be updated directly.
       usable (bool): Indicates if the model is usable.
 
@@ -61,7 +68,11 @@ class Component_Model(AstroPhot_Model):
     _parameter_order = ("center",)
 
     # Scope for PSF convolution
-    psf_mode = "none"  # none, full
+    psf_mode = "none"  # none, full, window
+    # Half width (arcsec) of the region around the center which is convolved when psf_mode is window, None selects the region where convolution changes the model by more than psf_window_tolerance
+    psf_window_radius = None
+    # Relative change from convolution above which pixels are included in the convolved region when psf_mode is window and psf_window_radius is None
+    psf_window_tolerance = 1e-3
     # Technique for PSF convolution
     psf_convolve_mode = "fft"  # fft, direct
     # Method to use when performing subpixel shifts. bilinear set by default for stability around pixel edges, though lanczos:3 is also fairly stable, and all are stable when away from pixel edges
@@ -76,7 +87,7 @@ class Component_Model(AstroPhot_Model):
     sampling_tolerance = 1e-2
 
     # Integration scope for model
-    integrate_mode = "threshold"  # none, threshold
+    integrate_mode = "threshold"  # none, threshold, stencil
 
     # Maximum recursion depth when performing sub pixel integration
     integrate_max_depth = 3
@@ -87,16 +98,39 @@ class Component_Model(AstroPhot_Model):
     # The initial quadrature level for sub pixel integration. Please always choose an odd number 3 or higher
     integrate_quad_level = 3
 
+    # Relative change in the parameters before the pixels selected for sub pixel integration are re-derived, set to None to always re-derive them
+    integrate_cache_tolerance = 1e-3
+
+    # Opt-in torch.compile for model evaluation during sampling, one of None (eager), default, reduce-overhead, max-autotune
+    compile_mode = None
+    # Backend given to torch.compile
+    compile_backend = "inductor"
+    # Pixel shapes are padded to multiples of this size so that similar windows share a compiled artefact
+    compile_bucket = 16
+
+    # Method for parameter uncertainties in the initial profile fits, bootstrap refits the profile 10 times while hessian uses the curvature of a single fit which is much faster
+    initialize_uncertainty = "bootstrap"  # bootstrap, hessian
+
+    # Derivatives for the jacobian, autodiff uses forward mode automatic differentiation while analytic uses the closed form derivatives of models which provide them (sersic, exponential, gaussian, moffat, nuker) and autodiff for all others
+    jacobian_mode = "autodiff"  # autodiff, analytic
+
+    # Precision of the model evaluation, mixed evaluates the brightness (and jacobian columns) and psf convolution in float32 while the results are accumulated with AP_config.ap_dtype, None follows AP_config.ap_precision_mode
+    precision_mode = None  # None, full, mixed
+
     # Maximum size of parameter list before jacobian will be broken into smaller chunks, this is helpful for limiting the memory requirements to build a model, lower jacobian_chunksize is slower but uses less memory
     jacobian_chunksize = 10
     image_chunksize = 1000
 
     # Softening length used for numerical stability and/or integration stability to avoid discontinuities (near R=0)
     softening = 1e-3
+    # Set if sample_vectors could not evaluate this model in a vectorized call
+    _batch_failed = False
 
     # Parameters which are treated specially by the model object and should not be updated directly when initializing
     track_attrs = [
         "psf_mode",
+        "psf_window_radius",
+        "psf_window_tolerance",
         "psf_convolve_mode",
         "psf_subpixel_shift",
         "sampling_mode",
@@ -108,6 +142,13 @@ class Component_Model(AstroPhot_Model):
         "jacobian_chunksize",
         "image_chunksize",
         "softening",
+        "integrate_cache_tolerance",
+        "initialize_uncertainty",
+        "compile_mode",
+        "compile_backend",
+        "compile_bucket",
+        "jacobian_mode",
+        "precision_mode",
     ]
     usable = False
 
@@ -255,6 +296,7 @@ class Component_Model(AstroPhot_Model):
             X, Y = Coords - parameters["center"].value[..., None, None]
         return torch.zeros_like(X)  # do nothing in base model
 
+    @profiled("sample")
     def sample(
         self,
         image: Optional[Image] = None,
@@ -300,10 +342,7 @@ class Component_Model(AstroPhot_Model):
         if parameters is None:
             parameters = self.parameters
 
-        if "window" in self.psf_mode:
-            raise NotImplementedError("PSF convolution in sub-window not available yet")
-
-        if "full" in self.psf_mode:
+        if "full" in self.psf_mode or "window" in self.psf_mode:
             if isinstance(self.psf, AstroPhot_Model):
                 psf = self.psf(
                     parameters=parameters[self.psf.name],
@@ -316,6 +355,7 @@ class Component_Model(AstroPhot_Model):
             working_window.pad_pixel(psf.psf_border_int)
             # Make the image object to which the samples will be tracked
             working_image = Model_Image(window=working_window)
+            profiler.allocation("working_image", working_image.data, self)
             # Sub pixel shift to align the model with the center of a pixel
             if self.psf_subpixel_shift != "none":
                 pixel_center = working_image.plane_to_pixel(parameters["center"].value)
@@ -325,21 +365,32 @@ class Component_Model(AstroPhot_Model):
                 center_shift = None
 
             # Evaluate the model at the current resolution
-            reference, deep = self._sample_init(
-                image=working_image,
-                parameters=parameters,
-                center=parameters["center"].value,
-            )
+            with profiler.stage("sample_init", self):
+                reference, deep = self._sample_init(
+                    image=working_image,
+                    parameters=parameters,
+                    center=parameters["center"].value,
+                )
+            if "window" in self.psf_mode:
+                # Region which will be convolved, selected before integration changes the samples
+                core = self._psf_window(working_image, deep, psf, parameters)
             # If needed, super-resolve the image in areas of high curvature so pixels are properly sampled
-            deep = self._sample_integrate(
-                deep, reference, working_image, parameters, parameters["center"].value
-            )
+            with profiler.stage("sample_integrate", self):
+                deep = self._sample_integrate(
+                    deep, reference, working_image, parameters, parameters["center"].value
+                )
 
             # update the image with the integrated pixels
             working_image.data += deep
 
             # Convolve the PSF
-            self._sample_convolve(working_image, center_shift, psf, self.psf_subpixel_shift)
+            with profiler.stage("sample_convolve", self):
+                if "window" in self.psf_mode:
+                    self._sample_convolve_window(
+                        working_image, center_shift, psf, core, self.psf_subpixel_shift
+                    )
+                else:
+                    self._sample_convolve(working_image, center_shift, psf, self.psf_subpixel_shift)
 
             # Shift image back to align with original pixel grid
             if self.psf_subpixel_shift != "none":
@@ -350,20 +401,23 @@ class Component_Model(AstroPhot_Model):
         else:
             # Create an image to store pixel samples
             working_image = Model_Image(pixelscale=image.pixelscale, window=working_window)
+            profiler.allocation("working_image", working_image.data, self)
             # Evaluate the model on the image
-            reference, deep = self._sample_init(
-                image=working_image,
-                parameters=parameters,
-                center=parameters["center"].value,
-            )
+            with profiler.stage("sample_init", self):
+                reference, deep = self._sample_init(
+                    image=working_image,
+                    parameters=parameters,
+                    center=parameters["center"].value,
+                )
             # Super-resolve and integrate where needed
-            deep = self._sample_integrate(
-                deep,
-                reference,
-                working_image,
-                parameters,
-                center=parameters["center"].value,
-            )
+            with profiler.stage("sample_integrate", self):
+                deep = self._sample_integrate(
+                    deep,
+                    reference,
+                    working_image,
+                    parameters,
+                    center=parameters["center"].value,
+                )
             # Add the sampled/integrated pixels to the requested image
             working_image.data += deep
 
@@ -374,6 +428,44 @@ class Component_Model(AstroPhot_Model):
 
         return image
 
+    def _sample_vector_chunk(self, vectors, as_representation, window):
+        """Sample the model for a chunk of parameter vectors in one
+        vectorized call when the model configuration allows it (see
+        ``Group_Model._batch_spec``), see ``sample_vectors``.
+
+        """
+        from .group_model_object import Group_Model
+
+        window = self.window & window
+        if (
+            len(vectors) == 1
+            or self._batch_failed
+            or Group_Model._batch_spec(self, window, self.parameters) is None
+        ):
+            return super()._sample_vector_chunk(vectors, as_representation, window)
+        values = []
+        for vector in vectors:
+            if as_representation:
+                self.parameters.vector_set_representation(vector)
+            else:
+                self.parameters.vector_set_values(vector)
+            values.append(
+                dict(
+                    (name, value.clone())
+                    for name, value in Group_Model._batch_values(self.parameters).items()
+                )
+            )
+        try:
+            return torch.stack(
+                Group_Model._evaluate_batch([self] * len(values), [window] * len(values), values)
+            )
+        except (RuntimeError, NotImplementedError) as error:
+            AP_config.ap_logger.warning(
+                f"{self.name} could not be sampled as a batch, parameter vectors will be sampled individually. {error}"
+            )
+            self._batch_failed = True
+        return super()._sample_vector_chunk(vectors, as_representation, window)
+
     @property
     def target(self):
         return self._target
@@ -431,14 +523,26 @@ class Component_Model(AstroPhot_Model):
     ######################################################################
     from ._model_methods import radius_metric
     from ._model_methods import angular_metric
+    from ._model_methods import _precision_dtype
+    from ._model_methods import _evaluate_sample
     from ._model_methods import _sample_init
     from ._model_methods import _sample_integrate
     from ._model_methods import _sample_convolve
+    from ._model_methods import _convolve_data
+    from ._model_methods import _psf_window
+    from ._model_methods import _sample_convolve_window
+    from ._model_methods import _psf_kernel
     from ._model_methods import _integrate_reference
+    from ._model_methods import _integrate_state
+    from ._model_methods import _integrate_cached_plan
+    from ._model_methods import _integrate_store_plan
     from ._model_methods import _shift_psf
+    from ._model_methods import _shift_kernel
     from ._model_methods import build_parameter_specs
     from ._model_methods import build_parameters
     from ._model_methods import jacobian
+    from ._model_methods import value_and_jacobian
+    from ._model_methods import block_jacobian
     from ._model_methods import _chunk_jacobian
     from ._model_methods import _chunk_image_jacobian
     from ._model_methods import load
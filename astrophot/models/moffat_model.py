@@ -66,6 +66,7 @@ class Moffat_Galaxy(Galaxy_Model):
         )
 
     from ._shared_methods import moffat_radial_model as radial_model
+    from ._shared_methods import moffat_radial_derivatives as radial_derivatives
 
 
 class Moffat_PSF(PSF_Model):
@@ -106,6 +107,7 @@ class Moffat_PSF(PSF_Model):
         parametric_initialize(self, parameters, target, _wrap_moffat, ("n", "Rd", "I0"), _x0_func)
 
     from ._shared_methods import moffat_radial_model as radial_model
+    from ._shared_methods import moffat_radial_derivatives as radial_derivatives
 
     @default_internal
     def total_flux(self, parameters=None, window=None):
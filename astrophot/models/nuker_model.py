@@ -90,6 +90,7 @@ class Nuker_Galaxy(Galaxy_Model):
         )
 
     from ._shared_methods import nuker_radial_model as radial_model
+    from ._shared_methods import nuker_radial_derivatives as radial_derivatives
 
 
 class Nuker_PSF(PSF_Model):
@@ -148,6 +149,7 @@ class Nuker_PSF(PSF_Model):
         )
 
     from ._shared_methods import nuker_radial_model as radial_model
+    from ._shared_methods import nuker_radial_derivatives as radial_derivatives
     from ._shared_methods import radial_evaluate_model as evaluate_model
 
 
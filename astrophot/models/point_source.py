@@ -6,10 +6,11 @@ import numpy as np
 from ..param import Param_Unlock, Param_SoftLimits, Parameter_Node
 from .model_object import Component_Model
 from .core_model import AstroPhot_Model
-from ..utils.decorators import ignore_numpy_warnings, default_internal
+from ..utils.decorators import ignore_numpy_warnings, default_internal, profiled
 from ..image import PSF_Image, Window, Model_Image, Image
 from ._shared_methods import select_target
 from ..errors import SpecificationConflict
+from ..utils.operations import psf_fft_cache
 
 __all__ = ("Point_Source",)
 
@@ -73,6 +74,7 @@ class Point_Source(Component_Model):
     def psf_mode(self, value):
         pass
 
+    @profiled("sample")
     def sample(
         self,
         image: Optional[Image] = None,
@@ -157,8 +159,12 @@ class Point_Source(Component_Model):
             center_shift = pixel_center - torch.round(pixel_center)
             # working_image.header.pixel_shift(center_shift)
             psf.window.shift(working_image.pixel_to_plane(torch.round(pixel_center)))
+            # The normalized psf is fixed, only its subpixel shift follows the center
+            key = psf_fft_cache.make_key(self.psf.data, "point")
             psf.data = self._shift_psf(
-                psf=psf.data,
+                psf=psf_fft_cache.get(
+                    key, self.psf.data, lambda: self.psf.data / torch.sum(self.psf.data)
+                ),
                 shift=center_shift,
                 shift_method=self.psf_subpixel_shift,
                 keep_pad=False,
@@ -11,7 +11,8 @@ from ..image import (
     Image_List,
 )
 from ._shared_methods import select_target
-from ..utils.decorators import default_internal, ignore_numpy_warnings
+from ..utils.decorators import default_internal, ignore_numpy_warnings, profiled
+from ..utils.profiling import profiler
 from ..param import Parameter_Node
 from ..errors import SpecificationConflict
 
@@ -57,7 +58,7 @@ class PSF_Model(AstroPhot_Model):
     sampling_tolerance = 1e-3
 
     # Integration scope for model
-    integrate_mode = "threshold"  # none, threshold, full*
+    integrate_mode = "threshold"  # none, threshold, stencil, full*
 
     # Maximum recursion depth when performing sub pixel integration
     integrate_max_depth = 3
@@ -68,6 +69,25 @@ class PSF_Model(AstroPhot_Model):
     # The initial quadrature level for sub pixel integration. Please always choose an odd number 3 or higher
     integrate_quad_level = 3
 
+    # Relative change in the parameters before the pixels selected for sub pixel integration are re-derived, set to None to always re-derive them
+    integrate_cache_tolerance = 1e-3
+
+    # Opt-in torch.compile for model evaluation during sampling, one of None (eager), default, reduce-overhead, max-autotune
+    compile_mode = None
+    # Backend given to torch.compile
+    compile_backend = "inductor"
+    # Pixel shapes are padded to multiples of this size so that similar windows share a compiled artefact
+    compile_bucket = 16
+
+    # Method for parameter uncertainties in the initial profile fits, bootstrap refits the profile 10 times while hessian uses the curvature of a single fit which is much faster
+    initialize_uncertainty = "bootstrap"  # bootstrap, hessian
+
+    # Derivatives for the jacobian, autodiff uses forward mode automatic differentiation while analytic uses the closed form derivatives of models which provide them (sersic, exponential, gaussian, moffat, nuker) and autodiff for all others
+    jacobian_mode = "autodiff"  # autodiff, analytic
+
+    # Precision of the model evaluation, mixed evaluates the brightness (and jacobian columns) and psf convolution in float32 while the results are accumulated with AP_config.ap_dtype, None follows AP_config.ap_precision_mode
+    precision_mode = None  # None, full, mixed
+
     # Maximum size of parameter list before jacobian will be broken into smaller chunks, this is helpful for limiting the memory requirements to build a model, lower jacobian_chunksize is slower but uses less memory
     jacobian_chunksize = 10
     image_chunksize = 1000
@@ -86,6 +106,13 @@ class PSF_Model(AstroPhot_Model):
         "integrate_quad_level",
         "jacobian_chunksize",
         "softening",
+        "integrate_cache_tolerance",
+        "initialize_uncertainty",
+        "compile_mode",
+        "compile_backend",
+        "compile_bucket",
+        "jacobian_mode",
+        "precision_mode",
     ]
 
     def __init__(self, *, name=None, **kwargs):
@@ -177,6 +204,7 @@ class PSF_Model(AstroPhot_Model):
             window = self.window & window
         return self.target[window].blank_copy()
 
+    @profiled("sample")
     def sample(
         self,
         image: Optional[Image] = None,
@@ -223,6 +251,7 @@ class PSF_Model(AstroPhot_Model):
 
         # Create an image to store pixel samples
         working_image = Model_Image(window=working_window)
+        profiler.allocation("working_image", working_image.data, self)
         if self.model_integrated is True:
             # Evaluate the model on the image
             Coords = image.get_coordinate_meshgrid()
@@ -232,19 +261,21 @@ class PSF_Model(AstroPhot_Model):
             )
         elif self.model_integrated is False:
             # Evaluate the model on the image
-            reference, deep = self._sample_init(
-                image=working_image,
-                parameters=parameters,
-                center=parameters["center"].value,
-            )
+            with profiler.stage("sample_init", self):
+                reference, deep = self._sample_init(
+                    image=working_image,
+                    parameters=parameters,
+                    center=parameters["center"].value,
+                )
             # Super-resolve and integrate where needed
-            deep = self._sample_integrate(
-                deep,
-                reference,
-                working_image,
-                parameters,
-                center=torch.zeros_like(working_image.center),
-            )
+            with profiler.stage("sample_integrate", self):
+                deep = self._sample_integrate(
+                    deep,
+                    reference,
+                    working_image,
+                    parameters,
+                    center=torch.zeros_like(working_image.center),
+                )
             # Add the sampled/integrated pixels to the requested image
             working_image.data += deep
         else:
@@ -319,12 +350,19 @@ class PSF_Model(AstroPhot_Model):
     ######################################################################
     from ._model_methods import radius_metric
     from ._model_methods import angular_metric
+    from ._model_methods import _precision_dtype
+    from ._model_methods import _evaluate_sample
     from ._model_methods import _sample_init
     from ._model_methods import _sample_integrate
     from ._model_methods import _integrate_reference
+    from ._model_methods import _integrate_state
+    from ._model_methods import _integrate_cached_plan
+    from ._model_methods import _integrate_store_plan
     from ._model_methods import build_parameter_specs
     from ._model_methods import build_parameters
     from ._model_methods import jacobian
+    from ._model_methods import value_and_jacobian
+    from ._model_methods import block_jacobian
     from ._model_methods import _chunk_jacobian
     from ._model_methods import _chunk_image_jacobian
     from ._model_methods import load
@@ -89,6 +89,7 @@ class Sersic_Galaxy(Galaxy_Model):
         return tot / image_data.numel()
 
     from ._shared_methods import sersic_radial_model as radial_model
+    from ._shared_methods import sersic_radial_derivatives as radial_derivatives
 
 
 class Sersic_PSF(PSF_Model):
@@ -135,6 +136,7 @@ class Sersic_PSF(PSF_Model):
         parametric_initialize(self, parameters, target, _wrap_sersic, ("n", "Re", "Ie"), _x0_func)
 
     from ._shared_methods import sersic_radial_model as radial_model
+    from ._shared_methods import sersic_radial_derivatives as radial_derivatives
     from ._shared_methods import radial_evaluate_model as evaluate_model
 
 
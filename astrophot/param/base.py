@@ -20,6 +20,16 @@ class Node(ABC):
     """
 
     global_unlock = False
+    # Incremented whenever the structure of any DAG changes, see Parameter_Layout
+    _structure_version = 0
+
+    @staticmethod
+    def structure_changed():
+        """Record that the structure of a DAG has changed (links, locks,
+        masks, etc.) so that any compiled layouts are rebuilt.
+
+        """
+        Node._structure_version += 1
 
     def __init__(self, name, **kwargs):
         if ":" in name:
@@ -53,6 +63,7 @@ class Node(ABC):
                         "Parameter structure must be Directed Acyclic Graph! Adding this node would create a cycle"
                     )
             self.nodes[node.name] = node
+            Node.structure_changed()
 
     def unlink(self, *nodes):
         """Undoes the linking of two nodes. Note that this could sever the
@@ -62,11 +73,28 @@ class Node(ABC):
         """
         for node in nodes:
             del self.nodes[node.name]
+            Node.structure_changed()
 
     def dump(self):
         """Simply unlinks all nodes that the current node is linked with."""
         self.unlink(*self.nodes.values())
 
+    @property
+    def locked(self):
+        """Locked nodes are skipped by operations which only act on unlocked nodes."""
+        return self._locked
+
+    @locked.setter
+    def locked(self, locked):
+        self._locked = locked
+        Node.structure_changed()
+
+    def __getstate__(self):
+        # Compiled layouts are rebuilt on demand rather than copied
+        state = self.__dict__.copy()
+        state.pop("_layout", None)
+        return state
+
     @property
     def leaf(self):
         """Returns True when the current node is a leaf node."""
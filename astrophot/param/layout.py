@@ -0,0 +1,152 @@
+import torch
+import numpy as np
+
+from .base import Node
+from .. import AP_config
+
+__all__ = ["Parameter_Layout"]
+
+
+class Parameter_Layout:
+    """Compiled description of the ``vector`` view of a parameter DAG.
+
+    The vector methods of a branch Parameter_Node need to know which
+    leaf nodes are in the DAG, where each leaf sits in the (masked)
+    vector, and how to transform each element between its value and
+    representation. Finding this requires walking the DAG, so the
+    layout is computed once and stored by the node until the DAG
+    structure changes. Any change to the links, locks, masks, limits,
+    or the kind of value held by a node increments
+    ``Node._structure_version`` which invalidates all layouts.
+
+    With the layout the transforms become a handful of tensor
+    operations over the whole vector, one for each kind of boundary
+    (cyclic, two sided, lower limit, upper limit).
+
+    Args:
+      node (Parameter_Node): the root node of the DAG to describe
+
+    """
+
+    def __init__(self, node):
+        self.version = Node._structure_version
+        self.global_unlock = Node.global_unlock
+
+        self.nodes = tuple(node.flat(include_locked=False, include_links=False).values())
+        masks = list(leaf.mask.flatten() for leaf in self.nodes)
+        # Position of each leaf in the full vector
+        self.sizes = list(mask.numel() for mask in masks)
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes, dtype=int)))
+        # Position of each leaf in the masked vector
+        self.counts = list(int(mask.sum().item()) for mask in masks)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts, dtype=int)))
+        # Leaves which can simply take a view of the vector as their value
+        self.direct = list(
+            isinstance(leaf._value, torch.Tensor) and count == size
+            for leaf, count, size in zip(self.nodes, self.counts, self.sizes)
+        )
+        self.size = int(self.starts[-1])
+        if len(self.nodes) > 0:
+            self.mask = torch.cat(masks)
+        else:
+            self.mask = torch.ones(0, dtype=torch.bool, device=AP_config.ap_device)
+        self.full_mask = bool(torch.all(self.mask).item())
+
+        self._build_transforms(masks)
+
+    def _build_transforms(self, masks):
+        """Collect the limits of every element in the masked vector and
+        group the elements by the kind of transform they need.
+
+        """
+        kinds = {"cyclic": [], "both": [], "lower": [], "upper": []}
+        lower = []
+        upper = []
+        for leaf, mask, start, stop in zip(self.nodes, masks, self.starts[:-1], self.starts[1:]):
+            low, high = leaf.limits
+            if leaf.cyclic:
+                kind = "cyclic"
+            elif low is None and high is None:
+                kind = None
+            elif high is None:
+                kind = "lower"
+            elif low is None:
+                kind = "upper"
+            else:
+                kind = "both"
+            if kind is not None:
+                kinds[kind].append(np.arange(start, stop))
+            shape = mask.shape
+            lower.append(
+                torch.zeros(shape, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+                if low is None
+                else torch.broadcast_to(low, leaf.value.shape).flatten()
+            )
+            upper.append(
+                torch.zeros(shape, dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+                if high is None
+                else torch.broadcast_to(high, leaf.value.shape).flatten()
+            )
+        if len(self.nodes) > 0:
+            lower = torch.cat(lower)[self.mask]
+            upper = torch.cat(upper)[self.mask]
+
+        # Index and limits for each group of elements sharing a transform
+        self.transforms = {}
+        for kind, index in kinds.items():
+            if len(index) == 0:
+                continue
+            index = torch.tensor(
+                np.concatenate(index), dtype=torch.long, device=AP_config.ap_device
+            )
+            self.transforms[kind] = (index, lower[index], upper[index])
+
+    def set_values(self, values):
+        """Vectorized form of ``Parameter_Node.vector_set_values``. The
+        values are copied once into a new buffer and unmasked leaves
+        take a view of their section of it.
+
+        """
+        values = values.clone()
+        for leaf, direct, sub in zip(self.nodes, self.direct, torch.split(values, self.counts)):
+            if direct:
+                leaf._value = sub.reshape(leaf._value.shape)
+            else:
+                leaf.vector_set_values(sub)
+
+    @property
+    def valid(self):
+        """True while the DAG structure is unchanged since the layout was built"""
+        return self.version == Node._structure_version and self.global_unlock == Node.global_unlock
+
+    def rep_to_val(self, rep):
+        """Vectorized form of ``Parameter_Node.vector_transform_rep_to_val``"""
+        val = rep
+        for kind, (index, low, high) in self.transforms.items():
+            sub = rep[index]
+            if kind == "cyclic":
+                sub = low + ((sub - low) % (high - low))
+            elif kind == "both":
+                sub = (torch.arctan(sub) + np.pi / 2) * (high - low) / np.pi + low
+            elif kind == "lower":
+                sub = (sub + low + torch.sqrt(torch.pow(sub - low, 2) + 4)) * 0.5
+            else:
+                sub = (sub + high - torch.sqrt(torch.pow(sub - high, 2) + 4)) * 0.5
+            val = val.index_put((index,), sub)
+        return val
+
+    def val_to_rep(self, val):
+        """Vectorized form of ``Parameter_Node.vector_transform_val_to_rep``"""
+        rep = val
+        for kind, (index, low, high) in self.transforms.items():
+            sub = val[index]
+            if kind == "cyclic":
+                sub = low + ((sub - low) % (high - low))
+            elif kind == "both":
+                sub = torch.tan((sub - low) * np.pi / (high - low) - np.pi / 2)
+            elif kind == "lower":
+                sub = sub - 1.0 / (sub - low)
+            else:
+                sub = sub - 1.0 / (sub - high)
+            rep = rep.index_put((index,), sub)
+        return rep
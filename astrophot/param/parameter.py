@@ -10,6 +10,7 @@ from ..utils.conversions.optimization import (
 )
 from .. import AP_config
 from .base import Node
+from .layout import Parameter_Layout
 from ..errors import InvalidParameter
 
 __all__ = ["Parameter_Node"]
@@ -126,6 +127,18 @@ class Parameter_Node(Node):
         except AttributeError:
             return torch.ones(self.shape, dtype=torch.bool, device=AP_config.ap_device)
 
+    @property
+    def layout(self):
+        """The compiled `Parameter_Layout` of the DAG below this node, it
+        is rebuilt automatically when the DAG structure changes.
+
+        """
+        layout = getattr(self, "_layout", None)
+        if layout is None or not layout.valid:
+            layout = Parameter_Layout(self)
+            self._layout = layout
+        return layout
+
     @property
     def identities(self):
         """This creates a numpy array of strings which uniquely identify
@@ -140,8 +153,7 @@ class Parameter_Node(Node):
         if self.leaf:
             idstr = str(self.identity)
             return np.array(tuple(f"{idstr}:{i}" for i in range(self.size)))
-        flat = self.flat(include_locked=False, include_links=False)
-        vec = tuple(node.identities for node in flat.values())
+        vec = tuple(node.identities for node in self.layout.nodes)
         if len(vec) > 0:
             return np.concatenate(vec)
         return np.array(())
@@ -160,8 +172,7 @@ class Parameter_Node(Node):
             if S == 1:
                 return np.array((self.name,))
             return np.array(tuple(f"{self.name}:{i}" for i in range(self.size)))
-        flat = self.flat(include_locked=False, include_links=False)
-        vec = tuple(node.names for node in flat.values())
+        vec = tuple(node.names for node in self.layout.nodes)
         if len(vec) > 0:
             return np.concatenate(vec)
         return np.array(())
@@ -182,11 +193,13 @@ class Parameter_Node(Node):
         if self.leaf:
             return self.value[self.mask].flatten()
 
-        flat = self.flat(include_locked=False, include_links=False)
-        vec = tuple(node.vector_values() for node in flat.values())
-        if len(vec) > 0:
-            return torch.cat(vec)
-        return torch.tensor((), dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        layout = self.layout
+        if len(layout.nodes) == 0:
+            return torch.tensor((), dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        vec = torch.cat(tuple(node.value.flatten() for node in layout.nodes))
+        if layout.full_mask:
+            return vec
+        return vec[layout.mask]
 
     def vector_uncertainty(self):
         """This returns a vector (see vector_values) with the uncertainty for
@@ -198,8 +211,7 @@ class Parameter_Node(Node):
                 self.uncertainty = torch.ones_like(self.value)
             return self.uncertainty[self.mask].flatten()
 
-        flat = self.flat(include_locked=False, include_links=False)
-        vec = tuple(node.vector_uncertainty() for node in flat.values())
+        vec = tuple(node.vector_uncertainty() for node in self.layout.nodes)
         if len(vec) > 0:
             return torch.cat(vec)
         return torch.tensor((), dtype=AP_config.ap_dtype, device=AP_config.ap_device)
@@ -223,11 +235,7 @@ class Parameter_Node(Node):
         if self.leaf:
             return self.mask.flatten()
 
-        flat = self.flat(include_locked=False, include_links=False)
-        vec = tuple(node.vector_mask() for node in flat.values())
-        if len(vec) > 0:
-            return torch.cat(vec)
-        return torch.tensor((), dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        return self.layout.mask.clone()
 
     def vector_identities(self):
         """This returns a vector (see vector_values) with the identities for
@@ -236,8 +244,7 @@ class Parameter_Node(Node):
         """
         if self.leaf:
             return self.identities[self.vector_mask().detach().cpu().numpy()].flatten()
-        flat = self.flat(include_locked=False, include_links=False)
-        vec = tuple(node.vector_identities() for node in flat.values())
+        vec = tuple(node.vector_identities() for node in self.layout.nodes)
         if len(vec) > 0:
             return np.concatenate(vec)
         return np.array(())
@@ -249,8 +256,7 @@ class Parameter_Node(Node):
         """
         if self.leaf:
             return self.names[self.vector_mask().detach().cpu().numpy()].flatten()
-        flat = self.flat(include_locked=False, include_links=False)
-        vec = tuple(node.vector_names() for node in flat.values())
+        vec = tuple(node.vector_names() for node in self.layout.nodes)
         if len(vec) > 0:
             return np.concatenate(vec)
         return np.array(())
@@ -269,15 +275,7 @@ class Parameter_Node(Node):
             self._value[self.mask] = values
             return
 
-        mask = self.vector_mask()
-        flat = self.flat(include_locked=False, include_links=False)
-
-        loc = 0
-        for node in flat.values():
-            node.vector_set_values(
-                values[mask[:loc].sum().int() : mask[: loc + node.size].sum().int()]
-            )
-            loc += node.size
+        self.layout.set_values(values)
 
     def vector_set_uncertainty(self, uncertainty):
         """Update the uncertainty vector for this parameter DAG (see
@@ -293,15 +291,9 @@ class Parameter_Node(Node):
             self._uncertainty[self.mask] = uncertainty
             return
 
-        mask = self.vector_mask()
-        flat = self.flat(include_locked=False, include_links=False)
-
-        loc = 0
-        for node in flat.values():
-            node.vector_set_uncertainty(
-                uncertainty[mask[:loc].sum().int() : mask[: loc + node.size].sum().int()]
-            )
-            loc += node.size
+        layout = self.layout
+        for node, start, stop in zip(layout.nodes, layout.starts[:-1], layout.starts[1:]):
+            node.vector_set_uncertainty(uncertainty[start:stop])
 
     def vector_set_mask(self, mask):
         """Update the mask vector for this parameter DAG (see
@@ -312,13 +304,11 @@ class Parameter_Node(Node):
         mask = torch.as_tensor(mask, dtype=torch.bool, device=AP_config.ap_device)
         if self.leaf:
             self._mask = mask.reshape(self.shape)
+            Node.structure_changed()
             return
-        flat = self.flat(include_locked=False, include_links=False)
-
-        loc = 0
-        for node in flat.values():
-            node.vector_set_mask(mask[loc : loc + node.size])
-            loc += node.size
+        layout = self.layout
+        for node, start, stop in zip(layout.nodes, layout.offsets[:-1], layout.offsets[1:]):
+            node.vector_set_mask(mask[start:stop])
 
     def vector_set_representation(self, rep):
         """Update the representation vector for this parameter DAG (see
@@ -357,21 +347,7 @@ class Parameter_Node(Node):
                 )
             return val
 
-        mask = self.vector_mask()
-        flat = self.flat(include_locked=False, include_links=False)
-
-        loc = 0
-        vals = []
-        for node in flat.values():
-            vals.append(
-                node.vector_transform_rep_to_val(
-                    rep[mask[:loc].sum().int() : mask[: loc + node.size].sum().int()]
-                )
-            )
-            loc += node.size
-        if len(vals) > 0:
-            return torch.cat(vals)
-        return torch.tensor((), dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        return self.layout.rep_to_val(rep)
 
     def vector_transform_val_to_rep(self, val):
         """Used to transform between the ``vector_values`` and
@@ -403,21 +379,7 @@ class Parameter_Node(Node):
                 )
             return rep
 
-        mask = self.vector_mask()
-        flat = self.flat(include_locked=False, include_links=False)
-
-        loc = 0
-        reps = []
-        for node in flat.values():
-            reps.append(
-                node.vector_transform_val_to_rep(
-                    val[mask[:loc].sum().int() : mask[: loc + node.size].sum().int()]
-                )
-            )
-            loc += node.size
-        if len(reps) > 0:
-            return torch.cat(reps)
-        return torch.tensor((), dtype=AP_config.ap_dtype, device=AP_config.ap_device)
+        return self.layout.val_to_rep(val)
 
     def _set_val_self(self, val):
         """Handles the setting of the value for a leaf node. Ensures the
@@ -483,9 +445,11 @@ class Parameter_Node(Node):
         if val is None:
             self._value = None
             self.shape = None
+            Node.structure_changed()
             return
         if isinstance(val, str):
             self._value = val
+            Node.structure_changed()
             return
         if isinstance(val, Parameter_Node):
             self._value = val
@@ -497,11 +461,15 @@ class Parameter_Node(Node):
         if isinstance(val, FunctionType):
             self._value = val
             self.shape = None
+            Node.structure_changed()
             return
         if len(self.nodes) > 0:
             self.vector_set_values(val)
             self.shape = None
             return
+        # Only a new value which changes the kind or shape of the node alters the layout
+        if not isinstance(getattr(self, "_value", None), torch.Tensor) or self.shape is None:
+            Node.structure_changed()
         self._set_val_self(val)
         self.dump()
 
@@ -574,6 +542,16 @@ class Parameter_Node(Node):
         else:
             high = torch.as_tensor(limits[1], dtype=AP_config.ap_dtype, device=AP_config.ap_device)
         self._limits = (low, high)
+        Node.structure_changed()
+
+    @property
+    def cyclic(self):
+        return self._cyclic
+
+    @cyclic.setter
+    def cyclic(self, cyclic):
+        self._cyclic = cyclic
+        Node.structure_changed()
 
     def to(self, dtype=None, device=None):
         """
@@ -593,6 +571,7 @@ class Parameter_Node(Node):
             self._uncertainty = self._uncertainty.to(dtype=dtype, device=device)
         if isinstance(self.prof, torch.Tensor):
             self.prof = self.prof.to(dtype=dtype, device=device)
+        Node.structure_changed()
         return self
 
     def get_state(self):
@@ -665,7 +644,7 @@ class Parameter_Node(Node):
     def size(self):
         if self.leaf:
             return self.value.numel()
-        return self.vector_values().numel()
+        return self.layout.size
 
     def __len__(self):
         """The number of elements required to fully describe the DAG. This is
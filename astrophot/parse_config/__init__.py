@@ -1,2 +1,3 @@
 from .basic_config import *
 from .galfit_config import *
+from .batch_config import *
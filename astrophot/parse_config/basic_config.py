@@ -8,7 +8,7 @@ from ..models import AstroPhot_Model
 from ..fit import LM
 from .. import AP_config
 
-__all__ = ["basic_config"]
+__all__ = ["basic_config", "basic_target", "basic_model", "basic_optimize"]
 
 
 def GetOptions(c):
@@ -38,13 +38,11 @@ def import_configfile(config_file):
     return c
 
 
-def basic_config(config_file):
-    c = import_configfile(config_file)  # importlib.import_module(config_file)
-    config = GetOptions(c)
+def basic_target(config):
+    """Build the `Target_Image` described by a dictionary of basic
+    config options (``ap_target`` or ``ap_target_file`` and friends).
 
-    # Parse Target
-    ######################################################################
-    AP_config.ap_logger.info("Collecting target information")
+    """
     target = config.get("ap_target", None)
     if target is None:
         target_file = config.get("ap_target_file", None)
@@ -52,11 +50,11 @@ def basic_config(config_file):
         variance_file = config.get("ap_variance_file", None)
         variance_hdu = config.get("ap_variance_hdu", 0)
         target_pixelscale = config.get("ap_target_pixelscale", None)
-        target_zeropoint = config.get("ap_target.zeropoint", None)
+        target_zeropoint = config.get("ap_target_zeropoint", None)
         target_origin = config.get("ap_target_origin", None)
 
         if variance_file is not None:
-            var_data = np.array(fits.open(target_file)[target_hdu].data, dtype=np.float64)
+            var_data = np.array(fits.open(variance_file)[variance_hdu].data, dtype=np.float64)
         else:
             var_data = None
         if target_file is not None:
@@ -68,43 +66,71 @@ def basic_config(config_file):
                 variance=var_data,
                 origin=target_origin,
             )
+    return target
 
-    # Parse Models
-    ######################################################################
-    AP_config.ap_logger.info("Constructing models")
-    model_info_list = config.get("ap_models", [])
+
+def basic_model(config, target):
+    """Build the group model described by a dictionary of basic config
+    options (``ap_models`` and/or ``ap_model_<name>`` entries).
+
+    """
+    model_info_list = list(config.get("ap_models", []))
     name_order = config.get(
         "ap_model_name_order",
         list(n[9:] for n in filter(lambda k: k.startswith("ap_model_"), config.keys())),
     )
     for name in name_order:
         key_name = "ap_model_" + name
-        model_info_list.append(config[key_name])
+        model_info_list.append(dict(config[key_name]))
         if "name" not in model_info_list[-1]:
             model_info_list[-1]["name"] = name
     model_list = []
     for model in model_info_list:
         model_list.append(AstroPhot_Model(target=target, **model))
 
-    MODEL = AstroPhot_Model(
+    return AstroPhot_Model(
         name="AstroPhot",
         model_type="group model",
         models=model_list,
         target=target,
     )
 
-    # Parse Optimize
-    ######################################################################
-    AP_config.ap_logger.info("Running optimization")
+
+def basic_optimize(config, MODEL):
+    """Initialize and optimize a model using the ``ap_optimizer`` and
+    ``ap_optimizer_kwargs`` options. Returns the optimizer, or None if
+    no optimization was requested.
+
+    """
     MODEL.initialize()
 
     optim_type = config.get("ap_optimizer", "LM")
     optim_kwargs = config.get("ap_optimizer_kwargs", {})
     if optim_type is None:
         # perform no optimization, simply write the astrophot model and the requested images
-        pass
+        return None
     elif optim_type == "LM":
-        result = LM(MODEL, **optim_kwargs).fit()
+        return LM(MODEL, **optim_kwargs).fit()
+
+
+def basic_config(config_file):
+    c = import_configfile(config_file)  # importlib.import_module(config_file)
+    config = GetOptions(c)
+
+    # Parse Target
+    ######################################################################
+    AP_config.ap_logger.info("Collecting target information")
+    target = basic_target(config)
+
+    # Parse Models
+    ######################################################################
+    AP_config.ap_logger.info("Constructing models")
+    MODEL = basic_model(config, target)
+
+    # Parse Optimize
+    ######################################################################
+    AP_config.ap_logger.info("Running optimization")
+    basic_optimize(config, MODEL)
 
     # Parse Save
     ######################################################################
@@ -0,0 +1,243 @@
+import os
+import json
+import copy
+import multiprocessing
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+
+from .basic_config import basic_target, basic_model, basic_optimize
+from .. import AP_config
+
+__all__ = ["batch_fit", "Batch_Results"]
+
+
+class Batch_Results:
+    """Columnar HDF5 file which collects the results of a batch fit one
+    object at a time. Every column is a resizable one dimensional
+    dataset with one row per object:
+
+    - ``name``: the object name from the manifest
+    - ``message``: the optimizer message, or the error if the fit failed
+    - ``chi2``: the final chi^2/DoF of the fit
+    - ``time``: wall time for the object in seconds
+    - ``parameters/<model>/<parameter>``: fitted parameter values
+    - ``uncertainty/<model>/<parameter>``: parameter uncertainties
+
+    Columns are created as new parameters are encountered and filled
+    with NaN for rows which do not have them. The ``name`` column is
+    written last for each row, so after a crash any partially written
+    row is discarded when the file is reopened. Objects already in the
+    file can be skipped with `completed` to resume a batch.
+
+    Args:
+        filename: path to the HDF5 file
+        resume: if True, keep the rows in an existing file. Otherwise the file is overwritten.
+    """
+
+    def __init__(self, filename, resume=True):
+        import h5py
+
+        self.file = h5py.File(filename, "a" if resume else "w")
+        self.columns = {}
+        self.file.visititems(self._collect_column)
+        self.nrows = len(self.columns["name"]) if "name" in self.columns else 0
+        # Drop any partially written row
+        for column in self.columns.values():
+            column.resize((self.nrows,))
+
+    def _collect_column(self, key, item):
+        if hasattr(item, "shape"):
+            self.columns[key] = item
+
+    @property
+    def completed(self):
+        """Set of object names which already have results"""
+        if self.nrows == 0:
+            return set()
+        return set(self.columns["name"].asstr()[()])
+
+    def _new_column(self, key, value):
+        import h5py
+
+        if isinstance(value, str):
+            dtype, fill = h5py.string_dtype(), ""
+        else:
+            dtype, fill = np.float64, np.nan
+        self.columns[key] = self.file.create_dataset(
+            key, shape=(self.nrows,), maxshape=(None,), dtype=dtype
+        )
+        self.columns[key][:] = fill
+
+    def append(self, row):
+        """Add a row of results. ``row`` maps column names to scalar values."""
+        for key, value in row.items():
+            if key not in self.columns:
+                self._new_column(key, value)
+        for key, column in self.columns.items():
+            if key == "name":
+                continue
+            column.resize((self.nrows + 1,))
+            column[self.nrows] = row.get(key, "" if column.dtype.kind == "O" else np.nan)
+        self.columns["name"].resize((self.nrows + 1,))
+        self.columns["name"][self.nrows] = row["name"]
+        self.nrows += 1
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_manifest(manifest):
+    """Read a batch manifest. The manifest is a YAML or JSON file (or
+    an already loaded object) which is either a list of objects or a
+    dictionary with an ``objects`` list and optional ``defaults``. Each
+    object is a dictionary of basic config options (the ``ap_`` prefix
+    may be dropped) plus a unique ``name``. The ``defaults`` are
+    applied to every object, so for example a single model template
+    can be shared by all the cutouts.
+
+    Returns:
+        list: one dictionary of ``ap_`` config options per object
+    """
+    if isinstance(manifest, str):
+        with open(manifest, "r") as f:
+            if manifest.endswith(".json"):
+                manifest = json.load(f)
+            else:
+                import yaml
+
+                manifest = yaml.safe_load(f)
+    if isinstance(manifest, dict):
+        defaults = manifest.get("defaults", {})
+        objects = manifest["objects"]
+    else:
+        defaults = {}
+        objects = manifest
+
+    def ap_keys(options):
+        return dict(
+            (key if key.startswith("ap_") or key == "name" else f"ap_{key}", value)
+            for key, value in options.items()
+        )
+
+    entries = []
+    for i, obj in enumerate(objects):
+        entry = ap_keys(defaults)
+        entry.update(ap_keys(obj))
+        entry.setdefault("name", f"object_{i}")
+        entries.append(entry)
+    names = list(entry["name"] for entry in entries)
+    if len(set(names)) != len(names):
+        raise ValueError("Batch manifest object names must be unique")
+    return entries
+
+
+def _init_worker(dtype, device, num_threads):
+    """Configure a worker process for a batch fit"""
+    AP_config.ap_dtype = dtype
+    AP_config.ap_device = device
+    torch.set_num_threads(num_threads)
+
+
+def fit_object(config):
+    """Build, initialize, and fit a single batch object. Errors are
+    caught and reported in the message so one bad cutout does not stop
+    the batch.
+
+    Returns:
+        dict: a row of results, see `Batch_Results`
+    """
+    start = time()
+    row = {"name": config["name"]}
+    try:
+        target = basic_target(config)
+        MODEL = basic_model(config, target)
+        res = basic_optimize(config, MODEL)
+        if res is None:
+            row["message"] = "no optimization"
+        else:
+            row["message"] = res.message
+            row["chi2"] = float(res.res_loss())
+            res.update_uncertainty()
+        for model in MODEL.models.values():
+            names = model.parameters.vector_names()
+            values = model.parameters.vector_values().detach().cpu().numpy()
+            uncertainty = model.parameters.vector_uncertainty().detach().cpu().numpy()
+            for name, value, unc in zip(names, values, uncertainty):
+                row[f"parameters/{model.name}/{name}"] = value
+                row[f"uncertainty/{model.name}/{name}"] = unc
+        if "ap_saveto_model" in config:
+            MODEL.save(config["ap_saveto_model"])
+    except Exception as e:
+        row["message"] = f"fail {type(e).__name__}: {e}"
+    row["time"] = time() - start
+    return row
+
+
+def batch_fit(
+    manifest,
+    output="AstroPhot_batch.hdf5",
+    workers=1,
+    threads_per_worker=None,
+    resume=True,
+):
+    """Fit many independent objects, for example a catalog of galaxy
+    cutouts, each with its own target and model. Objects are described
+    in a manifest (see `load_manifest`) and the fits are distributed
+    over a pool of worker processes. Results are streamed to a
+    columnar HDF5 file (see `Batch_Results`) as each object finishes,
+    so a crashed or interrupted batch can be resumed and only the
+    missing objects will be fit.
+
+    Worker processes are started with ``spawn``, so scripts using this
+    must guard their entry point with ``if __name__ == "__main__":``.
+
+    Args:
+        manifest: path to a YAML/JSON manifest, or the loaded manifest
+        output: path to the HDF5 results file
+        workers: number of worker processes, 1 fits the objects in this process
+        threads_per_worker: torch threads per worker, defaults to ``cpu_count // workers``
+        resume: if True, skip objects which are already in the output file
+
+    Returns:
+        int: the number of objects fit
+    """
+    entries = load_manifest(manifest)
+    if threads_per_worker is None:
+        threads_per_worker = max(1, os.cpu_count() // workers)
+
+    with Batch_Results(output, resume=resume) as results:
+        completed = results.completed
+        todo = list(entry for entry in entries if entry["name"] not in completed)
+        AP_config.ap_logger.info(
+            f"Batch fitting {len(todo)} objects ({len(entries) - len(todo)} already complete)"
+        )
+
+        if workers <= 1:
+            for entry in todo:
+                row = fit_object(copy.deepcopy(entry))
+                results.append(row)
+                AP_config.ap_logger.info(f"{row['name']}: {row['message']}")
+            return len(todo)
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(AP_config.ap_dtype, AP_config.ap_device, threads_per_worker),
+        ) as pool:
+            futures = list(pool.submit(fit_object, entry) for entry in todo)
+            for future in as_completed(futures):
+                row = future.result()
+                results.append(row)
+                AP_config.ap_logger.info(f"{row['name']}: {row['message']}")
+    return len(todo)
@@ -8,6 +8,7 @@ from . import (
     isophote,
     initialize,
     conversions,
+    profiling,
 )
 
 __all__ = [
@@ -20,4 +21,5 @@ __all__ = [
     "isophote",
     "initialize",
     "conversions",
+    "profiling",
 ]
@@ -22,6 +22,21 @@ def sersic_n_to_b(n):
     )
 
 
+def sersic_n_to_b_derivative(n):
+    """Derivative of `sersic_n_to_b` with respect to the sersic index
+    `n`.
+
+    """
+
+    return (
+        2
+        - 4 / (405 * n**2)
+        - 92 / (25515 * n**3)
+        - 393 / (1148175 * n**4)
+        + 8778788 / (30690717750 * n**5)
+    )
+
+
 def sersic_I0_to_flux_np(I0, n, R, q):
     """Compute the total flux integrated to infinity for a 2D elliptical
     sersic given the :math:`I_0,n,R_s,q` parameters which uniquely
@@ -4,6 +4,8 @@ import warnings
 
 import numpy as np
 
+from .profiling import profiler
+
 
 def ignore_numpy_warnings(func):
     """This decorator is used to turn off numpy warnings. This should
@@ -36,9 +38,22 @@ def default_internal(func):
 
     """
     sig = inspect.signature(func)
+    names = list(sig.parameters.keys())[1:]
+    image_index = names.index("image") if "image" in names else None
+    parameters_index = names.index("parameters") if "parameters" in names else None
+
+    def given(args, kwargs, name, index):
+        if index is not None and index < len(args):
+            return args[index] is not None
+        return kwargs.get(name, None) is not None
 
     @wraps(func)
     def wrapper(self, *args, **kwargs):
+        # Nothing to fill in, skip the (slow and untraceable) signature binding
+        if given(args, kwargs, "image", image_index) and given(
+            args, kwargs, "parameters", parameters_index
+        ):
+            return func(self, *args, **kwargs)
         bound = sig.bind(self, *args, **kwargs)
         bound.apply_defaults()
 
@@ -50,3 +65,24 @@ def default_internal(func):
         return func(*bound.args, **bound.kwargs)
 
     return wrapper
+
+
+def profiled(stage):
+    """This decorator records the wall time of a method as `stage` with
+    the profiler (see `astrophot.utils.profiling`), the object the
+    method is called on is the owner of the record. While profiling is
+    disabled the method is called directly.
+
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not profiler.enabled:
+                return func(self, *args, **kwargs)
+            with profiler.stage(stage, self):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
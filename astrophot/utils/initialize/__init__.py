@@ -12,6 +12,7 @@ __all__ = (
     "gaussian_psf",
     "moffat_psf",
     "construct_psf",
+    "segmentation_map_statistics",
     "centroids_from_segmentation_map",
     "PA_from_segmentation_map",
     "q_from_segmentation_map",
@@ -2,7 +2,7 @@ import numpy as np
 from scipy.stats import iqr
 from scipy.fftpack import fft
 
-from ..isophote.extract import _iso_extract
+from ..isophote.extract import _iso_extract_batch
 
 
 def isophotes(image, center, threshold=None, pa=None, q=None, R=None, n_isophotes=3, more=False):
@@ -22,28 +22,32 @@ def isophotes(image, center, threshold=None, pa=None, q=None, R=None, n_isophote
         if threshold is None:
             threshold = np.nanmedian(image) + 3 * iqr(image[np.isfinite(image)], rng=(16, 84)) / 2
 
-        # Sample growing isophotes until threshold is reached
+        # Sample growing isophotes until threshold is reached, all
+        # candidate radii are extracted together
         ellipse_radii = [1.0]
         while ellipse_radii[-1] < (max(image.shape) / 2):
             ellipse_radii.append(ellipse_radii[-1] * (1 + 0.2))
-            isovals = _iso_extract(
-                image,
-                ellipse_radii[-1],
-                {
-                    "q": q if isinstance(q, float) else np.max(q),
-                    "pa": pa if isinstance(pa, float) else np.min(pa),
-                },
-                {"x": center[0], "y": center[1]},
-                more=False,
-                sigmaclip=True,
-                sclip_nsigma=3,
-            )
+        grow_params = {
+            "q": q if isinstance(q, float) else np.max(q),
+            "pa": pa if isinstance(pa, float) else np.min(pa),
+        }
+        all_isovals = _iso_extract_batch(
+            image,
+            ellipse_radii[1:],
+            list(dict(grow_params) for _ in ellipse_radii[1:]),
+            {"x": center[0], "y": center[1]},
+            more=False,
+            sigmaclip=True,
+            sclip_nsigma=3,
+        )
+        R = ellipse_radii[-1]
+        for i, isovals in enumerate(all_isovals):
             if len(isovals) < 3:
                 continue
             # Stop when at 3 time background noise
-            if (np.quantile(isovals, 0.8) < threshold) and len(ellipse_radii) > 4:
+            if (np.quantile(isovals, 0.8) < threshold) and i >= 3:
+                R = ellipse_radii[i + 1]
                 break
-        R = ellipse_radii[-1]
 
     # Determine which radii to sample based on input R, pa, and q
     if isinstance(pa, float) and isinstance(q, float) and isinstance(R, float):
@@ -59,22 +63,25 @@ def isophotes(image, center, threshold=None, pa=None, q=None, R=None, n_isophote
         isophote_radii = np.ones(len(q)) * R
 
     # Sample the requested isophotes and record desired info
-    iso_info = []
-    for i, r in enumerate(isophote_radii):
-        iso_info.append({"R": r})
-        isovals = _iso_extract(
-            image,
-            r,
+    all_isovals = _iso_extract_batch(
+        image,
+        isophote_radii,
+        list(
             {
                 "q": q if isinstance(q, float) else q[i],
                 "pa": pa if isinstance(pa, float) else pa[i],
-            },
-            {"x": center[0], "y": center[1]},
-            more=more,
-            sigmaclip=True,
-            sclip_nsigma=3,
-            interp_mask=True,
-        )
+            }
+            for i in range(len(isophote_radii))
+        ),
+        {"x": center[0], "y": center[1]},
+        more=more,
+        sigmaclip=True,
+        sclip_nsigma=3,
+        interp_mask=True,
+    )
+    iso_info = []
+    for r, isovals in zip(isophote_radii, all_isovals):
+        iso_info.append({"R": r})
         if more:
             angles = isovals[1]
             isovals = isovals[0]
@@ -84,8 +91,8 @@ def isophotes(image, center, threshold=None, pa=None, q=None, R=None, n_isophote
         coefs = fft(isovals)
         iso_info[-1]["phase1"] = np.angle(coefs[1])
         iso_info[-1]["phase2"] = np.angle(coefs[2])
-        iso_info[-1]["flux"] = np.median(isovals)
-        iso_info[-1]["noise"] = iqr(isovals, rng=(16, 84)) / 2
+        low, iso_info[-1]["flux"], high = np.percentile(isovals, [16, 50, 84])
+        iso_info[-1]["noise"] = (high - low) / 2
         iso_info[-1]["amplitude1"] = np.abs(coefs[1]) / (
             len(isovals) * (max(0, iso_info[-1]["flux"]) + iso_info[-1]["noise"])
         )
@@ -4,10 +4,9 @@ from typing import Union
 import numpy as np
 import torch
 from astropy.io import fits
-from ..angle_operations import Angle_COM_PA
-from ..operations import axis_ratio_com
 
 __all__ = (
+    "segmentation_map_statistics",
     "centroids_from_segmentation_map",
     "PA_from_segmentation_map",
     "q_from_segmentation_map",
@@ -30,6 +29,117 @@ def _select_img(img, hduli):
     return img
 
 
+def segmentation_map_statistics(
+    seg_map: Union[np.ndarray, str],
+    image: Union[np.ndarray, str, None] = None,
+    centroids=None,
+    PAs=None,
+    hdul_index_seg: int = 0,
+    hdul_index_img: int = 0,
+    skip_index: tuple = (0,),
+    north=np.pi / 2,
+):
+    """Compute the basic statistics for every segment in a segmentation map
+
+    All segments are handled together in a single pass over the
+    pixels. Each pixel is assigned the position of its segment in a
+    table and the per segment sums are accumulated with
+    ``np.bincount``, the bounding boxes come from
+    ``scipy.ndimage.find_objects``. This scales with the number of
+    pixels instead of the number of segments times the number of
+    pixels, which matters for crowded fields with many thousands of
+    segments.
+
+    Parameters:
+    ----------
+      seg_map (Union[np.ndarray, str]): A segmentation map which gives the object identity for each pixel
+      image (Union[np.ndarray, str]): An Image used for the light weighted statistics. If None, only the windows and pixel counts are computed. Default: None
+      centroids (dict): Optional centroids to use in place of the computed ones when finding PA and q
+      PAs (dict): Optional position angles to use in place of the computed ones when finding q
+      hdul_index_seg (int): If reading from a fits file this is the hdu list index at which the map is found. Default: 0
+      hdul_index_img (int): If reading from a fits file this is the hdu list index at which the image is found. Default: 0
+      skip_index (tuple): Lists which identities (if any) in the segmentation map should be ignored. Default (0,)
+      north (float): Angle of north relative to the x-axis, added to the PA. Default: pi/2
+
+    Returns:
+      statistics (dict): table of per segment arrays, with keys "index" (segment ID), "npix" (pixel count), "window" (N,2,2) pixel bounding boxes formatted as [[xmin,xmax],[ymin,ymax]], and if an image is given "flux", "centroid" (N,2) in pixel coordinates, "PA", and "q"
+    """
+    from scipy.ndimage import find_objects
+
+    seg_map = _select_img(seg_map, hdul_index_seg)
+
+    # Position of each pixel's segment in the table
+    labels, inverse = np.unique(seg_map, return_inverse=True)
+    inverse = inverse.reshape(seg_map.shape)
+    keep = np.logical_not(np.isin(labels, skip_index))
+    statistics = {
+        "index": labels[keep],
+        "npix": np.bincount(inverse.ravel(), minlength=len(labels))[keep],
+    }
+
+    windows = np.zeros((len(labels), 2, 2), dtype=int)
+    for i, box in enumerate(find_objects(inverse + 1)):
+        windows[i] = [[box[1].start, box[1].stop - 1], [box[0].start, box[0].stop - 1]]
+    statistics["window"] = windows[keep]
+
+    if image is None:
+        return statistics
+    image = _select_img(image, hdul_index_img)
+
+    inverse = inverse.ravel()
+    flux = np.asarray(image, dtype=np.float64).ravel()
+    YY, XX = np.indices(seg_map.shape)
+    XX = XX.ravel()
+    YY = YY.ravel()
+
+    def segment_sum(weights):
+        return np.bincount(inverse, weights=weights, minlength=len(labels))
+
+    def from_dict(values, computed):
+        if values is None:
+            return computed
+        computed = computed.copy()
+        for i, index in enumerate(labels):
+            if index in values:
+                computed[i] = values[index]
+        return computed
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        total = segment_sum(flux)
+        xcentroid = from_dict(
+            None if centroids is None else dict((k, v[0]) for k, v in centroids.items()),
+            segment_sum(XX * flux) / total,
+        )
+        ycentroid = from_dict(
+            None if centroids is None else dict((k, v[1]) for k, v in centroids.items()),
+            segment_sum(YY * flux) / total,
+        )
+        theta = np.arctan2(YY - ycentroid[inverse], XX - xcentroid[inverse])
+
+        # Angular center of mass, see Angle_COM_PA
+        PA = (
+            np.arctan2(
+                segment_sum(flux * np.sin(2 * theta)) / total,
+                segment_sum(flux * np.cos(2 * theta)) / total,
+            )
+            / 2
+            % np.pi
+        ) + north
+        PA = from_dict(PAs, PA)
+
+        # Axis ratio center of mass, see axis_ratio_com
+        theta = theta - (PA[inverse] + north)
+        ang_com_cos = segment_sum(flux * np.cos(theta) ** 2) / total
+        ang_com_sin = segment_sum(flux * np.sin(theta) ** 2) / total
+        q = ang_com_sin / np.maximum(ang_com_sin, ang_com_cos)
+
+    statistics["flux"] = total[keep]
+    statistics["centroid"] = np.stack((xcentroid, ycentroid), axis=-1)[keep]
+    statistics["PA"] = PA[keep]
+    statistics["q"] = q[keep]
+    return statistics
+
+
 def centroids_from_segmentation_map(
     seg_map: Union[np.ndarray, str],
     image: Union[np.ndarray, str],
@@ -55,22 +165,14 @@ def centroids_from_segmentation_map(
       centroids (dict): dictionary of centroid positions matched to each segment ID. The centroids are in pixel coordinates
     """
 
-    seg_map = _select_img(seg_map, hdul_index_seg)
-    image = _select_img(image, hdul_index_img)
-
-    centroids = {}
-
-    XX, YY = np.meshgrid(np.arange(seg_map.shape[1]), np.arange(seg_map.shape[0]))
-
-    for index in np.unique(seg_map):
-        if index is None or index in skip_index:
-            continue
-        N = seg_map == index
-        xcentroid = np.sum(XX[N] * image[N]) / np.sum(image[N])
-        ycentroid = np.sum(YY[N] * image[N]) / np.sum(image[N])
-        centroids[index] = [xcentroid, ycentroid]
-
-    return centroids
+    statistics = segmentation_map_statistics(
+        seg_map,
+        image,
+        hdul_index_seg=hdul_index_seg,
+        hdul_index_img=hdul_index_img,
+        skip_index=skip_index,
+    )
+    return dict(zip(statistics["index"], statistics["centroid"].tolist()))
 
 
 def PA_from_segmentation_map(
@@ -83,27 +185,16 @@ def PA_from_segmentation_map(
     north=np.pi / 2,
 ):
 
-    seg_map = _select_img(seg_map, hdul_index_seg)
-    image = _select_img(image, hdul_index_img)
-
-    if centroids is None:
-        centroids = centroids_from_segmentation_map(
-            seg_map=seg_map, image=image, skip_index=skip_index
-        )
-
-    XX, YY = np.meshgrid(np.arange(image.shape[1]), np.arange(image.shape[0]))
-
-    PAs = {}
-    for index in np.unique(seg_map):
-        if index is None or index in skip_index:
-            continue
-        N = seg_map == index
-        PA = (
-            Angle_COM_PA(image[N], XX[N] - centroids[index][0], YY[N] - centroids[index][1]) + north
-        )
-        PAs[index] = PA
-
-    return PAs
+    statistics = segmentation_map_statistics(
+        seg_map,
+        image,
+        centroids=centroids,
+        hdul_index_seg=hdul_index_seg,
+        hdul_index_img=hdul_index_img,
+        skip_index=skip_index,
+        north=north,
+    )
+    return dict(zip(statistics["index"], statistics["PA"]))
 
 
 def q_from_segmentation_map(
@@ -117,30 +208,17 @@ def q_from_segmentation_map(
     north=np.pi / 2,
 ):
 
-    seg_map = _select_img(seg_map, hdul_index_seg)
-    image = _select_img(image, hdul_index_img)
-
-    if centroids is None:
-        centroids = centroids_from_segmentation_map(
-            seg_map=seg_map, image=image, skip_index=skip_index
-        )
-    if PAs is None:
-        PAs = PA_from_segmentation_map(
-            seg_map=seg_map, image=image, centroids=centroids, skip_index=skip_index
-        )
-
-    XX, YY = np.meshgrid(np.arange(image.shape[1]), np.arange(image.shape[0]))
-
-    qs = {}
-    for index in np.unique(seg_map):
-        if index is None or index in skip_index:
-            continue
-        N = seg_map == index
-        qs[index] = axis_ratio_com(
-            image[N], PAs[index] + north, XX[N] - centroids[index][0], YY[N] - centroids[index][1]
-        )
-
-    return qs
+    statistics = segmentation_map_statistics(
+        seg_map,
+        image,
+        centroids=centroids,
+        PAs=PAs,
+        hdul_index_seg=hdul_index_seg,
+        hdul_index_img=hdul_index_img,
+        skip_index=skip_index,
+        north=north,
+    )
+    return dict(zip(statistics["index"], statistics["q"]))
 
 
 def windows_from_segmentation_map(seg_map, hdul_index=0, skip_index=(0,)):
@@ -159,25 +237,10 @@ def windows_from_segmentation_map(seg_map, hdul_index=0, skip_index=(0,)):
 
     """
 
-    if isinstance(seg_map, str):
-        if seg_map.endswith(".fits"):
-            hdul = fits.open(seg_map)
-            seg_map = hdul[hdul_index].data
-        elif seg_map.endswith(".npy"):
-            seg_map = np.load(seg_map)
-        else:
-            raise ValueError(f"unrecognized file type, should be one of: fits, npy\n{seg_map}")
-
-    windows = {}
-
-    for index in np.unique(seg_map):
-        if index is None or index in skip_index:
-            continue
-        Yid, Xid = np.where(seg_map == index)
-        # Get window from segmap
-        windows[index] = [[np.min(Xid), np.max(Xid)], [np.min(Yid), np.max(Yid)]]
-
-    return windows
+    statistics = segmentation_map_statistics(
+        seg_map, hdul_index_seg=hdul_index, skip_index=skip_index
+    )
+    return dict(zip(statistics["index"], statistics["window"].tolist()))
 
 
 def scale_windows(windows, image_shape=None, expand_scale=1.0, expand_border=0.0):
@@ -227,6 +290,11 @@ def filter_windows(
     """
     Filter a set of windows based on a set of criteria.
 
+    The windows are collected into a single table so each criterion
+    is checked for all windows at once. Window fluxes are read from a
+    summed area table of the image, so the cost does not grow with the
+    size of the windows.
+
     Parameters
     ----------
         min_size: minimum size of the window in pixels
@@ -237,60 +305,36 @@ def filter_windows(
         max_flux: maximum flux of the window in ADU
         image: the image from which the flux is calculated for min_flux and max_flux
     """
-    new_windows = {}
-    for w in list(windows.keys()):
-        if min_size is not None:
-            if (
-                min(
-                    windows[w][0][1] - windows[w][0][0],
-                    windows[w][1][1] - windows[w][1][0],
-                )
-                < min_size
-            ):
-                continue
-        if max_size is not None:
-            if (
-                max(
-                    windows[w][0][1] - windows[w][0][0],
-                    windows[w][1][1] - windows[w][1][0],
-                )
-                > max_size
-            ):
-                continue
-        if min_area is not None:
-            if (
-                (windows[w][0][1] - windows[w][0][0]) * (windows[w][1][1] - windows[w][1][0])
-            ) < min_area:
-                continue
-        if max_area is not None:
-            if (
-                (windows[w][0][1] - windows[w][0][0]) * (windows[w][1][1] - windows[w][1][0])
-            ) > max_area:
-                continue
+    keys = list(windows.keys())
+    if len(keys) == 0:
+        return {}
+    table = np.array(list(windows[w] for w in keys), dtype=int)
+    width = table[:, 0, 1] - table[:, 0, 0]
+    height = table[:, 1, 1] - table[:, 1, 0]
+
+    keep = np.ones(len(keys), dtype=bool)
+    if min_size is not None:
+        keep &= np.minimum(width, height) >= min_size
+    if max_size is not None:
+        keep &= np.maximum(width, height) <= max_size
+    if min_area is not None:
+        keep &= width * height >= min_area
+    if max_area is not None:
+        keep &= width * height <= max_area
+    if min_flux is not None or max_flux is not None:
+        # Summed area table, padded so that windows touching the edge index correctly
+        sat = np.zeros((image.shape[0] + 1, image.shape[1] + 1))
+        sat[1:, 1:] = np.cumsum(np.cumsum(image, axis=0), axis=1)
+        x0, x1 = (np.clip(table[:, 0, i], 0, image.shape[1]) for i in (0, 1))
+        y0, y1 = (np.clip(table[:, 1, i], 0, image.shape[0]) for i in (0, 1))
+        x1 = np.maximum(x0, x1)
+        y1 = np.maximum(y0, y1)
+        flux = sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
         if min_flux is not None:
-            if (
-                np.sum(
-                    image[
-                        windows[w][1][0] : windows[w][1][1],
-                        windows[w][0][0] : windows[w][0][1],
-                    ]
-                )
-                < min_flux
-            ):
-                continue
+            keep &= flux >= min_flux
         if max_flux is not None:
-            if (
-                np.sum(
-                    image[
-                        windows[w][1][0] : windows[w][1][1],
-                        windows[w][0][0] : windows[w][0][1],
-                    ]
-                )
-                > max_flux
-            ):
-                continue
-        new_windows[w] = windows[w]
-    return new_windows
+            keep &= flux <= max_flux
+    return dict((w, windows[w]) for w, k in zip(keys, keep) if k)
 
 
 def transfer_windows(windows, base_image, new_image):
@@ -233,44 +233,30 @@ def interpolate_Lanczos(img, X, Y, scale):
     """
     Perform Lanczos interpolation on an image at a series of specified points.
     https://pixinsight.com/doc/docs/InterpolationAlgorithms/InterpolationAlgorithms.html
+
+    All points are interpolated at once, each point uses the ``2 *
+    scale`` pixels on either axis around it. Kernel taps which fall
+    outside the image are dropped and the remaining weights are
+    renormalized.
     """
-    flux = []
-
-    for i in range(len(X)):
-        box = [
-            [
-                max(0, int(round(np.floor(X[i]) - scale + 1))),
-                min(img.shape[1], int(round(np.floor(X[i]) + scale + 1))),
-            ],
-            [
-                max(0, int(round(np.floor(Y[i]) - scale + 1))),
-                min(img.shape[0], int(round(np.floor(Y[i]) + scale + 1))),
-            ],
-        ]
-        chunk = img[box[1][0] : box[1][1], box[0][0] : box[0][1]]
-        XX = np.ones(chunk.shape)
-        Lx = (
-            np.sinc(np.arange(-scale + 1, scale + 1) - X[i] + np.floor(X[i]))
-            * np.sinc((np.arange(-scale + 1, scale + 1) - X[i] + np.floor(X[i])) / scale)
-        )[
-            box[0][0]
-            - int(round(np.floor(X[i]) - scale + 1)) : 2 * scale
-            + box[0][1]
-            - int(round(np.floor(X[i]) + scale + 1))
-        ]
-        Ly = (
-            np.sinc(np.arange(-scale + 1, scale + 1) - Y[i] + np.floor(Y[i]))
-            * np.sinc((np.arange(-scale + 1, scale + 1) - Y[i] + np.floor(Y[i])) / scale)
-        )[
-            box[1][0]
-            - int(round(np.floor(Y[i]) - scale + 1)) : 2 * scale
-            + box[1][1]
-            - int(round(np.floor(Y[i]) + scale + 1))
-        ]
-        L = XX * Lx * Ly.reshape((Ly.size, -1))
-        w = np.sum(L)
-        flux.append(np.sum(chunk * L) / w)
-    return np.array(flux)
+    X = np.asarray(X, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    taps = np.arange(-scale + 1, scale + 1)
+    fX = np.floor(X)
+    fY = np.floor(Y)
+    dX = taps - (X - fX)[:, None]
+    dY = taps - (Y - fY)[:, None]
+    Lx = np.sinc(dX) * np.sinc(dX / scale)
+    Ly = np.sinc(dY) * np.sinc(dY / scale)
+    iX = fX.astype(int)[:, None] + taps
+    iY = fY.astype(int)[:, None] + taps
+    Lx = Lx * ((iX >= 0) & (iX < img.shape[1]))
+    Ly = Ly * ((iY >= 0) & (iY < img.shape[0]))
+    iX = np.clip(iX, 0, img.shape[1] - 1)
+    iY = np.clip(iY, 0, img.shape[0] - 1)
+    L = Ly[:, :, None] * Lx[:, None, :]
+    chunk = img[iY[:, :, None], iX[:, None, :]]
+    return np.sum(chunk * L, axis=(1, 2)) / np.sum(L, axis=(1, 2))
 
 
 def interp1d_torch(x_in, y_in, x_out):
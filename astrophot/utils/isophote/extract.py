@@ -1,6 +1,5 @@
 import numpy as np
 import logging
-from scipy.stats import iqr
 
 from .ellipse import parametric_SuperEllipse, Rscale_SuperEllipse
 from ..conversions.coordinates import Rotate_Cartesian_np
@@ -20,8 +19,8 @@ def Sigma_Clip_Upper(v, iterations=10, nsigma=5):
     old_lim = 0
     lim = np.inf
     while i < iterations and old_lim != lim:
-        med = np.median(v2[v2 < lim])
-        rng = iqr(v2[v2 < lim], rng=[16, 84]) / 2
+        low, med, high = np.percentile(v2[v2 < lim], [16, 50, 84])
+        rng = (high - low) / 2
         old_lim = lim
         lim = med + rng * nsigma
         i += 1
@@ -104,24 +103,9 @@ def _iso_between(
             return fluxes
 
 
-def _iso_extract(
-    IMG,
-    sma,
-    PARAMS,
-    c,
-    more=False,
-    minN=None,
-    mask=None,
-    interp_mask=False,
-    rad_interp=30,
-    interp_method="lanczos",
-    interp_window=5,
-    sigmaclip=False,
-    sclip_iterations=10,
-    sclip_nsigma=5,
-):
+def _iso_points(shape, sma, PARAMS, c, minN=None):
     """
-    Internal, basic function for extracting the pixel fluxes along an isophote
+    Internal, positions and angles of the samples along an isophote which fall inside the image
     """
     if "m" not in PARAMS:
         PARAMS["m"] = None
@@ -152,35 +136,33 @@ def _iso_extract(
 
     # Reject samples from outside the image
     BORDER = np.logical_and(
-        np.logical_and(X >= 0, X < (IMG.shape[1] - 1)),
-        np.logical_and(Y >= 0, Y < (IMG.shape[0] - 1)),
+        np.logical_and(X >= 0, X < (shape[1] - 1)),
+        np.logical_and(Y >= 0, Y < (shape[0] - 1)),
     )
     if not np.all(BORDER):
         X = X[BORDER]
         Y = Y[BORDER]
         theta = theta[BORDER]
+    return X, Y, theta, np.max(R)
 
-    Rlim = np.max(R)
-    if Rlim < rad_interp:
-        box = [
-            [max(0, int(c["x"] - Rlim - 5)), min(IMG.shape[1], int(c["x"] + Rlim + 5))],
-            [max(0, int(c["y"] - Rlim - 5)), min(IMG.shape[0], int(c["y"] + Rlim + 5))],
-        ]
-        if interp_method == "bicubic":
-            flux = interpolate_bicubic(
-                IMG[box[1][0] : box[1][1], box[0][0] : box[0][1]],
-                X - box[0][0],
-                Y - box[1][0],
-            )
-        elif interp_method == "lanczos":
-            flux = interpolate_Lanczos(IMG, X, Y, interp_window)
-        else:
-            raise ValueError(
-                "Unknown interpolate method %s. Should be one of lanczos or bicubic" % interp_method
-            )
-    else:
-        # round to integers and sample pixels values
-        flux = IMG[np.rint(Y).astype(np.int32), np.rint(X).astype(np.int32)]
+
+def _iso_clip(
+    flux,
+    X,
+    Y,
+    theta,
+    sma,
+    PARAMS,
+    more=False,
+    mask=None,
+    interp_mask=False,
+    sigmaclip=False,
+    sclip_iterations=10,
+    sclip_nsigma=5,
+):
+    """
+    Internal, mask and sigma clip the pixel fluxes sampled along an isophote
+    """
     # CHOOSE holds boolean array for which flux values to keep, initialized as None for no clipping
     CHOOSE = None
     # Mask pixels if a mask is given
@@ -218,6 +200,124 @@ def _iso_extract(
         return flux
 
 
+def _iso_extract_batch(
+    IMG,
+    smas,
+    PARAMS,
+    c,
+    more=False,
+    minN=None,
+    mask=None,
+    interp_mask=False,
+    rad_interp=30,
+    interp_method="lanczos",
+    interp_window=5,
+    sigmaclip=False,
+    sclip_iterations=10,
+    sclip_nsigma=5,
+):
+    """
+    Internal, extract the pixel fluxes along several isophotes at once. ``smas`` and
+    ``PARAMS`` are lists with one entry per isophote, the results are the same as
+    calling `_iso_extract` for each isophote. The Lanczos interpolation for all of the
+    isophotes is done in a single batch.
+    """
+    points = list(_iso_points(IMG.shape, sma, params, c, minN) for sma, params in zip(smas, PARAMS))
+
+    # Interpolate all small isophotes together
+    lanczos = list(i for i, point in enumerate(points) if point[3] < rad_interp)
+    fluxes = [None] * len(points)
+    if interp_method == "lanczos" and len(lanczos) > 0:
+        flux = interpolate_Lanczos(
+            IMG,
+            np.concatenate(list(points[i][0] for i in lanczos)),
+            np.concatenate(list(points[i][1] for i in lanczos)),
+            interp_window,
+        )
+        for i, sub in zip(
+            lanczos, np.split(flux, np.cumsum(list(len(points[i][0]) for i in lanczos))[:-1])
+        ):
+            fluxes[i] = sub
+
+    results = []
+    for i, (X, Y, theta, Rlim) in enumerate(points):
+        if fluxes[i] is not None:
+            flux = fluxes[i]
+        elif Rlim < rad_interp:
+            box = [
+                [max(0, int(c["x"] - Rlim - 5)), min(IMG.shape[1], int(c["x"] + Rlim + 5))],
+                [max(0, int(c["y"] - Rlim - 5)), min(IMG.shape[0], int(c["y"] + Rlim + 5))],
+            ]
+            if interp_method == "bicubic":
+                flux = interpolate_bicubic(
+                    IMG[box[1][0] : box[1][1], box[0][0] : box[0][1]],
+                    X - box[0][0],
+                    Y - box[1][0],
+                )
+            else:
+                raise ValueError(
+                    "Unknown interpolate method %s. Should be one of lanczos or bicubic"
+                    % interp_method
+                )
+        else:
+            # round to integers and sample pixels values
+            flux = IMG[np.rint(Y).astype(np.int32), np.rint(X).astype(np.int32)]
+        results.append(
+            _iso_clip(
+                flux,
+                X,
+                Y,
+                theta,
+                smas[i],
+                PARAMS[i],
+                more=more,
+                mask=mask,
+                interp_mask=interp_mask,
+                sigmaclip=sigmaclip,
+                sclip_iterations=sclip_iterations,
+                sclip_nsigma=sclip_nsigma,
+            )
+        )
+    return results
+
+
+def _iso_extract(
+    IMG,
+    sma,
+    PARAMS,
+    c,
+    more=False,
+    minN=None,
+    mask=None,
+    interp_mask=False,
+    rad_interp=30,
+    interp_method="lanczos",
+    interp_window=5,
+    sigmaclip=False,
+    sclip_iterations=10,
+    sclip_nsigma=5,
+):
+    """
+    Internal, basic function for extracting the pixel fluxes along an isophote
+    """
+    return _iso_extract_batch(
+        IMG,
+        [sma],
+        [PARAMS],
+        c,
+        more=more,
+        minN=minN,
+        mask=mask,
+        interp_mask=interp_mask,
+        rad_interp=rad_interp,
+        interp_method=interp_method,
+        interp_window=interp_window,
+        sigmaclip=sigmaclip,
+        sclip_iterations=sclip_iterations,
+        sclip_nsigma=sclip_nsigma,
+    )[0]
+
+
 def _iso_line(IMG, length, width, pa, c, more=False):
     start = np.array([c["x"], c["y"]])
     end = start + length * np.array([np.cos(pa), np.sin(pa)])
@@ -1,22 +1,47 @@
 from functools import lru_cache
+from collections import OrderedDict
+from time import perf_counter
+import types
+import weakref
 
 import torch
+import torch.autograd.forward_ad as fwAD
 from scipy.fft import next_fast_len
 from scipy.special import roots_legendre
 import numpy as np
 
+from .. import AP_config
 
-def fft_convolve_torch(img, psf, psf_fft=False, img_prepadded=False):
+
+@lru_cache(maxsize=256)
+def fast_fft_shape(img_shape, psf_shape):
+    """Padded shape for an fft convolution, cached since `next_fast_len`
+    is otherwise recomputed on every call.
+
+    """
+    return tuple(
+        next_fast_len(int(d + (p + 1) / 2), real=True) for d, p in zip(img_shape, psf_shape)
+    )
+
+
+def fft_convolve_torch(img, psf, psf_fft=False, img_prepadded=False, psf_shape=None):
+    """Convolve an image with a psf using FFTs. If `psf_fft` is True then
+    `psf` should already be the rfft2 of the psf padded to the
+    convolution shape, in which case `psf_shape` gives the shape of
+    the psf in pixel space. The convolution acts on the last two
+    dimensions, so a stack of images may be convolved at once.
+
+    """
     # Ensure everything is tensor
     img = torch.as_tensor(img)
     psf = torch.as_tensor(psf)
+    if psf_shape is None:
+        psf_shape = psf.shape[-2:]
 
     if img_prepadded:
-        s = img.size()
+        s = img.shape[-2:]
     else:
-        s = tuple(
-            next_fast_len(int(d + (p + 1) / 2), real=True) for d, p in zip(img.size(), psf.size())
-        )  # list(int(d + (p + 1) / 2) for d, p in zip(img.size(), psf.size()))
+        s = fast_fft_shape(tuple(img.shape[-2:]), tuple(psf_shape))
 
     img_f = torch.fft.rfft2(img, s=s)
 
@@ -31,9 +56,282 @@ def fft_convolve_torch(img, psf, psf_fft=False, img_prepadded=False):
     # Roll the tensor to correct centering and crop to original image size
     return torch.roll(
         conv,
-        shifts=(-int((psf.size()[0] - 1) / 2), -int((psf.size()[1] - 1) / 2)),
-        dims=(0, 1),
-    )[: img.size()[0], : img.size()[1]]
+        shifts=(-int((psf_shape[0] - 1) / 2), -int((psf_shape[1] - 1) / 2)),
+        dims=(-2, -1),
+    )[..., : img.shape[-2], : img.shape[-1]]
+
+
+def small_kernel_rfft2(kernel, shape):
+    """The rfft2 of a small kernel zero padded to `shape`, as returned by
+    ``torch.fft.rfft2(kernel, s=shape)``. It is evaluated as a direct
+    sum over the kernel pixels, which for a kernel of a few pixels is
+    cheaper than transforming the whole padded array. The transform
+    acts on the last two dimensions, so a stack of kernels may be
+    transformed at once.
+
+    """
+    dtype = torch.promote_types(kernel.dtype, torch.complex64)
+    Ey = torch.exp(
+        -2j
+        * np.pi
+        * torch.outer(
+            torch.arange(kernel.shape[-2], dtype=kernel.dtype, device=kernel.device),
+            torch.fft.fftfreq(shape[0], dtype=kernel.dtype, device=kernel.device),
+        )
+    )
+    Ex = torch.exp(
+        -2j
+        * np.pi
+        * torch.outer(
+            torch.arange(kernel.shape[-1], dtype=kernel.dtype, device=kernel.device),
+            torch.fft.rfftfreq(shape[1], dtype=kernel.dtype, device=kernel.device),
+        )
+    )
+    return torch.einsum("...ab,ak,bl->...kl", kernel.to(dtype), Ey.to(dtype), Ex.to(dtype))
+
+
+def is_traced(tensor):
+    """Check if a tensor carries derivative information (autograd or
+    forward mode), in which case any value computed from it cannot be
+    cached.
+
+    """
+    if tensor is None:
+        return False
+    return tensor.requires_grad or fwAD.unpack_dual(tensor).tangent is not None
+
+
+class FFT_Cache:
+    """Least recently used cache for psf FFTs.
+
+    Every time a psf convolved model is sampled, the psf is
+    normalized, possibly shifted, and transformed with an rfft2. When
+    the psf is a fixed PSF_Image these steps give identical results
+    for every model with the same working image shape and shift, so
+    the transformed psf is stored here. Entries are keyed by the
+    identity (and in-place version) of the psf data tensor along with
+    the padded shape, dtype/device, and subpixel shift. The least
+    recently used entries are evicted once the total size exceeds
+    `max_bytes`. Values which depend on traced (differentiable)
+    tensors are never cached.
+
+    Args:
+      max_bytes (int): memory budget for the cached tensors. Default 256MB
+      max_entries (int): maximum number of cached tensors. Default 1024
+
+    """
+
+    def __init__(self, max_bytes=2**28, max_entries=1024):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.enabled = True
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(source, *spec):
+        """Build a cache key for a value computed from the `source` tensor and
+        some extra hashable specifications. Returns None if the value
+        cannot be cached.
+
+        """
+        if is_traced(source):
+            return None
+        return (id(source), source._version, source.dtype, str(source.device)) + spec
+
+    def get(self, key, source, compute):
+        """Return the cached value for `key`, or evaluate `compute()` and
+        store the result. `compute` should return a tensor, or a tuple
+        whose first element is a tensor.
+
+        """
+        if not self.enabled or key is None:
+            return compute()
+
+        entry = self._entries.get(key, None)
+        # The weak reference guards against a new tensor reusing the id of a deleted one
+        if entry is not None and entry[0]() is source:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+
+        value = compute()
+        tensor = value[0] if isinstance(value, tuple) else value
+        if is_traced(tensor):
+            return value
+        size = tensor.element_size() * tensor.numel()
+        if size > self.max_bytes:
+            return value
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (weakref.ref(source), value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes or len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+        return value
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry[2]
+
+    def clear(self):
+        """Remove all cached values and reset the hit/miss counters"""
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return f"FFT_Cache: {len(self)} entries, {self.nbytes / 2**20:.1f}MB, hits: {self.hits}, misses: {self.misses}"
+
+
+# Shared cache used when convolving models with fixed psf images
+psf_fft_cache = FFT_Cache()
+
+
+def bucket_size(n, step=16):
+    """Round a size up to a bucket so that similar sizes share a
+    shape. Sizes up to ``step`` are kept as they are, sizes up to ``16
+    * step`` are rounded to a multiple of ``step``, above that the
+    spacing doubles with every doubling of the size. This keeps the
+    padding below 1/8 of the size for large inputs while giving at
+    most 8 buckets per doubling.
+
+    """
+    if n <= step:
+        return n
+    granularity = step
+    while n > 16 * granularity:
+        granularity *= 2
+    return -(-n // granularity) * granularity
+
+
+class Compile_Cache:
+    """Cache of ``torch.compile`` artefacts for model evaluation.
+
+    Entries are keyed by the caller, for models this is the model
+    class, bucketed pixel shape, sampling mode, dtype, device, and
+    compile settings. Each entry compiles its own copy of the function
+    code, since torch.compile tracks recompilations per code object
+    this means different buckets do not count towards each other's
+    recompile limit. The first call of an entry includes the
+    compilation, its wall time is recorded as the compile time along
+    with the time of one eager evaluation. Later calls record the
+    steady state time so `report` can show whether compiling is worth
+    it for a given model type. If compilation fails the entry falls
+    back to eager evaluation from then on.
+
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._entries = OrderedDict()
+
+    def run(self, key, function, args, eager, mode=None, backend="inductor"):
+        """Evaluate ``function(*args)`` with the compiled version for
+        `key`. ``eager`` is a function with no arguments which gives
+        the same result without compilation, used for the reference
+        timing and as a fall back.
+
+        """
+        if not self.enabled:
+            return eager()
+        entry = self._entries.get(key, None)
+        if entry is None:
+            code = function.__code__.replace()
+            compiled = torch.compile(
+                types.FunctionType(code, function.__globals__, function.__name__),
+                mode=mode,
+                backend=backend,
+                dynamic=False,
+            )
+            entry = {
+                "function": compiled,
+                "failed": False,
+                "compile_time": None,
+                "eager_time": None,
+                "calls": 0,
+                "time": 0.0,
+            }
+            self._entries[key] = entry
+        if entry["failed"]:
+            return eager()
+
+        start = perf_counter()
+        if entry["compile_time"] is None:
+            try:
+                result = entry["function"](*args)
+            except Exception as e:
+                entry["failed"] = True
+                AP_config.ap_logger.warning(f"torch.compile failed for {key}, using eager: {e}")
+                return eager()
+            entry["compile_time"] = perf_counter() - start
+            start = perf_counter()
+            eager()
+            entry["eager_time"] = perf_counter() - start
+            return result
+        result = entry["function"](*args)
+        entry["time"] += perf_counter() - start
+        entry["calls"] += 1
+        return result
+
+    def report(self):
+        """Summary of each compiled entry. Gives the compile time, the
+        mean steady state time of the compiled function, the time of
+        an eager evaluation, and the speedup (eager / compiled).
+
+        Returns:
+          list: one dictionary per entry
+        """
+        rows = []
+        for key, entry in self._entries.items():
+            mean = entry["time"] / entry["calls"] if entry["calls"] > 0 else None
+            rows.append(
+                {
+                    "key": key,
+                    "failed": entry["failed"],
+                    "compile_time": entry["compile_time"],
+                    "calls": entry["calls"],
+                    "compiled_time": mean,
+                    "eager_time": entry["eager_time"],
+                    "speedup": (
+                        None
+                        if mean is None or entry["eager_time"] is None
+                        else entry["eager_time"] / mean
+                    ),
+                }
+            )
+        return rows
+
+    def clear(self):
+        """Remove all compiled entries"""
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        lines = [f"Compile_Cache: {len(self)} entries"]
+        for row in self.report():
+            lines.append(
+                f"{row['key']}: "
+                + (
+                    "failed"
+                    if row["failed"]
+                    else f"compile {row['compile_time']:.3g}s, calls {row['calls']}, speedup "
+                    + ("n/a" if row["speedup"] is None else f"{row['speedup']:.2f}")
+                )
+            )
+        return "\n".join(lines)
+
+
+compile_cache = Compile_Cache()
 
 
 def fft_convolve_multi_torch(
@@ -70,8 +368,54 @@ def fft_convolve_multi_torch(
             -int((sum(kernel.size()[0] for kernel in kernels) - 1) / 2),
             -int((sum(kernel.size()[1] for kernel in kernels) - 1) / 2),
         ),
-        dims=(0, 1),
-    )[: img.size()[0], : img.size()[1]]
+        dims=(-2, -1),
+    )[..., : img.shape[-2], : img.shape[-1]]
+
+
+def binned_percentiles(x, values, bins, percentiles=(16, 50, 84)):
+    """Percentiles of ``values`` within each bin of ``x``, for all bins
+    at once. The values are sorted once by (bin, value) so every bin
+    is a contiguous sorted segment, each percentile is then a linear
+    interpolation between two elements of its segment. This gives the
+    same result as ``scipy.stats.binned_statistic`` with a
+    ``np.percentile`` statistic (the last bin includes its right edge,
+    empty bins are NaN) without a python call per bin.
+
+    Args:
+      x: values which determine the bin of each element
+      values: values from which the percentiles are computed
+      bins: monotonically increasing bin edges
+      percentiles: sequence of percentiles to compute in [0, 100]
+
+    Returns:
+      np.ndarray: array of shape (len(percentiles), len(bins) - 1)
+    """
+    x = np.asarray(x).ravel()
+    values = np.asarray(values).ravel()
+    bins = np.asarray(bins)
+    nbins = len(bins) - 1
+    index = np.searchsorted(bins, x, side="right") - 1
+    index[x == bins[-1]] = nbins - 1
+    valid = (index >= 0) & (index < nbins)
+    index = index[valid]
+    values = values[valid]
+
+    order = np.lexsort((values, index))
+    values = values[order]
+    counts = np.bincount(index, minlength=nbins)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    result = np.full((len(percentiles), nbins), np.nan)
+    filled = counts > 0
+    for i, p in enumerate(percentiles):
+        position = (p / 100) * (counts[filled] - 1)
+        low = np.floor(position).astype(int)
+        high = np.minimum(low + 1, counts[filled] - 1)
+        frac = position - low
+        low_value = values[starts[filled] + low]
+        high_value = values[starts[filled] + high]
+        result[i, filled] = low_value + (high_value - low_value) * frac
+    return result
 
 
 def axis_ratio_com(data, PA, X=None, Y=None, mask=None):
@@ -120,8 +464,41 @@ def quad_table(n, p, dtype, device):
     return X, Y, W.reshape(-1)
 
 
+@lru_cache(maxsize=32)
+def integrate_stencil(quad_level, gridding, max_depth, pixelscale, dtype, device):
+    """Precomputes the offsets and weights used at every depth of the
+    adaptive pixel integration. For each depth this gives the
+    quadrature abscissas and weights within a (sub)pixel, and the
+    offsets of the ``gridding**2`` subpixel centers used to refine a
+    (sub)pixel to the next depth. The pixelscale should be given as a
+    flat tuple so that the stencil can be cached.
+
+    Returns:
+      tuple: one ``(abscissaX, abscissaY, weight, stepX, stepY)`` entry per depth
+
+    """
+    P = torch.tensor(pixelscale, dtype=dtype, device=device).reshape(2, 2)
+    abscissa, weights = roots_legendre(quad_level)
+    w = torch.tensor(weights, dtype=dtype, device=device)
+    a = torch.tensor(abscissa, dtype=dtype, device=device)
+    QX, QY = torch.meshgrid(a, a, indexing="xy")
+    quad_grid = torch.stack((QX, QY)).view(2, -1) / 2.0
+    W = (torch.outer(w, w) / 4.0).reshape(-1)
+    step = displacement_spacing(gridding, dtype=dtype, device=device)
+    SX, SY = torch.meshgrid(step, step, indexing="xy")
+    step_grid = torch.stack((SX, SY)).view(2, -1)
+
+    stencil = []
+    for depth in range(max_depth):
+        Pd = P / gridding**depth
+        abscissaX, abscissaY = Pd @ quad_grid
+        stepX, stepY = Pd @ step_grid
+        stencil.append((abscissaX, abscissaY, W, stepX, stepY))
+    return tuple(stencil)
+
+
 def single_quad_integrate(
-    X, Y, image_header, eval_brightness, eval_parameters, dtype, device, quad_level=3
+    X, Y, image_header, eval_brightness, eval_parameters, dtype, device, quad_level=3, index=None
 ):
 
     # collect gaussian quadrature weights
@@ -136,6 +513,7 @@ def single_quad_integrate(
         Y=Ys,
         image=image_header,
         parameters=eval_parameters,
+        **({} if index is None else {"index": index}),
     )
 
     # Reference flux for pixel is simply the mean of the evaluations
@@ -160,6 +538,7 @@ def grid_integrate(
     _current_depth=1,
     max_depth=2,
     reference=None,
+    index=None,
 ):
     """The grid_integrate function performs adaptive quadrature
     integration over a given pixel grid, offering precision control
@@ -178,6 +557,7 @@ def grid_integrate(
       _current_depth (int, optional): The current depth level of the grid subdivision. Used for recursive calls to the function. Defaults to 1.
       max_depth (int, optional): The maximum depth level of grid subdivision. Once this level is reached, no further subdivision is performed. Defaults to 2.
       reference (torch.Tensor or None, optional): A scalar value that represents the allowed threshold for the integration error.
+      index (torch.Tensor or None, optional): Integer tensor with the same shape as X which is passed along to eval_brightness, used to evaluate several models at once where index identifies the model for each pixel. In this case reference should also have the same shape as X. Defaults to None.
 
     Returns:
       torch.Tensor: A tensor of the same shape as X and Y that represents the result of the integration on the grid.
@@ -204,6 +584,7 @@ def grid_integrate(
         dtype,
         device,
         quad_level=quad_level,
+        index=index,
     )
 
     # if the max depth is reached, simply return the integrated pixels
@@ -224,6 +605,10 @@ def grid_integrate(
     # Write out the coordinates for the super resolved pixels
     subgridX = torch.repeat_interleave(X[select].unsqueeze(-1), gridding**2, -1) + stepx.reshape(-1)
     subgridY = torch.repeat_interleave(Y[select].unsqueeze(-1), gridding**2, -1) + stepy.reshape(-1)
+    if index is not None:
+        # Carry the per pixel information to the super resolved pixels
+        index = torch.repeat_interleave(index[select].unsqueeze(-1), gridding**2, -1)
+        reference = torch.repeat_interleave(reference[select].unsqueeze(-1), gridding**2, -1)
 
     # Recursively evaluate the quadrature integration on the finer sampling grid
     subgridres = grid_integrate(
@@ -239,9 +624,173 @@ def grid_integrate(
         _current_depth=_current_depth + 1,
         max_depth=max_depth,
         reference=reference * gridding**2,
+        index=index,
     )
 
     # Integrate the finer sampling grid back to current resolution
     integral[select] = subgridres.sum(axis=(-1,))
 
     return integral
+
+
+def grid_integrate_plan(
+    X,
+    Y,
+    image_header,
+    eval_brightness,
+    eval_parameters,
+    dtype,
+    device,
+    quad_level=3,
+    gridding=5,
+    max_depth=2,
+    reference=None,
+):
+    """Non-recursive version of `grid_integrate` for a flat list of
+    pixels which also records where the final quadrature was
+    performed. The offsets and weights for every depth come from a
+    cached `integrate_stencil`. The pixels are processed one depth at
+    a time: the quadrature points of all current (sub)pixels are
+    evaluated by broadcasting against the stencil, pixels below the
+    error threshold are accumulated into the output with a single
+    ``index_add``, and only the remaining pixels are expanded to the
+    next depth.
+
+    The plan has one entry per depth holding the quadrature points of
+    the subpixels which were not refined any further at that
+    depth. Each point is stored as the index of the pixel it belongs
+    to, its offset from that pixel, and its quadrature weight. The
+    plan can be evaluated with `plan_integrate` which skips the
+    refinement decisions and the evaluations of the refined pixels at
+    lower depths.
+
+    Args:
+      X (torch.Tensor): A 1D tensor with the x-coordinates of the pixels to integrate.
+      Y (torch.Tensor): A 1D tensor with the y-coordinates of the pixels to integrate.
+      reference (torch.Tensor): The allowed threshold for the integration error.
+
+    See `grid_integrate` for the other arguments.
+
+    Returns:
+      Tuple[torch.Tensor, list]: The integrated pixels and the integration plan.
+
+    """
+    stencil = integrate_stencil(
+        quad_level,
+        gridding,
+        max_depth,
+        tuple(image_header.pixelscale.detach().flatten().tolist()),
+        dtype,
+        device,
+    )
+    middle = (quad_level**2) // 2
+    pixel = torch.arange(X.shape[0], device=device)
+    dX = torch.zeros(X.shape[0], dtype=dtype, device=device)
+    dY = torch.zeros(X.shape[0], dtype=dtype, device=device)
+    integral = torch.zeros_like(X)
+    plan = []
+    for depth, (abscissaX, abscissaY, weight, stepX, stepY) in enumerate(stencil):
+        pointX = dX.unsqueeze(-1) + abscissaX
+        pointY = dY.unsqueeze(-1) + abscissaY
+        res = eval_brightness(
+            X=X[pixel].unsqueeze(-1) + pointX,
+            Y=Y[pixel].unsqueeze(-1) + pointY,
+            image=image_header,
+            parameters=eval_parameters,
+        )
+        value = (res * weight).sum(axis=-1)
+
+        # Keep pixels with low error, refine the rest
+        if depth < max_depth - 1:
+            select = torch.abs(value - res[..., middle]) > reference
+        else:
+            select = torch.zeros_like(pixel, dtype=torch.bool)
+        keep = torch.logical_not(select)
+
+        # Record the quadrature points of the pixels which are done at this depth
+        integral = integral.index_add(0, pixel[keep], value[keep])
+        plan.append(
+            (
+                image_header,
+                torch.repeat_interleave(pixel[keep], quad_level**2),
+                pointX[keep].flatten(),
+                pointY[keep].flatten(),
+                weight.repeat(int(torch.sum(keep).item())),
+            )
+        )
+        if not torch.any(select):
+            break
+
+        # Super resolve the problem pixels
+        pixel = torch.repeat_interleave(pixel[select], gridding**2)
+        dX = (dX[select].unsqueeze(-1) + stepX).flatten()
+        dY = (dY[select].unsqueeze(-1) + stepY).flatten()
+        image_header = image_header.rescale_pixel(1 / gridding)
+        reference = reference * gridding**2
+
+    return integral, plan
+
+
+def plan_integrate(X, Y, plan, eval_brightness, eval_parameters):
+    """Integrates pixels using a plan from `grid_integrate_plan`. The
+    model is evaluated once per depth, only at the quadrature points
+    of the subpixels which were final in the plan.
+
+    Args:
+      X (torch.Tensor): A 1D tensor with the x-coordinates of the pixels to integrate, these must be the same pixels used to build the plan.
+      Y (torch.Tensor): A 1D tensor with the y-coordinates of the pixels to integrate.
+      plan (list): The integration plan from `grid_integrate_plan`.
+      eval_brightness (callable): A function that evaluates the brightness at each point.
+      eval_parameters (Parameter_Group): parameters passed to the eval_brightness function.
+
+    Returns:
+      torch.Tensor: A tensor of the same shape as X with the integrated pixels.
+
+    """
+    integral = torch.zeros_like(X)
+    for image_header, pixel, pointX, pointY, weight in plan:
+        if pixel.numel() == 0:
+            continue
+        res = eval_brightness(
+            X=X[pixel] + pointX,
+            Y=Y[pixel] + pointY,
+            image=image_header,
+            parameters=eval_parameters,
+        )
+        integral = integral.index_add(0, pixel, res * weight)
+    return integral
+
+
+def stencil_integrate(
+    X,
+    Y,
+    image_header,
+    eval_brightness,
+    eval_parameters,
+    dtype,
+    device,
+    quad_level=3,
+    gridding=5,
+    max_depth=2,
+    reference=None,
+):
+    """Integrates a flat list of pixels with `grid_integrate_plan`,
+    discarding the plan.
+
+    Returns:
+      torch.Tensor: A tensor of the same shape as X with the integrated pixels.
+
+    """
+    return grid_integrate_plan(
+        X,
+        Y,
+        image_header,
+        eval_brightness,
+        eval_parameters,
+        dtype,
+        device,
+        quad_level=quad_level,
+        gridding=gridding,
+        max_depth=max_depth,
+        reference=reference,
+    )[0]
@@ -1,6 +1,6 @@
 import torch
 import numpy as np
-from .conversions.functions import sersic_n_to_b
+from .conversions.functions import sersic_n_to_b, sersic_n_to_b_derivative
 from .interpolate import cubic_spline_torch
 
 
@@ -36,6 +36,20 @@ def sersic_np(R, n, Re, Ie):
     return Ie * np.exp(-bn * ((R / Re) ** (1 / n) - 1))
 
 
+def sersic_torch_derivatives(R, n, Re, Ie):
+    """Sersic 1d profile along with its analytic partial derivatives,
+    see `sersic_torch` for the parameters.
+
+    Returns:
+        tuple: the profile, then its derivatives with respect to R, n, Re, and Ie
+    """
+    bn = sersic_n_to_b(n)
+    U = torch.pow(R / Re, 1 / n)
+    I = Ie * torch.exp(-bn * (U - 1))
+    dI_dn = I * (bn * U * torch.log(R / Re) / n**2 - sersic_n_to_b_derivative(n) * (U - 1))
+    return I, -I * bn * U / (n * R), dI_dn, I * bn * U / (n * Re), I / Ie
+
+
 def gaussian_torch(R, sigma, I0):
     """Gaussian 1d profile function, specifically designed for pytorch
     operations.
@@ -60,6 +74,17 @@ def gaussian_np(R, sigma, I0):
     return (I0 / np.sqrt(2 * np.pi * sigma**2)) * np.exp(-0.5 * ((R / sigma) ** 2))
 
 
+def gaussian_torch_derivatives(R, sigma, I0):
+    """Gaussian 1d profile along with its analytic partial derivatives,
+    see `gaussian_torch` for the parameters.
+
+    Returns:
+        tuple: the profile, then its derivatives with respect to R, sigma, and I0
+    """
+    I = gaussian_torch(R, sigma, I0)
+    return I, -I * R / sigma**2, I * ((R / sigma) ** 2 - 1) / sigma, I / I0
+
+
 def exponential_torch(R, Re, Ie):
     """Exponential 1d profile function, specifically designed for pytorch
     operations.
@@ -86,6 +111,18 @@ def exponential_np(R, Ie, Re):
     return Ie * np.exp(-sersic_n_to_b(1.0) * (R / Re - 1.0))
 
 
+def exponential_torch_derivatives(R, Re, Ie):
+    """Exponential 1d profile along with its analytic partial
+    derivatives, see `exponential_torch` for the parameters.
+
+    Returns:
+        tuple: the profile, then its derivatives with respect to R, Re, and Ie
+    """
+    I = exponential_torch(R, Re, Ie)
+    b1 = sersic_n_to_b(torch.tensor(1.0, dtype=R.dtype, device=R.device))
+    return I, -b1 * I / Re, b1 * I * R / Re**2, I / Ie
+
+
 def moffat_torch(R, n, Rd, I0):
     """Moffat 1d profile function, specifically designed for pytorch
     operations
@@ -113,6 +150,19 @@ def moffat_np(R, n, Rd, I0):
     return I0 / (1 + (R / Rd) ** 2) ** n
 
 
+def moffat_torch_derivatives(R, n, Rd, I0):
+    """Moffat 1d profile along with its analytic partial derivatives,
+    see `moffat_torch` for the parameters.
+
+    Returns:
+        tuple: the profile, then its derivatives with respect to R, n, Rd, and I0
+    """
+    W = 1 + (R / Rd) ** 2
+    I = I0 / W**n
+    dI_dR = -2 * n * I * R / (Rd**2 * W)
+    return I, dI_dR, -I * torch.log(W), -dI_dR * R / Rd, I / I0
+
+
 def nuker_torch(R, Rb, Ib, alpha, beta, gamma):
     """Nuker 1d profile function, specifically designed for pytorch
     operations
@@ -154,6 +204,34 @@ def nuker_np(R, Rb, Ib, alpha, beta, gamma):
     )
 
 
+def nuker_torch_derivatives(R, Rb, Ib, alpha, beta, gamma):
+    """Nuker 1d profile along with its analytic partial derivatives,
+    see `nuker_torch` for the parameters.
+
+    Returns:
+        tuple: the profile, then its derivatives with respect to R, Rb, Ib, alpha, beta, and gamma
+    """
+    U = R / Rb
+    Ua = U**alpha
+    L = torch.log(1 + Ua)
+    I = nuker_torch(R, Rb, Ib, alpha, beta, gamma)
+    # derivative of log(I) with respect to log(U)
+    dlogI_dlogU = -gamma + (gamma - beta) * Ua / (1 + Ua)
+    dI_dalpha = I * (
+        (beta - gamma) * (L - np.log(2)) / alpha**2
+        + (gamma - beta) * Ua * torch.log(U) / (alpha * (1 + Ua))
+    )
+    return (
+        I,
+        I * dlogI_dlogU / R,
+        -I * dlogI_dlogU / Rb,
+        I / Ib,
+        dI_dalpha,
+        I * (np.log(2) - L) / alpha,
+        I * (L - np.log(2)) / alpha - I * torch.log(U),
+    )
+
+
 def spline_torch(R, profR, profI, extend):
     """Spline 1d profile function, cubic spline between points up
     to second last point beyond which is linear, specifically designed
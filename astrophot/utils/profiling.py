@@ -0,0 +1,282 @@
+import json
+from contextlib import contextmanager
+from time import perf_counter
+
+import torch
+
+from .. import AP_config
+
+__all__ = ["Profiler", "profiler"]
+
+
+class _Disabled:
+    """Context manager which does nothing, returned by
+    `Profiler.stage` while profiling is off so the instrumented code
+    pays only for one attribute check.
+
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+class _Stage:
+    """Times one stage and records it with the profiler on exit"""
+
+    __slots__ = ("profiler", "owner", "stage", "start", "children")
+
+    def __init__(self, profiler, owner, stage):
+        self.profiler = profiler
+        self.owner = owner
+        self.stage = stage
+
+    def __enter__(self):
+        self.profiler._synchronize()
+        self.children = 0.0
+        self.profiler._stack.append(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._synchronize()
+        duration = perf_counter() - self.start
+        self.profiler._stack.pop()
+        if len(self.profiler._stack) > 0:
+            self.profiler._stack[-1].children += duration
+        self.profiler._record(self, duration)
+        return False
+
+
+class Profiler:
+    """Collects wall times, call counts, counters, and tensor allocation
+    sizes for the stages of model sampling and fitting.
+
+    Profiling is off by default, in which case the instrumented code
+    only checks the ``enabled`` flag. Turn it on for a block of code
+    with ``profile``, then look at the results as a table or save them
+    as a Chrome trace (open in ``chrome://tracing`` or
+    https://ui.perfetto.dev)::
+
+        from astrophot.utils.profiling import profiler
+
+        with profiler.profile():
+            ap.fit.LM(model).fit()
+        print(profiler.table())
+        profiler.chrome_trace("fit_trace.json")
+
+    Each record belongs to an owner, the name of the model or the
+    class of the optimizer which ran the stage. Stages nest, the
+    ``self`` time of a stage excludes the time spent in the stages it
+    contains. On CUDA devices the profiler synchronizes at the start
+    and end of every stage so that the times are accurate, this slows
+    down the code being profiled.
+
+    Args:
+      max_events (int): Maximum number of individual stage calls kept for the Chrome trace, the summary statistics include all calls. Default: 100000
+
+    """
+
+    def __init__(self, max_events=100000):
+        self.enabled = False
+        self.max_events = max_events
+        self.reset()
+
+    def reset(self):
+        """Remove all records"""
+        self._stack = []
+        self._stages = {}
+        self._counters = {}
+        self._allocations = {}
+        self._events = []
+        self._dropped = 0
+        self._origin = perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    @contextmanager
+    def profile(self, reset=True):
+        """Enable profiling within a ``with`` block, previous records are
+        removed unless `reset` is False.
+
+        """
+        if reset:
+            self.reset()
+        previous = self.enabled
+        self.enabled = True
+        try:
+            yield self
+        finally:
+            self.enabled = previous
+
+    @staticmethod
+    def owner_name(owner):
+        if owner is None or isinstance(owner, str):
+            return owner
+        name = getattr(owner, "name", None)
+        if isinstance(name, str):
+            return name
+        return type(owner).__name__
+
+    def stage(self, stage, owner=None):
+        """Context manager which times a stage run by `owner` (a model,
+        optimizer, or name).
+
+        """
+        if not self.enabled:
+            return _DISABLED
+        return _Stage(self, self.owner_name(owner), stage)
+
+    def count(self, counter, value=1, owner=None):
+        """Add `value` to a counter, for example the number of pixels
+        selected for sub pixel integration.
+
+        """
+        if not self.enabled:
+            return
+        if isinstance(value, torch.Tensor):
+            value = value.item()
+        key = (self.owner_name(owner), counter)
+        total, calls = self._counters.get(key, (0, 0))
+        self._counters[key] = (total + value, calls + 1)
+        if len(self._events) < self.max_events:
+            self._events.append(("C", key[0], counter, perf_counter(), total + value))
+
+    def allocation(self, stage, tensor, owner=None):
+        """Record the size in bytes of a tensor allocated by a stage"""
+        if not self.enabled:
+            return
+        nbytes = tensor.numel() * tensor.element_size()
+        key = (self.owner_name(owner), stage)
+        count, total, peak = self._allocations.get(key, (0, 0, 0))
+        self._allocations[key] = (count + 1, total + nbytes, max(peak, nbytes))
+
+    def _synchronize(self):
+        if AP_config.ap_device != "cpu" and torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    def _record(self, stage, duration):
+        key = (stage.owner, stage.stage)
+        stats = self._stages.get(key, None)
+        if stats is None:
+            stats = {"calls": 0, "time": 0.0, "self_time": 0.0, "min": duration, "max": duration}
+            self._stages[key] = stats
+        stats["calls"] += 1
+        stats["time"] += duration
+        stats["self_time"] += duration - stage.children
+        stats["min"] = min(stats["min"], duration)
+        stats["max"] = max(stats["max"], duration)
+        if len(self._events) < self.max_events:
+            self._events.append(("X", stage.owner, stage.stage, stage.start, duration))
+        else:
+            self._dropped += 1
+
+    def stats(self):
+        """Summary of the records as a list of dictionaries, one for each
+        owner and stage, sorted by total time.
+
+        """
+        rows = []
+        for (owner, stage), stats in self._stages.items():
+            row = {"owner": owner, "stage": stage}
+            row.update(stats)
+            row["mean"] = stats["time"] / stats["calls"]
+            rows.append(row)
+        return sorted(rows, key=lambda row: row["time"], reverse=True)
+
+    def counters(self):
+        """Dictionary of (owner, counter) to the total and number of updates"""
+        return dict(
+            (key, {"total": total, "updates": calls})
+            for key, (total, calls) in self._counters.items()
+        )
+
+    def allocations(self):
+        """Dictionary of (owner, stage) to the number, total bytes, and
+        largest size in bytes of the allocations recorded
+
+        """
+        return dict(
+            (key, {"count": count, "bytes": total, "peak": peak})
+            for key, (count, total, peak) in self._allocations.items()
+        )
+
+    def table(self, limit=None):
+        """Summary of the records as a human readable table. Only the
+        `limit` most expensive stages are listed if given.
+
+        """
+        rows = self.stats()[:limit]
+        width = max([len(str(row["owner"])) for row in rows] + [5])
+        lines = [
+            f"{'owner':{width}s} {'stage':20s} {'calls':>7s} {'total [ms]':>11s} {'self [ms]':>11s} {'mean [ms]':>10s} {'max [ms]':>10s}"
+        ]
+        for row in rows:
+            lines.append(
+                f"{str(row['owner']):{width}s} {row['stage']:20s} {row['calls']:7d} {row['time'] * 1e3:11.3f} "
+                f"{row['self_time'] * 1e3:11.3f} {row['mean'] * 1e3:10.3f} {row['max'] * 1e3:10.3f}"
+            )
+        if len(self._counters) > 0:
+            lines.append("")
+            lines.append(f"{'owner':{width}s} {'counter':20s} {'updates':>7s} {'total':>11s}")
+            for (owner, counter), stats in sorted(self.counters().items(), key=str):
+                lines.append(
+                    f"{str(owner):{width}s} {counter:20s} {stats['updates']:7d} {stats['total']:11g}"
+                )
+        if len(self._allocations) > 0:
+            lines.append("")
+            lines.append(
+                f"{'owner':{width}s} {'allocation':20s} {'count':>7s} {'total [MB]':>11s} {'peak [MB]':>11s}"
+            )
+            for (owner, stage), stats in sorted(self.allocations().items(), key=str):
+                lines.append(
+                    f"{str(owner):{width}s} {stage:20s} {stats['count']:7d} {stats['bytes'] / 2**20:11.3f} "
+                    f"{stats['peak'] / 2**20:11.3f}"
+                )
+        if self._dropped > 0:
+            lines.append(f"{self._dropped} calls were not kept for the trace")
+        return "\n".join(lines)
+
+    def chrome_trace(self, filename=None):
+        """Records in the Chrome trace event format. If a `filename` is
+        given the trace is also written to that file as JSON.
+
+        """
+        events = []
+        for phase, owner, name, start, value in self._events:
+            event = {
+                "name": name,
+                "cat": "astrophot" if owner is None else owner,
+                "ph": phase,
+                "ts": (start - self._origin) * 1e6,
+                "pid": 0,
+                "tid": 0,
+            }
+            if phase == "X":
+                event["dur"] = value * 1e6
+                if owner is not None:
+                    event["args"] = {"owner": owner}
+            else:
+                event["name"] = name if owner is None else f"{owner}: {name}"
+                event["args"] = {name: value}
+            events.append(event)
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if filename is not None:
+            with open(filename, "w") as f:
+                json.dump(trace, f)
+        return trace
+
+    def __str__(self):
+        return self.table()
+
+
+profiler = Profiler()
@@ -0,0 +1,106 @@
+"""Compare the analytic and automatic differentiation jacobians of the
+standard parametric profiles.
+
+For every profile and image size a synthetic target is built, the
+jacobian is computed with ``jacobian_mode="autodiff"`` and
+``jacobian_mode="analytic"``, and the best of several timings is
+reported along with the largest difference between the two.
+
+Usage::
+
+    python benchmarks/analytic_jacobian.py --sizes 64 128 256 --repeat 5
+
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import torch
+import astrophot as ap
+
+PROFILES = {
+    "sersic": {"n": 2.3, "Re": 8.0, "Ie": 1.0},
+    "exponential": {"Re": 8.0, "Ie": 1.0},
+    "gaussian": {"sigma": 5.0, "flux": 2.0},
+    "moffat": {"n": 2.0, "Rd": 5.0, "I0": 1.0},
+    "nuker": {"Rb": 6.0, "Ib": 1.0, "alpha": 1.7, "beta": 2.5, "gamma": 0.4},
+}
+
+
+def make_target(size, psf):
+    pixelscale = 0.8
+    target = ap.image.Target_Image(
+        data=np.zeros((size, size)),
+        pixelscale=pixelscale,
+        variance=np.ones((size, size)),
+        psf=psf,
+    )
+    return target
+
+
+def gaussian_psf(size=25, sigma=2.0):
+    x = np.arange(size) - (size - 1) / 2
+    psf = np.exp(-0.5 * (x[:, None] ** 2 + x[None, :] ** 2) / sigma**2)
+    return psf / psf.sum()
+
+
+def best_time(function, repeat):
+    function()  # warm up caches
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def run(sizes, repeat, psf_modes, sampling_mode):
+    rows = []
+    for psf_mode in psf_modes:
+        for size in sizes:
+            target = make_target(size, gaussian_psf())
+            center = size * target.pixel_length.item() / 2
+            for profile, parameters in PROFILES.items():
+                parameters = dict(parameters, center=[center, center], q=0.6, PA=1.0)
+                model = ap.models.AstroPhot_Model(
+                    name=profile,
+                    model_type=f"{profile} galaxy model",
+                    target=target,
+                    parameters=parameters,
+                    psf_mode=psf_mode,
+                    sampling_mode=sampling_mode,
+                )
+                model.jacobian_mode = "autodiff"
+                autodiff = model.jacobian().data
+                autodiff_time = best_time(model.jacobian, repeat)
+                model.jacobian_mode = "analytic"
+                analytic = model.jacobian().data
+                analytic_time = best_time(model.jacobian, repeat)
+                rows.append(
+                    {
+                        "profile": profile,
+                        "size": size,
+                        "psf_mode": psf_mode,
+                        "autodiff": autodiff_time,
+                        "analytic": analytic_time,
+                        "speedup": autodiff_time / analytic_time,
+                        "max_diff": torch.max(torch.abs(autodiff - analytic)).item(),
+                    }
+                )
+                print(
+                    f"{profile:12s} {size:5d} psf={psf_mode:4s} autodiff {autodiff_time * 1e3:8.2f}ms "
+                    f"analytic {analytic_time * 1e3:8.2f}ms speedup {rows[-1]['speedup']:5.2f} "
+                    f"max diff {rows[-1]['max_diff']:.1e}"
+                )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--psf-modes", nargs="+", default=["none", "full"])
+    parser.add_argument("--sampling-mode", default="midpoint")
+    args = parser.parse_args()
+    run(args.sizes, args.repeat, args.psf_modes, args.sampling_mode)
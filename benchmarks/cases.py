@@ -0,0 +1,182 @@
+"""Benchmark cases for the sampling, jacobian, and fitting hot paths.
+
+Every case is a function which builds a synthetic problem and returns
+a ``(run, evaluations)`` pair. ``run`` is the callable that is timed
+and ``evaluations`` is the number of model evaluations it performs, or
+None if that number is only known after running (the harness then
+counts calls to the component model ``sample`` methods and the
+entries of batched group evaluations). Cases are
+rebuilt before every repetition so that fits always start from the
+same initial parameters.
+
+"""
+
+import numpy as np
+import torch
+import astrophot as ap
+
+SAMPLING_MODES = ("midpoint", "trapezoid", "simpsons", "quad:3")
+INTEGRATE_MODES = ("none", "threshold", "stencil")
+
+
+def gaussian_psf(size=11, sigma=1.5):
+    x = np.arange(size) - (size - 1) / 2
+    psf = np.exp(-0.5 * (x[:, None] ** 2 + x[None, :] ** 2) / sigma**2)
+    return psf / psf.sum()
+
+
+def make_target(size, nmodels=1, seed=12345):
+    """Square target with ``nmodels`` sersic galaxies on a grid plus
+    gaussian noise. Returns the target and the true parameters of each
+    galaxy.
+
+    """
+    rng = np.random.default_rng(seed)
+    pixelscale = 0.8
+    target = ap.image.Target_Image(
+        data=np.zeros((size, size)),
+        pixelscale=pixelscale,
+        variance=np.ones((size, size)),
+        psf=gaussian_psf(),
+        zeropoint=22.5,
+    )
+    ngrid = int(np.ceil(np.sqrt(nmodels)))
+    spacing = size * pixelscale / ngrid
+    truth = []
+    for i in range(nmodels):
+        truth.append(
+            {
+                "center": [
+                    spacing * (i % ngrid + 0.5) + rng.uniform(-0.5, 0.5),
+                    spacing * (i // ngrid + 0.5) + rng.uniform(-0.5, 0.5),
+                ],
+                "q": rng.uniform(0.4, 0.9),
+                "PA": rng.uniform(0, np.pi),
+                "n": rng.uniform(1, 3),
+                "Re": spacing / 8,
+                "Ie": 1.0,
+            }
+        )
+    model = make_group(target, truth)
+    target.data = model().data + torch.as_tensor(
+        rng.normal(size=(size, size)), dtype=ap.AP_config.ap_dtype, device=ap.AP_config.ap_device
+    )
+    return target, truth
+
+
+def make_sersic(target, parameters, name="sersic", **kwargs):
+    return ap.models.AstroPhot_Model(
+        name=name,
+        model_type="sersic galaxy model",
+        target=target,
+        parameters=dict(parameters),
+        **kwargs,
+    )
+
+
+def make_group(target, truth, perturb=0.0, seed=54321, **kwargs):
+    """Group of sersic models, one for each set of parameters in
+    `truth`. With `perturb` the starting values are moved away from
+    the truth by that fraction so the fitters have work to do.
+
+    """
+    rng = np.random.default_rng(seed)
+    models = []
+    for i, parameters in enumerate(truth):
+        parameters = dict(parameters)
+        if perturb > 0:
+            for key in ("q", "n", "Re"):
+                parameters[key] = parameters[key] * (1 + perturb * rng.uniform(-1, 1))
+            parameters["center"] = list(
+                c + perturb * rng.uniform(-1, 1) for c in parameters["center"]
+            )
+        models.append(make_sersic(target, parameters, name=f"sersic {i}", **kwargs))
+    return ap.models.AstroPhot_Model(
+        name="group", model_type="group model", target=target, models=models
+    )
+
+
+# Cases
+######################################################################
+def sample(size, sampling_mode="midpoint", integrate_mode="threshold"):
+    target, truth = make_target(size)
+    model = make_sersic(
+        target,
+        truth[0],
+        sampling_mode=sampling_mode,
+        integrate_mode=integrate_mode,
+    )
+    return model, 1
+
+
+def convolve(size, psf_convolve_mode="fft", psf_mode="full"):
+    target, truth = make_target(size)
+    model = make_sersic(target, truth[0], psf_mode=psf_mode, psf_convolve_mode=psf_convolve_mode)
+    return model, 1
+
+
+def jacobian(size, chunked=False, jacobian_mode="autodiff"):
+    target, truth = make_target(size)
+    kwargs = {"jacobian_mode": jacobian_mode}
+    if chunked:
+        kwargs.update({"jacobian_chunksize": 3, "image_chunksize": max(size // 2, 1)})
+    model = make_sersic(target, truth[0], **kwargs)
+    return model.jacobian, None
+
+
+def group_sample(size, nmodels):
+    target, truth = make_target(size, nmodels)
+    model = make_group(target, truth)
+    return model, nmodels
+
+
+def group_jacobian(size, nmodels):
+    target, truth = make_target(size, nmodels)
+    model = make_group(target, truth)
+    return model.jacobian, None
+
+
+def fit(size, nmodels, method="LM"):
+    target, truth = make_target(size, nmodels)
+    if method == "MiniFit":
+        # MiniFit swaps in a downsampled target which group initialization does not support
+        model = make_group(target, truth, perturb=0.1).models["sersic 0"]
+    else:
+        model = make_group(target, truth, perturb=0.1)
+    if method == "LM":
+        fitter = ap.fit.LM(model, max_iter=20)
+    elif method == "LM_CG":
+        fitter = ap.fit.LM_CG(model, max_iter=20)
+    elif method == "Iter":
+        fitter = ap.fit.Iter(model, max_iter=3, method_kwargs={"max_iter": 10})
+    elif method == "Iter_LM":
+        fitter = ap.fit.Iter_LM(model, chunks=max(nmodels * 7 // 2, 1), max_iter=3)
+    elif method == "MiniFit":
+        fitter = ap.fit.MiniFit(model, downsample_factor=2, method_kwargs={"max_iter": 20})
+    else:
+        raise ValueError(f"unknown fit method: {method}")
+    return fitter.fit, None
+
+
+def build_cases(sizes=(64, 128, 256), nmodels=(1, 4, 16), fit_size=128):
+    """Dictionary of case name to a function which builds the case."""
+    cases = {}
+    for size in sizes:
+        for sampling_mode in SAMPLING_MODES:
+            for integrate_mode in INTEGRATE_MODES:
+                cases[f"sample/{sampling_mode}/{integrate_mode}/{size}"] = (
+                    lambda s=size, sm=sampling_mode, im=integrate_mode: sample(s, sm, im)
+                )
+        for mode in ("fft", "direct"):
+            cases[f"convolve/{mode}/{size}"] = lambda s=size, m=mode: convolve(s, m)
+        cases[f"convolve/window/{size}"] = lambda s=size: convolve(s, psf_mode="window")
+        cases[f"jacobian/full/{size}"] = lambda s=size: jacobian(s)
+        cases[f"jacobian/chunked/{size}"] = lambda s=size: jacobian(s, chunked=True)
+        cases[f"jacobian/analytic/{size}"] = lambda s=size: jacobian(s, jacobian_mode="analytic")
+    for n in nmodels:
+        cases[f"group/sample/{n}"] = lambda n=n: group_sample(fit_size, n)
+        cases[f"group/jacobian/{n}"] = lambda n=n: group_jacobian(fit_size, n)
+        for method in ("LM", "LM_CG", "Iter", "Iter_LM"):
+            cases[f"fit/{method}/{n}"] = lambda n=n, m=method: fit(fit_size, n, m)
+    cases["fit/MiniFit/1"] = lambda: fit(fit_size, 1, "MiniFit")
+    return cases
@@ -0,0 +1,93 @@
+"""Compare the native HMC and NUTS samplers with the Pyro wrappers.
+
+A sersic model is fit to a synthetic target with LM, then each sampler
+draws the same number of samples after the same warmup, starting from
+the fitted parameters and using the LM covariance matrix (in the
+representation space) as the inverse mass matrix. For every sampler
+the wall time, the number of gradient evaluations (counted as model
+evaluations, each potential and gradient samples the model once), and
+the smallest effective sample size over the parameters are reported,
+along with the gradient evaluations and seconds per effective sample.
+
+Usage::
+
+    python benchmarks/hmc.py --size 32 --samples 200 --warmup 100
+
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import torch
+import astrophot as ap
+
+from cases import make_target, make_sersic
+from run import count_samples
+
+SAMPLERS = ("HMC", "Native_HMC", "NUTS", "Native_NUTS")
+
+
+def run(size, samples, warmup, leapfrog_steps, samplers, seed=12345):
+    target, truth = make_target(size, 1)
+    model = make_sersic(target, truth[0], integrate_mode="none")
+    lm = ap.fit.LM(model, max_iter=50).fit()
+    state = model.parameters.vector_representation().detach().clone()
+    inv_mass = ap.fit.Native_HMC(model, initial_state=state).representation_covariance(
+        lm.covariance_matrix
+    )
+    counter = count_samples()
+    rows = []
+    for name in samplers:
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        model.parameters.vector_set_representation(state)
+        kwargs = {
+            "initial_state": state,
+            "max_iter": samples,
+            "warmup": warmup,
+            "inv_mass": inv_mass,
+            "progress_bar": False,
+        }
+        if name in ("HMC", "Native_HMC"):
+            kwargs["leapfrog_steps"] = leapfrog_steps
+            # the Pyro HMC wrapper does not adapt the step size, use the same fixed value
+            kwargs["epsilon"] = 0.3
+            if name == "Native_HMC":
+                kwargs["adapt_step_size"] = False
+        sampler = getattr(ap.fit, name)(model, **kwargs)
+        counter["calls"] = 0
+        start = perf_counter()
+        sampler.fit()
+        elapsed = perf_counter() - start
+        chain = np.asarray(
+            sampler.chain.detach().cpu() if torch.is_tensor(sampler.chain) else sampler.chain
+        )
+        ess = np.min(len(chain) / ap.fit.Ensemble.autocorrelation_time(chain[:, None, :]))
+        rows.append(
+            {
+                "sampler": name,
+                "time": elapsed,
+                "gradients": counter["calls"],
+                "ess": ess,
+                "gradients_per_ess": counter["calls"] / ess,
+                "time_per_ess": elapsed / ess,
+            }
+        )
+        print(
+            f"{name:12s} {elapsed:8.2f}s {counter['calls']:8d} gradients  min ESS {ess:8.1f}  "
+            f"{rows[-1]['gradients_per_ess']:8.1f} gradients/ESS  {rows[-1]['time_per_ess'] * 1e3:8.1f}ms/ESS",
+            flush=True,
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=32)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--leapfrog-steps", type=int, default=10)
+    parser.add_argument("--samplers", nargs="+", default=list(SAMPLERS), choices=SAMPLERS)
+    args = parser.parse_args()
+    run(args.size, args.samples, args.warmup, args.leapfrog_steps, args.samplers)
@@ -0,0 +1,295 @@
+"""Run the AstroPhot benchmark suite or compare two runs.
+
+The suite times the hot paths of model fitting on synthetic targets
+(see ``cases.py``): model sampling for each sampling and integration
+mode, psf convolution, jacobians with and without chunking, group
+models, and the LM, LM_CG, Iter, Iter_LM, and MiniFit optimizers. For each
+case the wall time of several repetitions, the peak memory, and the
+model evaluations per second are written to a JSON file.
+
+Usage::
+
+    python benchmarks/run.py run --output main.json
+    python benchmarks/run.py run --output branch.json --filter "jacobian|fit/LM"
+    python benchmarks/run.py compare main.json branch.json --threshold 0.1
+    python benchmarks/run.py check --filter group
+
+Each case runs in a fresh process by default so that one case cannot
+warm caches for another. Peak memory is the growth of the resident
+set size during a run on Linux CPUs (the kernel peak is reset before
+each run) and the peak allocated memory on CUDA, it is not recorded
+on other platforms. ``compare`` exits with status 1 if any case is
+slower than the baseline by more than the threshold, so it can be
+used to guard against regressions.
+
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import re
+import sys
+from datetime import datetime, timezone
+from time import perf_counter
+
+import numpy as np
+import torch
+import astrophot as ap
+
+from cases import build_cases
+
+
+def _subclasses(cls):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _subclasses(sub)
+
+
+def count_samples():
+    """Wrap the ``sample`` method of every component model class, and the
+    batched evaluation of group models, so that calls can be
+    counted. Returns a dictionary whose ``"calls"`` entry is
+    incremented on every component model evaluation, a batch counts
+    one evaluation for each of its entries.
+
+    """
+    counter = {"calls": 0}
+    for cls in set(_subclasses(ap.models.AstroPhot_Model)):
+        if "sample" not in vars(cls) or issubclass(cls, ap.models.Group_Model):
+            continue
+
+        def sample(self, *args, _sample=vars(cls)["sample"], **kwargs):
+            counter["calls"] += 1
+            return _sample(self, *args, **kwargs)
+
+        cls.sample = sample
+
+    # Batches of sub models are evaluated together without calling their sample methods
+    evaluate_batch = vars(ap.models.Group_Model)["_evaluate_batch"].__func__
+
+    def _evaluate_batch(cls, models, *args, **kwargs):
+        counter["calls"] += len(models)
+        return evaluate_batch(cls, models, *args, **kwargs)
+
+    ap.models.Group_Model._evaluate_batch = classmethod(_evaluate_batch)
+    return counter
+
+
+def _cuda():
+    return ap.AP_config.ap_device != "cpu" and torch.cuda.is_available()
+
+
+def reset_peak_memory():
+    """Start a new peak memory measurement. Returns the current memory
+    in bytes which the peak is measured against.
+
+    """
+    if _cuda():
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        return torch.cuda.memory_allocated()
+    try:
+        # Linux can reset the peak resident set size of a process
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _proc_status("VmRSS")
+    except OSError:
+        return None
+
+
+def peak_memory():
+    """Peak memory in bytes since `reset_peak_memory`, None if unavailable"""
+    if _cuda():
+        return torch.cuda.max_memory_allocated()
+    try:
+        return _proc_status("VmHWM")
+    except OSError:
+        return None
+
+
+def _proc_status(key):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"{key} not found in /proc/self/status")
+
+
+def measure(name, repeat, sizes, nmodels, fit_size):
+    """Time one case. The case is rebuilt before each repetition and
+    the first run is a warm up which is not recorded.
+
+    """
+    builder = build_cases(sizes, nmodels, fit_size)[name]
+    counter = count_samples()
+    times = []
+    evaluations = []
+    memory = []
+    for i in range(repeat + 1):
+        run, known_evaluations = builder()
+        counter["calls"] = 0
+        baseline = reset_peak_memory()
+        start = perf_counter()
+        run()
+        if _cuda():
+            torch.cuda.synchronize()
+        elapsed = perf_counter() - start
+        if i == 0:
+            continue
+        times.append(elapsed)
+        evaluations.append(counter["calls"] if known_evaluations is None else known_evaluations)
+        if baseline is not None:
+            memory.append(peak_memory() - baseline)
+    return {
+        "wall_time": {
+            "min": min(times),
+            "mean": float(np.mean(times)),
+            "std": float(np.std(times)),
+            "all": times,
+        },
+        "peak_memory": max(memory) if len(memory) > 0 else None,
+        "evaluations": float(np.mean(evaluations)),
+        "evals_per_sec": float(np.sum(evaluations) / np.sum(times)),
+    }
+
+
+def metadata():
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "astrophot": getattr(ap, "__version__", "unknown"),
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "device": str(ap.AP_config.ap_device),
+        "dtype": str(ap.AP_config.ap_dtype),
+        "threads": torch.get_num_threads(),
+    }
+
+
+def run_suite(args):
+    names = list(build_cases(args.sizes, args.nmodels, args.fit_size).keys())
+    if args.filter is not None:
+        names = list(name for name in names if re.search(args.filter, name))
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        measure_args = (name, args.repeat, args.sizes, args.nmodels, args.fit_size)
+        if args.no_isolate:
+            result = measure(*measure_args)
+        else:
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                result = pool.apply(measure, measure_args)
+        results[name] = result
+        memory = "" if result["peak_memory"] is None else f"{result['peak_memory'] / 2**20:9.1f}MB"
+        print(
+            f"{name:40s} {result['wall_time']['min'] * 1e3:10.2f}ms {memory} "
+            f"{result['evals_per_sec']:10.1f} evals/s",
+            flush=True,
+        )
+    with open(args.output, "w") as f:
+        json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    regressions = 0
+    print(f"{'case':40s} {'baseline':>10s} {'candidate':>10s} {'time':>7s} {'memory':>7s}")
+    for name, base in baseline["results"].items():
+        if name not in candidate["results"]:
+            print(f"{name:40s} missing from candidate")
+            continue
+        new = candidate["results"][name]
+        ratio = new["wall_time"]["min"] / base["wall_time"]["min"]
+        memory = ""
+        if base["peak_memory"] and new["peak_memory"] is not None:
+            memory = f"{new['peak_memory'] / base['peak_memory']:7.2f}"
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 / (1 + args.threshold):
+            flag = "improved"
+        print(
+            f"{name:40s} {base['wall_time']['min'] * 1e3:8.2f}ms {new['wall_time']['min'] * 1e3:8.2f}ms "
+            f"{ratio:7.2f} {memory:>7s} {flag}"
+        )
+    for name in candidate["results"]:
+        if name not in baseline["results"]:
+            print(f"{name:40s} new case")
+    print(f"{regressions} regressions beyond {args.threshold:.0%}")
+    return 1 if regressions > 0 else 0
+
+
+def check_counts(args):
+    """Check the evaluation counter against the cases which know their
+    number of evaluations, for example a group case should count one
+    evaluation for each of its models whether or not they are sampled
+    as a batch.
+
+    """
+    counter = count_samples()
+    mismatches = 0
+    for name, builder in build_cases(args.sizes, args.nmodels, args.fit_size).items():
+        if args.filter is not None and not re.search(args.filter, name):
+            continue
+        run, known_evaluations = builder()
+        if known_evaluations is None:
+            continue
+        counter["calls"] = 0
+        run()
+        flag = ""
+        if counter["calls"] != known_evaluations:
+            flag = "MISMATCH"
+            mismatches += 1
+        print(f"{name:40s} {known_evaluations:6d} {counter['calls']:6d} {flag}", flush=True)
+    print(f"{mismatches} cases with miscounted evaluations")
+    return 1 if mismatches > 0 else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark suite")
+    run_parser.add_argument("--output", default="astrophot_benchmarks.json")
+    run_parser.add_argument("--filter", default=None, help="regex selecting case names")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256])
+    run_parser.add_argument("--nmodels", type=int, nargs="+", default=[1, 4, 16])
+    run_parser.add_argument("--fit-size", type=int, default=128)
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument(
+        "--no-isolate",
+        action="store_true",
+        help="run all cases in this process, faster but cases may share warm caches",
+    )
+    run_parser.set_defaults(function=run_suite)
+
+    check_parser = commands.add_parser(
+        "check", help="check the evaluation counter against the cases with known evaluations"
+    )
+    check_parser.add_argument("--filter", default=None, help="regex selecting case names")
+    check_parser.add_argument("--sizes", type=int, nargs="+", default=[64])
+    check_parser.add_argument("--nmodels", type=int, nargs="+", default=[1, 4, 16])
+    check_parser.add_argument("--fit-size", type=int, default=64)
+    check_parser.set_defaults(function=check_counts)
+
+    compare_parser = commands.add_parser("compare", help="compare two benchmark runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="relative slow down counted as a regression"
+    )
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 
 import torch
@@ -351,6 +353,177 @@ class TestLM(unittest.TestCase):
             "LM should update parameters in LM step",
         )
 
+    def test_block_jacobian(self):
+        np.random.seed(123456)
+        tar = make_basic_sersic(N=51, M=51)
+        mod1 = ap.models.Sersic_Galaxy(
+            name="base model 1",
+            target=tar,
+            window=[[0, 30], [0, 30]],
+            parameters={"center": [10, 10], "PA": 0, "q": 0.5, "n": 2, "Re": 5, "Ie": 1},
+        )
+        mod2 = ap.models.Sersic_Galaxy(
+            name="base model 2",
+            target=tar,
+            window=[[20, 51], [15, 51]],
+            parameters={"center": [35, 35], "PA": 1, "q": 0.7, "n": 3, "Re": 4, "Ie": 1},
+        )
+        smod = ap.models.AstroPhot_Model(
+            name="group model",
+            model_type="group model",
+            models=[mod1, mod2],
+            target=tar,
+        )
+
+        dense = smod.jacobian().flatten("data")
+        blocks = smod.block_jacobian()
+        self.assertEqual(len(blocks.blocks), 2, "one block per component model")
+        self.assertTrue(
+            torch.allclose(blocks.flatten("data"), dense),
+            "block jacobian should match dense jacobian",
+        )
+
+        LM_dense = ap.fit.LM(smod)
+        LM_block = ap.fit.LM(smod, block_jacobian=True)
+        Ypred = smod().flatten("data")
+        h = torch.ones(dense.shape[1], dtype=ap.AP_config.ap_dtype)
+        dr = LM_dense._r(Ypred * 1.01, LM_dense.Y, LM_dense.W)
+        self.assertTrue(
+            torch.allclose(LM_block._hess(blocks, LM_block.W), LM_dense._hess(dense, LM_dense.W))
+        )
+        self.assertTrue(
+            torch.allclose(
+                LM_block._grad(blocks, LM_block.W, LM_block.Y, Ypred),
+                LM_dense._grad(dense, LM_dense.W, LM_dense.Y, Ypred),
+            )
+        )
+        self.assertTrue(
+            torch.allclose(
+                LM_block._rpp(blocks, 0.1, dr, LM_block.W, h),
+                LM_dense._rpp(dense, 0.1, dr, LM_dense.W, h),
+            )
+        )
+
+        vec_init = smod.parameters.vector_values().detach().clone()
+        LM_block.max_iter = 1
+        LM_block.fit()
+        vec_final = smod.parameters.vector_values().detach().clone()
+        self.assertFalse(
+            torch.all(vec_init == vec_final),
+            "LM should update parameters with block jacobian",
+        )
+
+    def test_lm_cg(self):
+        torch.manual_seed(12345)
+        target = make_basic_sersic(N=31, M=35)
+        results = {}
+        for method in (ap.fit.LM, ap.fit.LM_CG):
+            model = ap.models.Sersic_Galaxy(name="cg model", target=target)
+            model.initialize()
+            results[method.__name__] = method(model, max_iter=20).fit()
+
+        fitter = results["LM_CG"]
+        self.assertGreater(len(fitter.cg_iterations), 0, "steps should use conjugate gradients")
+        self.assertLess(
+            fitter.res_loss(),
+            1.01 * results["LM"].res_loss(),
+            "matrix free LM should fit as well as LM",
+        )
+
+        # Jacobian products should match the explicit jacobian
+        fitter._linearize()
+        J = fitter.model.jacobian(parameters=fitter.current_state, as_representation=True)
+        J = J.flatten("data")
+        v = torch.randn_like(fitter.current_state)
+        self.assertTrue(torch.allclose(fitter._jvp(v), J @ v))
+        self.assertTrue(torch.allclose(fitter._hvp(v), J.T @ (fitter.W * (J @ v))))
+
+    def test_mixed_precision(self):
+        target = make_basic_sersic(N=51, M=61)
+        results = {}
+        for precision_mode in ("full", "mixed"):
+            model = ap.models.Sersic_Galaxy(
+                name="mixed precision",
+                target=target,
+                parameters={"center": [20, 21], "PA": 0.7, "q": 0.5, "n": 2, "Re": 8, "Ie": 0.2},
+                psf_mode="full",
+                precision_mode=precision_mode,
+            )
+            res = ap.fit.LM(model, max_iter=30).fit()
+            self.assertEqual(
+                res.hess.dtype, ap.AP_config.ap_dtype, "hessian should be full precision"
+            )
+            results[precision_mode] = (
+                model.parameters.vector_values().detach().clone(),
+                res.loss_history[-1],
+                torch.sqrt(torch.diag(res.covariance_matrix)),
+            )
+        full, mixed = results["full"], results["mixed"]
+        self.assertAlmostEqual(full[1], mixed[1], delta=1e-4 * full[1])
+        self.assertTrue(
+            torch.all(torch.abs(full[0] - mixed[0]) < 0.05 * full[2]),
+            "mixed precision fit should agree with full precision well within the uncertainty",
+        )
+
+    def test_stream_chunksize(self):
+        np.random.seed(123456)
+        tar = make_basic_sersic(N=51, M=61)
+        mask = torch.zeros_like(tar.data, dtype=torch.bool)
+        mask[20:26, 10:40] = True
+        tar.mask = mask
+        mod1 = ap.models.Sersic_Galaxy(
+            name="base model 1",
+            target=tar,
+            window=[[0, 30], [0, 30]],
+            parameters={"center": [10, 10], "PA": 0, "q": 0.5, "n": 2, "Re": 5, "Ie": 1},
+            integrate_mode="none",
+        )
+        mod2 = ap.models.Sersic_Galaxy(
+            name="base model 2",
+            target=tar,
+            window=[[20, 61], [15, 51]],
+            parameters={"center": [35, 30], "PA": 1, "q": 0.7, "n": 3, "Re": 4, "Ie": 1},
+            integrate_mode="none",
+        )
+        smod = ap.models.AstroPhot_Model(
+            name="group model",
+            model_type="group model",
+            models=[mod1, mod2],
+            target=tar,
+        )
+
+        LM_dense = ap.fit.LM(smod)
+        LM_stream = ap.fit.LM(smod, stream_chunksize=17)
+        state = LM_dense.current_state
+        Ypred = LM_dense.forward(parameters=state).flatten("data")
+        J = LM_dense.jacobian(parameters=state).flatten("data")
+        hess, grad = LM_stream._stream_hess_grad(LM_stream.jacobian, state, Ypred, LM_stream.Y)
+        self.assertTrue(torch.allclose(hess, LM_dense._hess(J, LM_dense.W)))
+        self.assertTrue(torch.allclose(grad, LM_dense._grad(J, LM_dense.W, Ypred, LM_dense.Y)))
+
+        h = 1e-3 * torch.ones_like(state)
+        r = LM_dense._r(Ypred, LM_dense.Y, LM_dense.W)
+        rh = LM_dense._r(
+            LM_dense.forward(parameters=state + 0.1 * h).flatten("data"),
+            LM_dense.Y,
+            LM_dense.W,
+        )
+        self.assertTrue(
+            torch.allclose(
+                LM_stream._stream_rpp(0.1, rh - r, LM_stream.W, h),
+                LM_dense._rpp(J, 0.1, rh - r, LM_dense.W, h),
+            )
+        )
+
+        vec_init = smod.parameters.vector_values().detach().clone()
+        LM_stream.max_iter = 1
+        LM_stream.fit()
+        vec_final = smod.parameters.vector_values().detach().clone()
+        self.assertFalse(
+            torch.all(vec_init == vec_final),
+            "LM should update parameters when streaming the jacobian",
+        )
+
 
 class TestMiniFit(unittest.TestCase):
     def test_minifit(self):
@@ -417,6 +590,67 @@ class TestIter(unittest.TestCase):
 
         res.fit()
 
+    def _make_separated_group(self, positions, Re=3.0, target=None):
+        if target is None:
+            target = make_basic_sersic(N=60, M=60)
+        model_list = []
+        for i, (x, y, w) in enumerate(positions):
+            model_list.append(
+                ap.models.AstroPhot_Model(
+                    name=f"sersic {i}",
+                    model_type="sersic galaxy model",
+                    parameters={
+                        "center": [0.8 * x, 0.8 * y],
+                        "PA": 1.0,
+                        "q": 0.6,
+                        "n": 2,
+                        "Re": Re,
+                        "Ie": 0,
+                    },
+                    window=[[x - w, x + w], [y - w, y + w]],
+                    target=target,
+                )
+            )
+        MODEL = ap.models.AstroPhot_Model(
+            name="model",
+            model_type="group model",
+            target=target,
+            models=model_list,
+        )
+        MODEL.initialize()
+        return MODEL
+
+    def test_iter_independent_sets(self):
+        MODEL = self._make_separated_group(
+            [(10, 10, 8), (50, 10, 8), (10, 50, 8), (50, 50, 8), (30, 30, 14)]
+        )
+        res = ap.fit.Iter(MODEL, method=ap.fit.LM, workers=2)
+        # The four corner models are independent, the central one overlaps them all
+        self.assertEqual(len(res.schedule), 2, "corner models should be fit together")
+        self.assertEqual(
+            sorted(len(s) for s in res.schedule), [1, 4], "central model should be alone"
+        )
+
+    def test_iter_parallel(self):
+        positions = [(10, 10, 8), (50, 10, 8), (10, 50, 8), (50, 50, 8)]
+        true_model = self._make_separated_group(positions)
+        target = true_model.target
+        target.data = torch.normal(mean=torch.zeros_like(target.data), std=0.01)
+        target += true_model()
+
+        MODEL = self._make_separated_group(positions, Re=2.5, target=target)
+        ap.fit.Iter(MODEL, method=ap.fit.LM, max_iter=1, method_kwargs={"max_iter": 5}).fit()
+        serial_state = MODEL.parameters.vector_values().clone()
+
+        MODEL = self._make_separated_group(positions, Re=2.5, target=target)
+        ap.fit.Iter(
+            MODEL, method=ap.fit.LM, max_iter=1, method_kwargs={"max_iter": 5}, workers=2
+        ).fit()
+        self.assertTrue(
+            torch.allclose(serial_state, MODEL.parameters.vector_values(), rtol=1e-6),
+            "parallel Iter should match sequential Iter for independent models",
+        )
+
 
 class TestIterLM(unittest.TestCase):
     def test_iter_basic(self):
@@ -530,6 +764,145 @@ class TestNUTS(unittest.TestCase):
         NUTS.fit()
 
 
+class TestNativeHMC(unittest.TestCase):
+    def test_native_samplers(self):
+        np.random.seed(12345)
+        torch.manual_seed(12345)
+        target = make_basic_sersic(N=30, M=30, x=12, y=12.5, Re=5)
+        MODEL = ap.models.Sersic_Galaxy(name="sersic model", target=target, integrate_mode="none")
+        MODEL.initialize()
+        LM = ap.fit.LM(MODEL, max_iter=20).fit()
+
+        for sampler in (ap.fit.Native_HMC, ap.fit.Native_NUTS):
+            with self.subTest(sampler=sampler.__name__):
+                fitter = sampler(
+                    MODEL, inv_mass=LM, max_iter=20, warmup=20, leapfrog_steps=5, progress_bar=False
+                )
+                fitter.fit()
+                self.assertEqual(fitter.chain.shape, (20, 7))
+                self.assertTrue(np.all(np.isfinite(fitter.chain)), "chain should be finite")
+                self.assertGreater(
+                    fitter.acceptance, 0.3, "mass matrix from LM should give a high acceptance"
+                )
+                self.assertGreater(
+                    fitter.gradient_evaluations, 40, "every step should evaluate the gradient"
+                )
+
+    def test_native_potential(self):
+        np.random.seed(12345)
+        torch.manual_seed(12345)
+        tar = make_basic_sersic(N=51, M=51)
+        single = ap.models.Sersic_Galaxy(name="single", target=tar, integrate_mode="none")
+        single.initialize()
+        models = [
+            ap.models.Sersic_Galaxy(
+                name="first",
+                target=tar,
+                window=[[0, 30], [0, 30]],
+                parameters={"center": [12, 12], "PA": 0, "q": 0.5, "n": 2, "Re": 5, "Ie": 1},
+            ),
+            ap.models.Sersic_Galaxy(
+                name="second",
+                target=tar,
+                window=[[20, 51], [20, 51]],
+                parameters={
+                    "center": [35, 35],
+                    "PA": 1,
+                    "q": 0.7,
+                    "n": {"value": 3, "locked": True},
+                    "Re": 4,
+                    "Ie": 1,
+                },
+            ),
+        ]
+        group = ap.models.AstroPhot_Model(
+            name="group model", model_type="group model", models=models, target=tar
+        )
+        group.initialize()
+
+        for model in (single, group):
+            with self.subTest(model=model.name):
+                fitter = ap.fit.Native_HMC(model, progress_bar=False)
+                initial = model.parameters.vector_values().detach().clone()
+                state = fitter.current_state + 0.01
+                U, grad = fitter.potential(state)
+                self.assertIsNotNone(fitter._plan, "model should be evaluated without the DAG")
+                self.assertTrue(
+                    torch.all(model.parameters.vector_values() == initial),
+                    "potential should not change the parameters",
+                )
+
+                vector = state.clone().requires_grad_(True)
+                nll = model.negative_log_likelihood(parameters=vector, as_representation=True)
+                nll.backward()
+                self.assertTrue(
+                    torch.allclose(U, nll.detach()), "potential should match likelihood"
+                )
+                self.assertTrue(
+                    torch.allclose(grad, vector.grad), "gradient should match likelihood"
+                )
+
+
+class TestLaplace(unittest.TestCase):
+    def test_laplace_blocks(self):
+        np.random.seed(12345)
+        torch.manual_seed(12345)
+        tar = make_basic_sersic(N=51, M=51)
+        models = [
+            ap.models.Sersic_Galaxy(
+                name="isolated",
+                target=tar,
+                window=[[28, 51], [28, 51]],
+                parameters={"center": [38, 38], "PA": 1, "q": 0.7, "n": 3, "Re": 4, "Ie": 1},
+            ),
+            ap.models.Sersic_Galaxy(
+                name="overlap 1",
+                target=tar,
+                window=[[0, 22], [0, 22]],
+                parameters={"center": [10, 10], "PA": 0, "q": 0.5, "n": 2, "Re": 5, "Ie": 1},
+            ),
+            ap.models.Sersic_Galaxy(
+                name="overlap 2",
+                target=tar,
+                window=[[20, 51], [0, 20]],
+                parameters={"center": [35, 10], "PA": 1, "q": 0.7, "n": 3, "Re": 4, "Ie": 1},
+            ),
+        ]
+        smod = ap.models.AstroPhot_Model(
+            name="group model", model_type="group model", models=models, target=tar
+        )
+        smod.initialize()
+        laplace = ap.fit.Laplace(smod, max_iter=5).fit()
+        self.assertEqual(
+            sorted(len(index) for index, _ in laplace.cholesky),
+            [7, 14],
+            "models which share no pixels should be factorized separately",
+        )
+
+        LM = ap.fit.LM(smod, initial_state=laplace.current_state, max_iter=0)
+        self.assertTrue(
+            torch.allclose(laplace.marginal_variance(), torch.diag(LM.covariance_matrix)),
+            "marginal variance should match the inverse hessian",
+        )
+        self.assertTrue(torch.allclose(laplace.covariance_matrix, LM.covariance_matrix))
+
+        samples = laplace.sample(2000, batch_size=700)
+        self.assertEqual(samples.shape, (2000, 21))
+        self.assertTrue(
+            torch.allclose(torch.var(samples, dim=0), laplace.marginal_variance(), rtol=0.2),
+            "sample variance should match the marginal variance",
+        )
+
+        state = smod.parameters.vector_values().detach().clone()
+        mags = laplace.propagate(lambda m: m.models["isolated"].total_magnitude(), 20)
+        self.assertEqual(mags.shape, (20,))
+        self.assertTrue(torch.all(torch.isfinite(mags)))
+        self.assertTrue(
+            torch.allclose(smod.parameters.vector_values(), state),
+            "model should be returned to the best fit",
+        )
+
+
 class TestMHMCMC(unittest.TestCase):
     def test_singlesersic(self):
         np.random.seed(12345)
@@ -571,5 +944,127 @@ class TestMHMCMC(unittest.TestCase):
         )
 
 
+class TestEnsemble(unittest.TestCase):
+    def test_singlesersic(self):
+        np.random.seed(12345)
+        torch.manual_seed(12345)
+        target = make_basic_sersic(N=20, M=20)
+        MODEL = ap.models.Sersic_Galaxy(name="sersic model", target=target)
+        ap.fit.LM(MODEL, max_iter=10).fit()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            chain_file = os.path.join(tmpdir, "test_ensemble_chain.npy")
+            sampler = ap.fit.Ensemble(
+                MODEL,
+                max_iter=40,
+                check_every=20,
+                progress_bar=False,
+                chain_file=chain_file,
+            )
+            sampler.fit()
+
+            self.assertEqual(
+                sampler.chain.shape, (40, sampler.nwalkers, 7), "chain should record every walker"
+            )
+            self.assertTrue(np.all(np.isfinite(sampler.chain)), "chain should be finite")
+            self.assertTrue(
+                np.allclose(np.load(chain_file), sampler.chain),
+                "chain should be written to the memory mapped file",
+            )
+            self.assertGreater(
+                np.mean(sampler.acceptance),
+                0.1,
+                "Ensemble should have nonzero acceptance for simple fits",
+            )
+            self.assertEqual(len(sampler.effective_sample_size()), 7)
+            del sampler
+
+    def test_early_stop_chain_file(self):
+        np.random.seed(12345)
+        torch.manual_seed(12345)
+        target = make_basic_sersic(N=20, M=20)
+        MODEL = ap.models.Sersic_Galaxy(name="sersic model", target=target)
+        ap.fit.LM(MODEL, max_iter=10).fit()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            chain_file = os.path.join(tmpdir, "test_ensemble_chain.npy")
+            sampler = ap.fit.Ensemble(
+                MODEL,
+                max_iter=1000,
+                check_every=20,
+                tau_factor=1,
+                tau_tolerance=1e6,
+                progress_bar=False,
+                chain_file=chain_file,
+            )
+            sampler.fit()
+
+            self.assertEqual(sampler.nsteps, 40, "sampler should stop at the second check")
+            self.assertTrue(sampler.message.startswith("success"))
+            saved = np.load(chain_file)
+            self.assertEqual(
+                saved.shape, (40, sampler.nwalkers, 7), "file should only hold the recorded steps"
+            )
+            self.assertTrue(np.allclose(saved, sampler.chain), "file should hold the chain")
+            self.assertFalse(np.any(np.all(saved == 0, axis=(1, 2))), "no step should be empty")
+            self.assertEqual(os.listdir(tmpdir), ["test_ensemble_chain.npy"])
+            del sampler, saved
+
+    def test_autocorrelation_time(self):
+        rng = np.random.default_rng(12345)
+        chain = np.zeros((200, 4, 3))
+        chain[:, :, 0] = rng.normal(size=(200, 4))
+        # Anti-correlated chain
+        chain[:, :, 1] = np.where(np.arange(200) % 2 == 0, 1.0, -1.0)[:, None] + 0.01 * rng.normal(
+            size=(200, 4)
+        )
+        # Parameter which never moves
+        chain[:, :, 2] = 1.0
+        tau = ap.fit.Ensemble.autocorrelation_time(chain)
+        self.assertAlmostEqual(tau[0], 1.0, delta=0.3, msg="independent samples have tau near 1")
+        self.assertGreater(tau[1], 0, "anti-correlated chains should not give negative tau")
+        self.assertTrue(np.isinf(tau[2]), "a constant parameter has no effective samples")
+
+
+class TestBatchFit(unittest.TestCase):
+    def test_batch_fit_resume(self):
+        import h5py
+
+        manifest = {
+            "defaults": {
+                "models": [{"name": "galaxy", "model_type": "sersic galaxy model"}],
+                "optimizer_kwargs": {"max_iter": 5},
+            },
+            "objects": [
+                {"name": "gal1", "target": make_basic_sersic(rand=1)},
+                {"name": "gal2", "target": make_basic_sersic(n=3, rand=2)},
+                {
+                    "name": "bad",
+                    "target": make_basic_sersic(rand=3),
+                    "models": [{"name": "galaxy", "model_type": "not a model"}],
+                },
+            ],
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, "test_batch_results.hdf5")
+            nfit = ap.batch_fit(manifest, output=output, resume=False)
+            self.assertEqual(nfit, 3, "all objects should be fit")
+
+            with h5py.File(output, "r") as F:
+                names = list(F["name"].asstr()[()])
+                messages = dict(zip(names, F["message"].asstr()[()]))
+                self.assertEqual(sorted(names), ["bad", "gal1", "gal2"])
+                self.assertTrue(messages["bad"].startswith("fail"), "bad model should be reported")
+                n = F["parameters/galaxy/n"][()]
+                self.assertTrue(
+                    np.isfinite(n[names.index("gal2")]), "parameters should be recorded"
+                )
+                self.assertTrue(np.isnan(n[names.index("bad")]), "failed fit has no parameters")
+
+            # Objects already in the output are skipped
+            nfit = ap.batch_fit(manifest, output=output, resume=True)
+            self.assertEqual(nfit, 0, "completed objects should not be refit")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -110,6 +110,180 @@ class TestGroup(unittest.TestCase):
         for fmi in fm:
             self.assertTrue(torch.sum(fmi).item() == 0, "this fit_mask should not mask any pixels")
 
+    def test_groupmodel_value_and_jacobian(self):
+        np.random.seed(12345)
+        tar = make_basic_sersic(N=51, M=61)
+        mod1 = ap.models.AstroPhot_Model(
+            name="base model 1",
+            model_type="sersic galaxy model",
+            target=tar,
+            window=[[0, 30], [0, 30]],
+            parameters={"center": [10, 10], "PA": 0, "q": 0.5, "n": 2, "Re": 5, "Ie": 1},
+        )
+        mod2 = ap.models.AstroPhot_Model(
+            name="base model 2",
+            model_type="sersic galaxy model",
+            target=tar,
+            window=[[20, 61], [15, 51]],
+            parameters={"center": [35, 30], "PA": 1, "q": 0.7, "n": 3, "Re": 4, "Ie": 1},
+            jacobian_chunksize=3,
+        )
+        smod = ap.models.AstroPhot_Model(
+            name="group model",
+            model_type="group model",
+            models=[mod1, mod2],
+            target=tar,
+        )
+
+        for model in (mod1, mod2, smod):
+            value, jac = model.value_and_jacobian()
+            self.assertTrue(
+                torch.allclose(value.data, model().data),
+                "value_and_jacobian should return the sampled model",
+            )
+            self.assertTrue(
+                torch.allclose(jac.data, model.jacobian().data),
+                "value_and_jacobian should return the jacobian",
+            )
+
+    def test_groupmodel_batch_sample(self):
+        np.random.seed(12345)
+        tar = make_basic_sersic(N=51, M=61)
+        models = []
+        for i in range(5):
+            models.append(
+                ap.models.AstroPhot_Model(
+                    name=f"batch model {i}",
+                    model_type="sersic galaxy model",
+                    target=tar,
+                    window=[[5 * i, 25 + 7 * i], [3 * i, 30]],
+                    parameters={
+                        "center": [8 + 4 * i, 12 + i],
+                        "PA": 0.3 * i,
+                        "q": 0.5 + 0.05 * i,
+                        "n": 1 + 0.4 * i,
+                        "Re": 3 + i,
+                        "Ie": 0.2 * i,
+                    },
+                )
+            )
+        # a model which is not batched with the others
+        models.append(
+            ap.models.AstroPhot_Model(
+                name="other model",
+                model_type="gaussian galaxy model",
+                target=tar,
+                parameters={"center": [30, 25], "PA": 1, "q": 0.7, "sigma": 4, "flux": 1},
+            )
+        )
+        smod = ap.models.AstroPhot_Model(
+            name="group model",
+            model_type="group model",
+            models=models,
+            target=tar,
+        )
+
+        for psf_mode in ("none", "full"):
+            smod.psf_mode = psf_mode
+            smod.batch_sample = True
+            batch_img = smod().data
+            smod.batch_sample = False
+            single_img = smod().data
+            self.assertTrue(
+                torch.allclose(batch_img, single_img),
+                f"batched sampling should match sampling each model, psf_mode: {psf_mode}",
+            )
+        self.assertEqual(len(smod._batch_failed), 0, "sersic models should sample as a batch")
+
+        # several parameter vectors at once
+        smod.batch_sample = True
+        state = smod.parameters.vector_values().detach().clone()
+        vectors = torch.stack((state, state * 1.01, state * 0.99))
+        images = smod.sample_vectors(vectors)
+        self.assertTrue(torch.all(smod.parameters.vector_values() == state))
+        for image, vector in zip(images, vectors):
+            self.assertTrue(
+                torch.allclose(image, smod(parameters=vector).data),
+                "vector sample should match sampling each vector",
+            )
+
+    def test_groupmodel_vector_gradients(self):
+        tar = make_basic_sersic(N=31, M=31)
+        sersics = list(
+            ap.models.AstroPhot_Model(
+                name=f"gradient model {i}",
+                model_type="sersic galaxy model",
+                target=tar,
+                parameters={
+                    "center": [8 + 6 * i, 10 + 5 * i],
+                    "PA": 0.3 * i,
+                    "q": 0.6,
+                    "n": 2,
+                    "Re": 3,
+                    "Ie": 0.5,
+                },
+            )
+            for i in range(3)
+        )
+        sky = [ap.models.AstroPhot_Model(name="sky", model_type="flat sky model", target=tar)]
+        for name, models in (("sersics", sersics), ("sky", sky)):
+            with self.subTest(group=name):
+                smod = ap.models.AstroPhot_Model(
+                    name=f"{name} group", model_type="group model", models=models, target=tar
+                )
+                smod.initialize()
+                state = smod.parameters.vector_representation().detach().clone()
+                vectors = torch.stack((state, state * 1.01, state * 0.99)).requires_grad_(True)
+                smod.negative_log_likelihood_vectors(
+                    vectors, as_representation=True
+                ).sum().backward()
+
+                for vector, grad in zip(vectors.detach(), vectors.grad):
+                    vector = vector.clone().requires_grad_(True)
+                    smod.negative_log_likelihood(
+                        parameters=vector, as_representation=True
+                    ).backward()
+                    self.assertTrue(
+                        torch.allclose(grad, vector.grad),
+                        "gradient through the vector likelihood should match each vector",
+                    )
+
+    def test_groupmodel_parallel_initialize(self):
+        target = make_basic_sersic(N=60, M=60)
+
+        def make_group():
+            model_list = []
+            for i, (x, y) in enumerate([(12, 12), (48, 12), (12, 48), (30, 30)]):
+                model_list.append(
+                    ap.models.AstroPhot_Model(
+                        name=f"sersic {i}",
+                        model_type="sersic galaxy model",
+                        parameters={"center": [0.8 * x, 0.8 * y], "PA": 1.0, "q": 0.6},
+                        window=[[x - 8, x + 8], [y - 8, y + 8]],
+                        target=target,
+                        initialize_uncertainty="hessian",
+                    )
+                )
+            return ap.models.AstroPhot_Model(
+                name="model", model_type="group model", target=target, models=model_list
+            )
+
+        sequential = make_group()
+        sequential.initialize()
+        parallel = make_group()
+        self.assertEqual(len(parallel.independent_sets()), 1, "models do not overlap")
+        parallel.initialize(workers=2)
+
+        for name in sequential.models:
+            for param in ["n", "Re", "Ie"]:
+                P1 = sequential.models[name][param]
+                P2 = parallel.models[name][param]
+                self.assertTrue(
+                    torch.allclose(P1.value, P2.value), "parallel init should match sequential"
+                )
+                self.assertTrue(torch.allclose(P1.uncertainty, P2.uncertainty))
+                self.assertTrue(torch.all(torch.isfinite(P1.uncertainty)))
+
     def test_groupmodel_saveload(self):
         np.random.seed(12345)
         tar = make_basic_sersic(N=51, M=51)
@@ -114,6 +114,300 @@ class TestModel(unittest.TestCase):
         model.psf_convolve_mode = "fft"
         res = model()
 
+    def test_psf_window(self):
+        target = make_basic_sersic(80, 90)
+        model = ap.models.AstroPhot_Model(
+            name="test window",
+            model_type="sersic galaxy model",
+            parameters={"center": [30.3, 28.6], "q": 0.6, "PA": 1.0, "n": 3, "Re": 5, "Ie": 1},
+            target=target,
+            psf_mode="full",
+        )
+        full_img, full_jac = model.value_and_jacobian()
+        full_img = full_img.data
+        full_jac = full_jac.data
+
+        # A core covering the whole window is the full convolution
+        model.psf_mode = "window"
+        model.psf_window_radius = 100
+        self.assertTrue(torch.allclose(model().data, full_img))
+
+        # A small core only changes the model near the edge of the core
+        model.psf_window_radius = 4
+        core = model()
+        self.assertFalse(torch.allclose(core.data, full_img))
+        self.assertAlmostEqual(
+            core.data.sum().item(), full_img.sum().item(), delta=5e-2 * full_img.sum().item()
+        )
+        center = core.plane_to_pixel(model["center"].value).int().tolist()
+        self.assertAlmostEqual(
+            core.data[center[1], center[0]].item(), full_img[center[1], center[0]].item()
+        )
+
+        # The selected core keeps the model within the tolerance
+        model.psf_window_radius = None
+        window_img, window_jac = model.value_and_jacobian()
+        self.assertTrue(
+            torch.allclose(window_img.data, full_img, rtol=0, atol=1e-3 * full_img.max()),
+            "windowed convolution should match full convolution",
+        )
+        self.assertTrue(
+            torch.all(
+                torch.amax(torch.abs(window_jac.data - full_jac), dim=(0, 1))
+                < 0.05 * torch.amax(torch.abs(full_jac), dim=(0, 1))
+            ),
+            "windowed convolution jacobian should match full convolution",
+        )
+        (row_start, row_stop), (col_start, col_stop) = model._psf_window(
+            core, full_img, target.psf, model.parameters
+        )
+        self.assertLess((row_stop - row_start) * (col_stop - col_start), full_img.numel())
+
+    def test_psf_window_subpixel_shift(self):
+        # Extended model centered on a pixel edge, so the default bilinear shift moves it half a pixel
+        target = ap.image.Target_Image(
+            data=np.zeros((120, 120)),
+            pixelscale=1.0,
+            variance=np.ones((120, 120)),
+            psf=ap.utils.initialize.gaussian_psf(1.5, 11, 1.0),
+        )
+        models = {}
+        for psf_mode in ("full", "window"):
+            models[psf_mode] = ap.models.AstroPhot_Model(
+                name=f"test {psf_mode}",
+                model_type="sersic galaxy model",
+                parameters={"center": [60.0, 60.0], "q": 0.7, "PA": 1.0, "n": 2, "Re": 25, "Ie": 1},
+                target=target,
+                psf_mode=psf_mode,
+            )
+        full = models["full"]().data
+        window = models["window"]().data
+        self.assertTrue(
+            torch.allclose(window, full, rtol=0, atol=1e-4 * full.max()),
+            "windowed convolution should match full convolution",
+        )
+        self.assertLess(
+            torch.max(torch.abs(window - full)[:20, :20] / full[:20, :20]).item(),
+            5e-3,
+            "passed through pixels should be moved back onto the pixel grid",
+        )
+
+    def test_integrate_cache(self):
+        target = make_basic_sersic(60, 60)
+        model = ap.models.AstroPhot_Model(
+            name="test sersic",
+            model_type="sersic galaxy model",
+            parameters={
+                "center": [20, 20],
+                "PA": 60 * np.pi / 180,
+                "q": 0.5,
+                "n": 3,
+                "Re": 3,
+                "Ie": 1,
+            },
+            target=target,
+        )
+        model.integrate_cache_tolerance = None
+        full = model().data
+        model.integrate_cache_tolerance = 1e-3
+        model()
+        plan = model._integrate_cache["plan"]
+        self.assertTrue(torch.allclose(model().data, full), "cached plan should give same model")
+        self.assertIs(plan, model._integrate_cache["plan"], "plan should be reused")
+
+        # Small parameter changes reuse the plan, large changes rebuild it
+        with ap.param.Param_Unlock(model["Re"]):
+            model["Re"].value = 3.001
+        model()
+        self.assertIs(plan, model._integrate_cache["plan"], "plan should be reused")
+        with ap.param.Param_Unlock(model["Re"]):
+            model["Re"].value = 4.0
+        model()
+        self.assertIsNot(plan, model._integrate_cache["plan"], "plan should be rebuilt")
+
+    def test_integrate_stencil(self):
+        target = make_basic_sersic(60, 60)
+        X, Y = target.get_coordinate_meshgrid() - 20.0
+
+        def brightness(X, Y, image=None, parameters=None):
+            return torch.exp(-0.5 * (X**2 + 4 * Y**2) / 3**2)
+
+        kwargs = dict(
+            image_header=target.header,
+            eval_brightness=brightness,
+            eval_parameters=None,
+            dtype=ap.AP_config.ap_dtype,
+            device=ap.AP_config.ap_device,
+            quad_level=3,
+            gridding=3,
+            max_depth=3,
+            reference=1e-6,
+        )
+        recursive = ap.utils.operations.grid_integrate(X.flatten(), Y.flatten(), **kwargs)
+        stencil = ap.utils.operations.stencil_integrate(X.flatten(), Y.flatten(), **kwargs)
+        self.assertTrue(
+            torch.allclose(recursive, stencil),
+            "stencil integration should match recursive integration",
+        )
+
+        # The stencil mode shares the integration plan cache
+        model = ap.models.AstroPhot_Model(
+            name="test sersic",
+            model_type="sersic galaxy model",
+            parameters={
+                "center": [20, 20],
+                "PA": 60 * np.pi / 180,
+                "q": 0.5,
+                "n": 3,
+                "Re": 3,
+                "Ie": 1,
+            },
+            target=target,
+            integrate_mode="stencil",
+            integrate_max_depth=3,
+        )
+        first = model().data
+        plan = model._integrate_cache["plan"]
+        self.assertGreater(len(plan), 1, "some pixels should be refined")
+        second = model().data
+        self.assertIs(plan, model._integrate_cache["plan"], "plan should be reused")
+        self.assertTrue(torch.allclose(first, second), "plan should give the same pixels")
+
+    def test_compiled_evaluation(self):
+        ap.utils.operations.compile_cache.clear()
+        target = make_basic_sersic(40, 50)
+        model = ap.models.AstroPhot_Model(
+            name="test sersic",
+            model_type="sersic galaxy model",
+            parameters={
+                "center": [20, 20],
+                "PA": 60 * np.pi / 180,
+                "q": 0.5,
+                "n": 2,
+                "Re": 5,
+                "Ie": 1,
+            },
+            target=target,
+        )
+        eager = model().data
+        eager_jac = model.jacobian().data
+        model.compile_mode = "default"
+        model.compile_backend = "eager"
+        compiled = model().data
+        self.assertTrue(
+            torch.allclose(eager, compiled), "compiled evaluation should match eager evaluation"
+        )
+        self.assertTrue(
+            torch.allclose(eager_jac, model.jacobian().data),
+            "jacobian should be unaffected by compiled evaluation",
+        )
+        report = ap.utils.operations.compile_cache.report()
+        self.assertGreater(len(report), 0, "compiled evaluations should be recorded")
+        for row in report:
+            self.assertFalse(row["failed"], "eager backend should always compile")
+            self.assertIsNotNone(row["compile_time"])
+        ap.utils.operations.compile_cache.clear()
+
+    def test_analytic_jacobian(self):
+        target = make_basic_sersic(40, 50)
+        for model_type, parameters in (
+            ("sersic galaxy model", {"n": 2.3, "Re": 6, "Ie": 1}),
+            ("moffat galaxy model", {"n": 2, "Rd": 4, "I0": 1}),
+            ("nuker galaxy model", {"Rb": 5, "Ib": 1, "alpha": 1.7, "beta": 2.5, "gamma": 0.4}),
+        ):
+            parameters.update({"center": [20.3, 19.6], "q": 0.6, "PA": 1.0})
+            model = ap.models.AstroPhot_Model(
+                name="test analytic",
+                model_type=model_type,
+                parameters=parameters,
+                target=target,
+                psf_mode="full",
+            )
+            autodiff = model.jacobian().data
+            model.jacobian_mode = "analytic"
+            analytic = model.jacobian().data
+            self.assertTrue(
+                torch.allclose(autodiff, analytic),
+                f"analytic jacobian should match autodiff for {model_type}",
+            )
+            self.assertTrue(
+                torch.allclose(model().data, model.value_and_jacobian()[0].data),
+                "analytic jacobian should not change the model image",
+            )
+
+    def test_mixed_precision(self):
+        target = make_basic_sersic(40, 50)
+        model = ap.models.AstroPhot_Model(
+            name="test mixed",
+            model_type="sersic galaxy model",
+            parameters={"center": [20.3, 19.6], "q": 0.6, "PA": 1.0, "n": 2.3, "Re": 6, "Ie": 1},
+            target=target,
+            psf_mode="full",
+        )
+        full_img, full_jac = model.value_and_jacobian()
+        model.precision_mode = "mixed"
+        self.assertEqual(model._precision_dtype(), torch.float32)
+        mixed_img, mixed_jac = model.value_and_jacobian()
+        self.assertEqual(mixed_img.data.dtype, ap.AP_config.ap_dtype)
+        self.assertEqual(mixed_jac.data.dtype, ap.AP_config.ap_dtype)
+        self.assertFalse(torch.equal(full_img.data, mixed_img.data), "should evaluate in float32")
+        self.assertTrue(
+            torch.allclose(full_img.data, mixed_img.data, rtol=0, atol=1e-5 * full_img.data.max()),
+            "mixed precision model should match the full precision model",
+        )
+        scale = torch.amax(torch.abs(full_jac.data), dim=(0, 1))
+        self.assertTrue(
+            torch.all(
+                torch.amax(torch.abs(full_jac.data - mixed_jac.data), dim=(0, 1)) < 1e-4 * scale
+            ),
+            "mixed precision jacobian should match the full precision jacobian",
+        )
+
+        # The model setting overrides the global precision mode
+        mixed_img = model().data
+        model.precision_mode = "full"
+        full_img = model().data
+        model.precision_mode = None
+        ap.AP_config.ap_precision_mode = "mixed"
+        try:
+            self.assertTrue(torch.equal(model().data, mixed_img))
+            model.precision_mode = "full"
+            self.assertTrue(torch.equal(model().data, full_img))
+        finally:
+            ap.AP_config.ap_precision_mode = "full"
+
+    def test_sample_vectors(self):
+        target = make_basic_sersic(30, 36)
+        model = ap.models.AstroPhot_Model(
+            name="test vectors",
+            model_type="sersic galaxy model",
+            parameters={"center": [12.3, 14.6], "q": 0.6, "PA": 1.0, "n": 2.3, "Re": 6, "Ie": 1},
+            target=target,
+        )
+        state = model.parameters.vector_representation().detach().clone()
+        vectors = state + 0.05 * torch.randn(
+            (5, len(state)), dtype=ap.AP_config.ap_dtype, device=ap.AP_config.ap_device
+        )
+        images = model.sample_vectors(vectors, as_representation=True, batch_size=2)
+        nll = model.negative_log_likelihood_vectors(vectors, as_representation=True)
+        self.assertEqual(images.shape, (5,) + tuple(model().data.shape))
+        self.assertTrue(
+            torch.all(model.parameters.vector_representation() == state),
+            "sampling vectors should not change the model parameters",
+        )
+        self.assertFalse(model._batch_failed, "sersic model should sample as a batch")
+        for i, vector in enumerate(vectors):
+            self.assertTrue(
+                torch.allclose(images[i], model(parameters=vector, as_representation=True).data),
+                "vector sample should match sampling each vector",
+            )
+            self.assertTrue(
+                torch.allclose(
+                    nll[i], model.negative_log_likelihood(vector, as_representation=True)
+                ),
+                "vector likelihood should match the likelihood of each vector",
+            )
+
     def test_model_creation(self):
         np.random.seed(12345)
         shape = (10, 15)
@@ -417,6 +417,48 @@ class TestParameterVector(unittest.TestCase):
             )
             self.assertEqual(PG.vector_values().numel(), 5, "masked values shouldn't be shown")
 
+    def test_vector_layout(self):
+        P1 = Parameter_Node("test1", value=0.5, limits=(-1, 1))
+        P2 = Parameter_Node("test2", value=[1.0, 2.0], limits=(0.0, None))
+        P3 = Parameter_Node("test3", value=3.0, limits=(None, 5.0))
+        P4 = Parameter_Node("test4", value=1.0, limits=(0, np.pi), cyclic=True)
+        P5 = Parameter_Node("test5", value=-2.0)
+        leaves = (P1, P2, P3, P4, P5)
+        PG = Parameter_Node("testgroup", link=leaves)
+
+        # The vectorized transforms should match the per leaf transforms
+        rep = PG.vector_representation()
+        leaf_rep = torch.cat(
+            tuple(P.vector_transform_val_to_rep(P.vector_values()) for P in leaves)
+        )
+        self.assertTrue(torch.allclose(rep, leaf_rep), "layout transform should match leaves")
+        rep = rep + 0.3
+        PG.vector_set_representation(rep)
+        leaf_val = torch.cat(
+            tuple(
+                P.vector_transform_rep_to_val(r)
+                for P, r in zip(leaves, torch.split(rep, (1, 2, 1, 1, 1)))
+            )
+        )
+        self.assertTrue(
+            torch.allclose(PG.vector_values(), leaf_val), "layout transform should match leaves"
+        )
+
+        # The layout is reused until the DAG structure changes
+        layout = PG.layout
+        PG.vector_set_values(PG.vector_values() * 0.9)
+        self.assertIs(layout, PG.layout, "setting values should not rebuild the layout")
+        P2.locked = True
+        self.assertEqual(PG.size, 4, "locking should update the layout")
+        P2.locked = False
+        PG.link(Parameter_Node("test6", value=7.0))
+        self.assertEqual(PG.size, 7, "linking should update the layout")
+        with Param_Mask(
+            PG, torch.tensor([1, 0, 1, 1, 1, 1, 1], dtype=torch.bool, device=P1.value.device)
+        ):
+            self.assertEqual(PG.size, 6, "masking should update the layout")
+        self.assertEqual(PG.size, 7, "unmasking should update the layout")
+
     def test_printing(self):
 
         def node_func_sqr(P):
@@ -5,7 +5,7 @@ import h5py
 from scipy.signal import fftconvolve
 from scipy.special import gamma
 import astrophot as ap
-from utils import make_basic_sersic, make_basic_gaussian
+from utils import make_basic_sersic, make_basic_gaussian, make_basic_gaussian_psf
 
 ######################################################################
 # Util functions
@@ -50,6 +50,98 @@ class TestFFT(unittest.TestCase):
             "Convolved image should be smoothed",
         )
 
+    def test_psf_fft_cache(self):
+
+        target = make_basic_sersic()
+        model = ap.models.AstroPhot_Model(
+            name="cached psf sersic",
+            model_type="sersic galaxy model",
+            target=target,
+            psf_mode="full",
+            psf_subpixel_shift="none",
+            parameters={
+                "center": [20, 20],
+                "PA": 60 * np.pi / 180,
+                "q": 0.5,
+                "n": 2,
+                "Re": 5,
+                "Ie": 1,
+            },
+        )
+        cache = ap.utils.operations.psf_fft_cache
+        cache.clear()
+
+        first = model().data
+        hits = cache.hits
+        second = model().data
+        self.assertGreater(cache.hits, hits, "Repeated sampling should reuse the psf fft")
+        self.assertTrue(torch.allclose(first, second), "Cached psf should give the same model")
+
+        cache.enabled = False
+        try:
+            uncached = model().data
+        finally:
+            cache.enabled = True
+        self.assertTrue(torch.allclose(first, uncached), "Cache should not change the model")
+
+        # Subpixel shifted kernels reuse the cached transform of the unshifted psf
+        shifted = ap.models.AstroPhot_Model(
+            name="shifted psf sersic",
+            model_type="sersic galaxy model",
+            target=target,
+            psf_mode="full",
+            parameters={
+                "center": [20.3, 19.6],
+                "PA": 60 * np.pi / 180,
+                "q": 0.5,
+                "n": 2,
+                "Re": 5,
+                "Ie": 1,
+            },
+        )
+        shifted.initialize()
+        cache.clear()
+        ap.fit.LM(shifted, max_iter=10).fit()
+        self.assertGreater(cache.hits, 0, "Fitting should reuse the psf fft")
+        self.assertLessEqual(len(cache), 2, "Shifted psf kernels should not fill the cache")
+
+        fft = shifted().data
+        shifted.psf_convolve_mode = "direct"
+        direct = shifted().data
+        self.assertTrue(
+            torch.allclose(fft, direct, atol=1e-6 * torch.max(direct).item()),
+            "Shift in Fourier space should match shifting the psf",
+        )
+
+        # Point sources shift the cached normalized psf
+        point = ap.models.AstroPhot_Model(
+            name="cached point source",
+            model_type="point model",
+            target=target,
+            psf=make_basic_gaussian_psf(N=25),
+            parameters={"center": [20.3, 19.6], "flux": 1},
+        )
+        cache.clear()
+        point()
+        point()
+        self.assertGreater(cache.hits, 0, "Point sources should reuse the normalized psf")
+
+    def test_fft_cache_eviction(self):
+
+        cache = ap.utils.operations.FFT_Cache(max_bytes=3 * 8 * 10)
+        sources = list(torch.ones(10, dtype=torch.float64) * i for i in range(5))
+        for source in sources:
+            cache.get(cache.make_key(source), source, lambda: source.clone())
+        self.assertEqual(len(cache), 3, "Cache should evict to stay within its byte budget")
+        self.assertLessEqual(cache.nbytes, 3 * 8 * 10)
+
+        # Most recent entry is retained while an in-place change invalidates it
+        cache.get(cache.make_key(sources[-1]), sources[-1], lambda: None)
+        self.assertEqual(cache.hits, 1)
+        sources[-1] *= 2
+        cache.get(cache.make_key(sources[-1]), sources[-1], lambda: sources[-1].clone())
+        self.assertEqual(cache.hits, 1)
+
 
 class TestOptimize(unittest.TestCase):
     def test_chi2(self):
@@ -207,6 +299,32 @@ class TestSegtoWindow(unittest.TestCase):
             windows[3], [[80, 84], [26, 33]], "Original windows should not have changed"
         )
 
+    def test_segmentation_statistics(self):
+        segmap = np.zeros((100, 100), dtype=int)
+        segmap[5:9, 20:30] = 1
+        segmap[50:90, 17:35] = 2
+        segmap[26:34, 80:85] = 7
+        image = np.random.uniform(1, 2, size=segmap.shape)
+
+        stats = ap.utils.initialize.segmentation_map_statistics(segmap, image)
+        self.assertEqual(list(stats["index"]), [1, 2, 7], "should find all non zero segments")
+        self.assertEqual(list(stats["npix"]), [40, 720, 40], "should count segment pixels")
+        self.assertTrue(np.allclose(stats["flux"][1], np.sum(image[50:90, 17:35])))
+        self.assertEqual(stats["window"][2].tolist(), [[80, 84], [26, 33]])
+        YY, XX = np.indices(segmap.shape)
+        N = segmap == 2
+        self.assertTrue(
+            np.allclose(
+                stats["centroid"][1],
+                [
+                    np.sum(XX[N] * image[N]) / np.sum(image[N]),
+                    np.sum(YY[N] * image[N]) / np.sum(image[N]),
+                ],
+            ),
+            "centroid should be light weighted",
+        )
+        self.assertTrue(stats["q"][1] < 1, "elongated segment should have q < 1")
+
 
 class TestConversions(unittest.TestCase):
     def test_conversions_units(self):
@@ -447,6 +565,38 @@ class TestInterpolate(unittest.TestCase):
             msg="Lanczos interpolate returning nonfinite values",
         )
 
+    def test_interpolate_lanczos_points(self):
+        model = make_basic_gaussian(x=10.0, y=10.0).data.detach().cpu().numpy()
+        X = np.array([10.3, 0.2, model.shape[1] - 1.5])
+        Y = np.array([9.7, 5.5, model.shape[0] - 1.2])
+        flux = ap.utils.interpolate.interpolate_Lanczos(model, X, Y, 3)
+        # Reference without vectorization, taps outside the image are dropped
+        for x, y, f in zip(X, Y, flux):
+            taps = np.arange(-2, 4)
+            ix, iy = int(np.floor(x)) + taps, int(np.floor(y)) + taps
+            Lx = np.sinc(taps - x + np.floor(x)) * np.sinc((taps - x + np.floor(x)) / 3)
+            Ly = np.sinc(taps - y + np.floor(y)) * np.sinc((taps - y + np.floor(y)) / 3)
+            kx = (ix >= 0) & (ix < model.shape[1])
+            ky = (iy >= 0) & (iy < model.shape[0])
+            L = np.outer(Ly[ky], Lx[kx])
+            ref = np.sum(model[iy[ky]][:, ix[kx]] * L) / np.sum(L)
+            self.assertAlmostEqual(f, ref, msg="vectorized lanczos should match pointwise")
+
+    def test_binned_percentiles(self):
+        from scipy.stats import binned_statistic, iqr
+
+        x = np.random.uniform(0, 10, 1000)
+        v = np.random.normal(size=1000)
+        bins = np.array([0, 1, 2, 5, 9.5, 10, 12])
+        low, med, high = ap.utils.operations.binned_percentiles(x, v, bins)
+        ref = binned_statistic(x, v, statistic="median", bins=bins)[0]
+        self.assertTrue(
+            np.allclose(med, ref, equal_nan=True), "median should match binned_statistic"
+        )
+        self.assertTrue(np.isnan(med[-1]), "empty bins should be nan")
+        ref = binned_statistic(x, v, statistic=lambda d: iqr(d, rng=[16, 84]), bins=bins)[0]
+        self.assertTrue(np.allclose(high - low, ref, equal_nan=True))
+
 
 class TestAngleOperations(unittest.TestCase):
     def test_angle_operation_functions(self):
@@ -482,5 +632,47 @@ class TestAngleOperations(unittest.TestCase):
         self.assertAlmostEqual(res + np.pi / 2, 115 * np.pi / 180, delta=0.1)
 
 
+class TestProfiling(unittest.TestCase):
+    def test_profile_fit(self):
+        target = make_basic_sersic()
+        new_model = ap.models.AstroPhot_Model(
+            name="profiled sersic",
+            model_type="sersic galaxy model",
+            target=target,
+            psf_mode="full",
+        )
+        profiler = ap.utils.profiling.profiler
+
+        # Nothing is recorded while the profiler is disabled
+        profiler.reset()
+        new_model.initialize()
+        new_model()
+        self.assertEqual(len(profiler.stats()), 0, "disabled profiler should not record")
+
+        with profiler.profile():
+            ap.fit.LM(new_model, max_iter=3).fit()
+        self.assertFalse(profiler.enabled, "profiler should be disabled after the block")
+
+        stages = dict(((row["owner"], row["stage"]), row) for row in profiler.stats())
+        for stage in ("sample", "sample_init", "sample_integrate", "sample_convolve", "torchjac"):
+            self.assertIn(("profiled sersic", stage), stages, f"missing {stage} stage")
+        self.assertIn(("LM", "linalg.solve"), stages, "missing LM solve stage")
+        self.assertGreaterEqual(stages[("LM", "step")]["calls"], 1)
+        self.assertLessEqual(
+            stages[("profiled sersic", "sample")]["self_time"],
+            stages[("profiled sersic", "sample")]["time"],
+        )
+        self.assertIn(("profiled sersic", "refined_pixels"), profiler.counters())
+        self.assertGreater(profiler.allocations()[("profiled sersic", "jacobian")]["bytes"], 0)
+
+        self.assertIn("linalg.solve", profiler.table())
+        trace = profiler.chrome_trace()
+        self.assertTrue(
+            all(event["ph"] in ("X", "C") for event in trace["traceEvents"]),
+            "trace events should be complete or counter events",
+        )
+        profiler.reset()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -84,6 +84,31 @@ class TestWindow(unittest.TestCase):
             "pad pixels should change shape",
         )
 
+    def test_window_chunk_pixels(self):
+
+        window1 = ap.image.Window(origin=(0, 6), pixel_shape=(250, 110))
+
+        area = 0
+        for subwindow, pixels in window1.chunk_pixels(100):
+            self.assertTrue(
+                np.all(subwindow.pixel_shape.detach().cpu().numpy() <= 100),
+                "chunks should be no larger than the chunksize",
+            )
+            area += (pixels[0][1] - pixels[0][0]) * (pixels[1][1] - pixels[1][0])
+        self.assertEqual(area, 250 * 110, "chunks should cover every pixel in the window")
+
+        for shape, chunksize in (((22, 23), 5), ((7, 100), 2), ((101, 99), 10)):
+            window = ap.image.Window(origin=(0, 0), pixel_shape=shape)
+            area = 0
+            largest = 0
+            for subwindow, pixels in window.chunk_pixels(chunksize):
+                sizes = (pixels[0][1] - pixels[0][0], pixels[1][1] - pixels[1][0])
+                self.assertGreater(min(sizes), 0, "chunks should not be empty")
+                largest = max(largest, *sizes)
+                area += sizes[0] * sizes[1]
+            self.assertLessEqual(largest, chunksize, "no chunk should exceed the chunksize")
+            self.assertEqual(area, shape[0] * shape[1], "chunks should cover every pixel")
+
     def test_window_get_indices(self):
 
         window1 = ap.image.Window(origin=(0, 6), pixel_shape=(100, 110))
@@ -407,6 +432,44 @@ class TestWindow(unittest.TestCase):
                 origin=[0.0, 1.0], origin_radec=[5.0, 6.0], pixel_shape=[10.0, 11.0]
             )
 
+    def test_window_grid_cache(self):
+        cache = ap.image.coordinate_grid_cache
+        cache.clear()
+        window = ap.image.Window(origin=[0.0, 1.0], pixel_shape=[10, 12], pixelscale=0.5)
+        grid = window.get_coordinate_meshgrid()
+        self.assertTrue(
+            torch.equal(grid, window._get_coordinate_meshgrid()),
+            "cached grid should match a freshly built grid",
+        )
+        self.assertIs(
+            window.copy().get_coordinate_meshgrid(),
+            grid,
+            "copies of a window should share a cached grid",
+        )
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+        # Changing the window geometry should give a new grid
+        window.shift(torch.tensor([1.0, 0.0], dtype=ap.AP_config.ap_dtype))
+        self.assertTrue(torch.allclose(window.get_coordinate_meshgrid()[0], grid[0] + 1))
+        window.pad_pixel((2,))
+        self.assertEqual(window.get_coordinate_meshgrid().shape, (2, 16, 14))
+        self.assertEqual(
+            window.get_coordinate_corner_meshgrid().shape,
+            (2, 17, 15),
+            "each kind of grid is cached separately",
+        )
+        self.assertEqual(cache.stats()["entries"], 4)
+        self.assertAlmostEqual(cache.hit_rate, 1 / 5)
+
+        cache.clear()
+
+        small = ap.image.Grid_Cache(max_bytes=3 * 16 * 14 * 8)
+        small.get(window, "center", window._get_coordinate_meshgrid)
+        small.get(window, "corner", window._get_coordinate_corner_meshgrid)
+        self.assertEqual(len(small), 1, "least recently used grid should be evicted")
+        self.assertLessEqual(small.nbytes, small.max_bytes, "cache should respect memory budget")
+
 
 if __name__ == "__main__":
     unittest.main()